@@ -0,0 +1,147 @@
+""" Run the pipeline for many configs at once, one worker process per config.
+
+  From the ./optimizely-fake-data directory
+
+    python ./src/batch.py -w 16 -m -s 'config/web/*.yaml'
+
+  Each worker builds its own database for its config, so configs never share state. Takes the same
+  options as main.py, minus -c. A summary of row counts and timings is printed per config.
+
+  Some configs share an experiment id, e.g. travel and travel_loser, so the files a run writes are
+  named after its config file instead. The journal and dead letter file default to
+  send_{config}.journal and send_{config}.dead.ndjson. --journal, --dead-letter, --report and
+  --prometheus must contain {config}, and --profile writes a directory per config.
+
+"""
+
+from main import add_arguments, config_name, run
+from multiprocessing import Pool, cpu_count
+
+import argparse
+import copy
+import glob
+import logging
+import os
+import time
+import traceback
+
+
+# Options naming a file each run writes, with their defaults in batch.py.
+OUTPUT_OPTIONS = (
+  ('journal',     'send_{config}.journal'),
+  ('dead_letter', 'send_{config}.dead.ndjson'),
+  ('report',      None),
+  ('prometheus',  None)
+)
+
+
+def find_configs(patterns):
+  """Expand globs, keep order and drop duplicates."""
+  configs = []
+
+  for pattern in patterns:
+    for config_path in sorted(glob.glob(pattern)) or [pattern]:
+      if config_path not in configs:
+        configs.append(config_path)
+
+  return configs
+
+
+def get_jobs(args):
+  """Arguments of every config's run, each writing files of its own."""
+  jobs = []
+
+  for config_path in find_configs(args.configs):
+    job_args        = copy.copy(args)
+    job_args.config = config_path
+
+    for name, default in OUTPUT_OPTIONS:
+      setattr(job_args, name, getattr(args, name) or default)
+
+    if args.profile:
+      job_args.profile = os.path.join(args.profile, config_name(config_path))
+
+    jobs.append(job_args)
+
+  return jobs
+
+
+def print_summary(summaries, elapsed):
+  stage_names = ['visitors', 'baseline_events', 'distributed_events', 'segments', 'merge', 'export', 'send']
+  header      = ['config'] + stage_names + ['seconds']
+
+  print '\t'.join(header)
+
+  for summary in summaries:
+    if 'error' in summary:
+      print '{}\tFAILED: {}'.format(summary['config'], summary['error'])
+      continue
+
+    stages  = dict((stage['name'], stage) for stage in summary['stages'])
+    columns = [summary['config']]
+
+    for name in stage_names:
+      columns.append('{rows} ({seconds:.1f}s)'.format(**stages[name]) if name in stages else '-')
+
+    columns.append('{:.1f}'.format(sum(stage['seconds'] for stage in summary['stages'])))
+
+    print '\t'.join(columns)
+
+  print 'Finished {} configs in {:.1f}s.'.format(len(summaries), elapsed)
+
+
+def run_config(args):
+  """Worker entry point. Errors are returned in the summary so one bad config doesn't stop the batch."""
+  try:
+    return run(args)
+  except (Exception, SystemExit):
+    logging.error('%s failed:\n%s', args.config, traceback.format_exc())
+    return {'config': args.config, 'error': traceback.format_exc().splitlines()[-1]}
+
+
+def main(args):
+  logging.basicConfig(level=logging.INFO)
+
+  jobs    = get_jobs(args)
+  started = time.time()
+
+  # One config per worker process, so each config's memory is returned when it finishes.
+  pool      = Pool(processes=args.workers, maxtasksperchild=1)
+  summaries = pool.map(run_config, jobs, chunksize=1)
+
+  pool.close()
+  pool.join()
+
+  print_summary(summaries, time.time() - started)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Generate and send fake data for many experiment configs in parallel.')
+
+  parser.add_argument('configs',
+                      nargs='+',
+                      help='Config files or glob patterns, e.g. "config/web/*.yaml".')
+
+  parser.add_argument('-w', '--workers',
+                      default=cpu_count(),
+                      type=int,
+                      help='Worker processes. Defaults to the number of cores.')
+
+  add_arguments(parser)
+
+  args = parser.parse_args()
+
+  # Pool workers are daemonic and can't start processes of their own.
+  if args.jobs > 1:
+    parser.error('--jobs can not be combined with batch.py, use --workers.')
+
+  for name, _ in OUTPUT_OPTIONS:
+    if getattr(args, name) and '{config}' not in getattr(args, name):
+      parser.error('--{} is written per config, it needs {{config}} in batch.py.'.format(name.replace('_', '-')))
+
+  names = [config_name(config_path) for config_path in find_configs(args.configs)]
+
+  if len(set(names)) < len(names):
+    parser.error('Configs must have distinct file names, they name the files of each run.')
+
+  main(args)
@@ -0,0 +1,186 @@
+""" Benchmark the generation stages on representative configs at several scales.
+
+  From the ./optimizely-fake-data directory
+
+    python ./src/benchmark.py -o benchmark.json
+    python ./src/benchmark.py --scales 1 10 --baseline benchmark.json -o new.json
+
+  By default retail (revenue), cs_upworthy (volume) and b2b_totals (manual segments) are generated
+  at 1x, 10x and 100x their visitor, conversion and manual segment counts, with -m -s and --seed 1.
+  Each config and scale runs in a fresh worker process, so peak memory isn't carried over.
+
+  Wall time, rows per second and peak memory of every stage are printed and written to --output as
+  JSON. With --baseline, each stage is compared to the same config, scale and stage of an earlier
+  results file, and the exit status is 1 if any got slower by more than --tolerance.
+
+"""
+
+from main import add_arguments, create_database, generate, get_config
+from multiprocessing import Pool
+
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+
+DEFAULT_CONFIGS = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'web', name)
+                   for name in ('retail.yaml', 'cs_upworthy.yaml', 'b2b_totals.yaml')]
+
+# Stages faster than this in the baseline are too noisy to compare.
+MIN_SECONDS = 0.1
+
+
+def scale_config(config, scale):
+  """Copy of the config with every visitor, conversion and manual segment count multiplied by scale."""
+  scaled = copy.deepcopy(config)
+
+  for distribution in scaled['visitors'].itervalues():
+    distribution['total'] = int(distribution['total'] * scale)
+
+  for goal_data in scaled['conversions'].itervalues():
+    for counts in goal_data['counts'].itervalues():
+      counts['unique'] = int(counts['unique'] * scale)
+      counts['total']  = int(counts['total'] * scale)
+
+  for segment_distribution in scaled['segments'].get('manual', {}).itervalues():
+    for variation_distribution in segment_distribution.itervalues():
+      for distribution in variation_distribution.itervalues():
+        distribution['total']       = int(distribution['total'] * scale)
+        distribution['conversions'] = dict((goal_id, int(count * scale))
+                                           for goal_id, count in distribution['conversions'].iteritems())
+
+  return scaled
+
+
+def run_benchmark(job):
+  """Worker entry point: generate one config at one scale. Returns a result per stage."""
+  config_path, scale, args = job
+
+  config   = scale_config(get_config(config_path), scale)
+  database = create_database(config, args.store)
+  summary  = {'stages': []}
+
+  generate(config, database, args, summary)
+
+  return [{'config':          os.path.basename(config_path),
+           'scale':           scale,
+           'stage':           stage['name'],
+           'rows':            stage['rows'],
+           'seconds':         stage['seconds'],
+           'rows_per_second': stage['rows'] / stage['seconds'] if stage['seconds'] else None,
+           'peak_memory':     stage['peak_memory']} for stage in summary['stages']]
+
+
+def compare(results, baseline, tolerance):
+  """Print each stage against the baseline. Returns the results that got slower than tolerance."""
+  previous    = dict(((x['config'], x['scale'], x['stage']), x) for x in baseline['results'])
+  regressions = []
+
+  print '\t'.join(['config', 'scale', 'stage', 'baseline s', 'seconds', 'ratio'])
+
+  for result in results:
+    before = previous.get((result['config'], result['scale'], result['stage']))
+
+    if not before:
+      continue
+
+    ratio = result['seconds'] / before['seconds'] if before['seconds'] else None
+
+    if ratio is not None and before['seconds'] >= MIN_SECONDS and ratio > 1 + tolerance:
+      regressions.append(result)
+
+    print '{config}\t{scale:g}x\t{stage}\t{0:.2f}\t{seconds:.2f}\t{1}'.format(
+      before['seconds'], '{:.2f}'.format(ratio) if ratio is not None else '-', **result)
+
+  return regressions
+
+
+def print_results(results):
+  print '\t'.join(['config', 'scale', 'stage', 'rows', 'seconds', 'rows/s', 'peak MiB'])
+
+  for result in results:
+    print '{config}\t{scale:g}x\t{stage}\t{rows}\t{seconds:.2f}\t{0}\t{1:.1f}'.format(
+      '{:.0f}'.format(result['rows_per_second']) if result['rows_per_second'] else '-',
+      result['peak_memory'] / 1024.0, **result)
+
+
+def main(args):
+  logging.basicConfig(level=logging.WARNING)
+
+  jobs = [(config_path, scale, args) for config_path in args.configs for scale in args.scales]
+
+  pool    = Pool(processes=args.workers, maxtasksperchild=1)
+  results = sum(pool.map(run_benchmark, jobs, chunksize=1), [])
+
+  pool.close()
+  pool.join()
+
+  print_results(results)
+
+  report = {
+    'created': int(time.time()),
+    'python':  platform.python_version(),
+    'seed':    args.seed,
+    'store':   args.store,
+    'results': results
+  }
+
+  with open(args.output, 'w') as output:
+    json.dump(report, output, indent=2, sort_keys=True)
+
+  if args.baseline:
+    with open(args.baseline) as baseline:
+      regressions = compare(results, json.load(baseline), args.tolerance)
+
+    if regressions:
+      print '{} stages slower than the baseline by more than {:.0%}.'.format(len(regressions), args.tolerance)
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the generation stages at several scales.')
+
+  parser.add_argument('configs',
+                      default=DEFAULT_CONFIGS,
+                      nargs='*',
+                      help='Config files. Defaults to retail, cs_upworthy and b2b_totals.')
+
+  parser.add_argument('--baseline',
+                      help='Results file of an earlier run to compare against.')
+
+  parser.add_argument('-o', '--output',
+                      default='benchmark.json',
+                      help='File the results are written to, as JSON.')
+
+  parser.add_argument('--scales',
+                      default=[1, 10, 100],
+                      nargs='+',
+                      type=float,
+                      help='Multipliers for the visitor and conversion counts of every config.')
+
+  parser.add_argument('--tolerance',
+                      default=0.1,
+                      type=float,
+                      help='Fraction a stage may be slower than the baseline before it counts as a regression.')
+
+  parser.add_argument('-w', '--workers',
+                      default=1,
+                      type=int,
+                      help='Benchmarks run at once. More than 1 makes them compete for cores and memory bandwidth.')
+
+  add_arguments(parser)
+
+  # Every stage is benchmarked, always on the same data.
+  parser.set_defaults(include_multiple_conversions=True, include_segments=True, seed=1)
+
+  args = parser.parse_args()
+
+  if args.jobs > 1:
+    parser.error('--jobs can not be combined with benchmark.py.')
+
+  main(args)
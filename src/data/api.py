@@ -1,18 +1,110 @@
 from __future__ import division
-from datetime import datetime
-from eventlet.green import urllib2
-from httplib import BadStatusLine
+from connections import ConnectionPool
+from eventlet.green import socket
+from eventlet.green.httplib import HTTPException
 from interface import progress_bar
+from itertools import izip
+from metrics import metrics
+from query import APIQuery
+from scheduler import SendError, SendScheduler
+from urlparse import urlsplit
 
-import eventlet
 import re
+import time
 import urllib
 
 
+class EventSerializer(object):
+  """Turns send query rows into request paths for one experiment. Compiled once per experiment, from
+    its credentials, experiment id and the row columns (APIQuery.event_columns), which fix the segment ids.
+
+    The constant parameters (a, d, f, wxhr, y) are encoded once into the path prefix, and the rest
+    fill a format template in a fixed order. Names, goal ids and segment values come from small sets
+    and are quoted once each. tsent is refreshed at most once per second. The query string has
+    the same parameters and values urllib.urlencode would give the APIImport.format_event dict.
+  """
+  def __init__(self, account_id, admin_id, experiment_id, columns, path):
+    position = dict((column, index) for index, column in enumerate(columns))
+
+    self.experiment_id = experiment_id
+    self.segment_keys  = [column for column in columns if re.match(APIImport.regex['segment'], column)]
+    self.bucket_key    = 'x{}'.format(experiment_id)
+
+    self.constants = [
+      ('a',    account_id),
+      ('d',    admin_id),
+      ('f',    APIImport.format_event_experiment_ids(experiment_id)),
+      ('wxhr', 'true'),
+      ('y',    'false')
+    ]
+
+    self.prefix   = '{}?{}&'.format(path, urllib.urlencode(self.constants))
+    self.template = self.prefix.replace('%', '%%') + '&'.join(['tsent=%s', 'u=oeu%s', 'time=%d', 'n=%s', 'g=%s', 'v=%d',
+                                            urllib.quote_plus(self.bucket_key) + '=%s'] +
+                                           [urllib.quote_plus(key) + '=%s' for key in self.segment_keys])
+
+    self.positions = dict((key, position[key]) for key in ('u', 'variation_id', 't', 'n', 'g', 'v'))
+    self.segments  = [position[key] for key in self.segment_keys]
+
+    self._quoted        = {}
+    self._tsent         = None
+    self._tsent_refresh = 0
+
+  def quote(self, value):
+    try:
+      return self._quoted[value]
+    except KeyError:
+      quoted = self._quoted[value] = urllib.quote_plus(str(value))
+      return quoted
+
+  def tsent(self):
+    now = time.time()
+
+    if now >= self._tsent_refresh:
+      self._tsent         = APIImport.format_event_tsent()
+      self._tsent_refresh = int(now) + 1
+
+    return self._tsent
+
+  def serialize(self, row):
+    """(path, identity) of the event for a query row. identity is what SendJournal keys events by."""
+    position   = self.positions
+    quote      = self.quote
+    user_id    = row[position['u']]
+    name       = row[position['n']]
+    event_time = row[position['t']]
+
+    values = [self.tsent(), user_id, event_time, quote(name), quote(APIImport.format_event_goal_ids(row[position['g']])),
+              row[position['v']], row[position['variation_id']]]
+
+    values.extend(quote(row[index]) for index in self.segments)
+
+    return self.template % tuple(values), 'oeu{}|{}|{}'.format(user_id, name, int(event_time))
+
+  def format(self, row):
+    """The event for a query row as a dict of parameters, e.g. to export it."""
+    position = self.positions
+    event    = dict(self.constants)
+
+    event.update({
+      'g':             APIImport.format_event_goal_ids(row[position['g']]),
+      'n':             APIImport.format_event_name(row[position['n']]),
+      'time':          APIImport.format_event_time(row[position['t']]),
+      'tsent':         self.tsent(),
+      'u':             APIImport.format_event_user_id(row[position['u']]),
+      'v':             APIImport.format_event_revenue(row[position['v']]),
+      self.bucket_key: row[position['variation_id']]
+    })
+
+    for key, index in izip(self.segment_keys, self.segments):
+      event[key] = row[index]
+
+    return event
+
+
 class APIImport(object):
-  errors   = 0
-  pause    = 5
-  pool     = eventlet.GreenPool(size=10)
+  # Statuses worth retrying: the server may accept the same event later.
+  retry_statuses = (408, 429)
   url_base = 'http://{}.log.optimizely.com/v1/offline/event'
 
   regex = {
@@ -20,41 +112,42 @@ class APIImport(object):
     'segment':    '^s(\d+)$'
   }
 
-  def __init__(self, account_id, admin_id):
+  def __init__(self, account_id, admin_id, experiment_id, segment_ids, connections=None, journal=None, **scheduling):
+    """
+    :param : experiment_id, segment_ids: the experiment the events are for, see EventSerializer.
+    :param : connections (ConnectionPool): keep-alive connections to the log endpoint.
+    :param : journal (SendJournal): records acknowledged events, events already in it are skipped.
+    :param : scheduling: concurrency, rate limit, retry and dead letter options for SendScheduler.
+    """
     self.credentials = {
       'account_id': account_id,
       'admin_id':   admin_id
     }
 
+    url = urlsplit(self.url_base.format(account_id))
+
     self.env = {
-      'url': self.url_base.format(account_id)
+      'host': url.netloc,
+      'path': url.path,
+      'url':  url.geturl()
     }
 
-  def format_event(self, event):
-    formatted_event = {
-      'a':     self.credentials['account_id'],
-      'd':     self.credentials['admin_id'],
-      'f':     self.format_event_experiment_ids(event['x']),
-      'g':     self.format_event_goal_ids(event['g']),
-      'n':     self.format_event_name(event['n']),
-      'time':  self.format_event_time(event['t']),
-      'tsent': self.format_event_tsent(),
-      'u':     self.format_event_user_id(event['u']),
-      'v':     self.format_event_revenue(event['v']),
-      'wxhr':  'true',
-      'y':     'false'
-    }
+    self.serializer  = EventSerializer(account_id, admin_id, experiment_id,
+                                       APIQuery.event_columns(segment_ids), url.path)
+    self.journal     = journal
+    self.scheduler   = SendScheduler(self.send_event, **scheduling)
+    self.connections = connections or ConnectionPool(size=self.scheduler.max_concurrency)
 
-    # Dynamically set the bucket key (x12345={{variation_id}})
-    bucket_key = 'x{}'.format(event['x'])
-    formatted_event[bucket_key] = event['variation_id']
+  def format_event(self, event):
+    """The parameters sent for a query row, as a dict. Sending itself uses serializer.serialize."""
+    return self.serializer.format(event)
 
-    # There can be any number of segments, need to dynamically set the keys
-    for key in event.keys():
-      if re.match(self.regex['segment'], str(key)):
-        formatted_event[key] = event[key]
+  @staticmethod
+  def format_event_keys(experiment_id, segment_ids):
+    """Every key format_event can give the events of an experiment."""
+    keys = ['a', 'd', 'f', 'g', 'n', 'time', 'tsent', 'u', 'v', 'wxhr', 'y', 'x{}'.format(experiment_id)]
 
-    return formatted_event
+    return keys + ['s{}'.format(segment_id) for segment_id in segment_ids]
 
   @staticmethod
   def format_event_experiment_ids(experiment_id):
@@ -73,54 +166,82 @@ class APIImport(object):
   def format_event_revenue(revenue):
     return int(revenue)
 
-  # TODO(brendan): split out time logic
   @staticmethod
   def format_event_time(event_time):
-    epoch          = datetime.utcfromtimestamp(0)
-    event_datetime = datetime.strptime(event_time, '%Y-%m-%d %H:%M:%S.%f').replace(microsecond=0)
-    delta          = event_datetime - epoch
+    """Event times are stored as epoch seconds already."""
+    return int(event_time)
 
-    return int(delta.total_seconds())
-
-  # TODO(brendan): split out time logic
   @staticmethod
   def format_event_tsent():
-    epoch          = datetime.utcfromtimestamp(0)
-    event_datetime = datetime.utcnow()
-    delta          = event_datetime - epoch
-
-    return int(delta.total_seconds())
+    return int(time.time())
 
   @staticmethod
   def format_event_user_id(user_id):
     return 'oeu' + str(user_id)
 
-  def send(self, events, title='Sending events'):
+  def send(self, events, title='Sending events', total=None):
+    """Format and send events as they come. events can be any iterable, e.g. a query generator:
+      submit blocks while every slot is busy, so only a few events are held at once.
+      Returns once every event was accepted or written to the dead letter file.
+
+    :param : total (int): number of events, for the progress bar. Defaults to len(events).
+    """
     # Initialize progress bar
-    events_count = len(events)
+    events_count = total if total is not None else len(events)
     events_sent  = 0
     warning      = ''
+    journal      = self.journal
+    serialize    = self.serializer.serialize
 
     progress_bar(title, 0, warning)
 
+    started = time.time()
+    stats   = dict(self.scheduler.stats)
+
     for event in events:
-      self.pool.spawn(self.send_event,
-                      self.format_event(event))
+      path, identity = serialize(event)
+
+      if journal is None or identity not in journal:
+        self.scheduler.submit((path, identity))
+      else:
+        metrics.increment('events_skipped', events=title)
 
       events_sent += 1
 
       if events_sent % 1000 == 0:
         progress_bar(title, (events_sent / events_count), warning)
 
-      if self.errors > 10:
+      if self.scheduler.stats['errors'] > 10:
         warning = 'High error rate!'
 
+    self.scheduler.drain()
+
+    metrics.observe('send', time.time() - started, events=title)
+
+    for name in ('succeeded', 'dead', 'retried'):
+      metrics.increment('events_' + name, self.scheduler.stats[name] - stats[name], events=title)
 
     progress_bar(title, 1, warning)
 
   def send_event(self, event):
+    """Send one event, a (path, identity) pair from EventSerializer.serialize.
+      Latency of every request and the reason of every failure go to metrics.
+    """
+    path, identity = event
+    started        = time.time()
+
     try:
-      url = '?'.join([self.env['url'], urllib.urlencode(event)])
-      urllib2.urlopen(url)
-    except BadStatusLine, urllib2.HTTPError:
-      self.errors += 1
+      response = self.connections.get(self.env['host'], path)
+    except (HTTPException, socket.error) as error:
+      metrics.increment('http_errors', reason=type(error).__name__)
+      raise SendError(repr(error))
+
+    metrics.observe('http_request', time.time() - started, status=response.status)
+
+    if response.status >= 400:
+      metrics.increment('http_errors', reason=response.status)
+      raise SendError('HTTP {}'.format(response.status),
+                      retry=response.status >= 500 or response.status in self.retry_statuses)
+
+    if self.journal is not None:
+      self.journal.record(identity)
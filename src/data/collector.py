@@ -0,0 +1,138 @@
+from eventlet.green import socket
+from urlparse import parse_qsl, urlsplit
+
+import eventlet
+import json
+import random
+
+
+class EventCollector(object):
+  """Local stand-in for the /v1/offline/event endpoint, to load test APIImport without sending anything.
+
+    Speaks just enough HTTP/1.1 for httplib keep-alive connections. Every event request waits
+    latency seconds, plus up to jitter more, and is then answered:
+
+      reset:  with probability reset_rate the connection is closed without a response, which
+              httplib reports as BadStatusLine
+      errors: {status: rate}, e.g. {503: 0.02, 429: 0.01}, answered with that status
+      200:    otherwise, and the event counts as delivered
+
+    GET /stats returns the counts as JSON, GET /reset sets them back to zero first.
+  """
+  event_path = '/v1/offline/event'
+  reasons    = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 408: 'Request Timeout', 429: 'Too Many Requests',
+                500: 'Internal Server Error', 502: 'Bad Gateway', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+  def __init__(self, latency=0, jitter=0, errors=None, reset_rate=0, seed=None):
+    self.latency    = latency
+    self.jitter     = jitter
+    self.errors     = sorted((errors or {}).items())
+    self.reset_rate = reset_rate
+
+    self._random = random.Random(seed)
+    self._socket = None
+
+    self.reset()
+
+  @property
+  def address(self):
+    return self._socket.getsockname()
+
+  def reset(self):
+    self.counts     = {'connections': 0, 'received': 0, 'resets': 0, 'statuses': {}}
+    self.delivered  = set()
+    self.duplicates = 0
+
+  def stats(self):
+    return dict(self.counts, delivered=len(self.delivered), duplicates=self.duplicates)
+
+  def listen(self, host='127.0.0.1', port=0):
+    """Bind the server socket; port 0 picks a free port, see address."""
+    self._socket = eventlet.listen((host, port), backlog=1024)
+
+    return self.address
+
+  def serve(self):
+    """Accept connections until the process ends, each on a greenlet of its own."""
+    while True:
+      connection, _ = self._socket.accept()
+      self.counts['connections'] += 1
+      eventlet.spawn_n(self.handle, connection)
+
+  def handle(self, connection):
+    reader = connection.makefile('rb')
+
+    try:
+      while True:
+        request_line = reader.readline()
+
+        if not request_line:
+          break
+
+        # Headers are read and ignored: every request is a GET without a body.
+        while reader.readline() not in ('\r\n', '\n', ''):
+          pass
+
+        status, body = self.respond(request_line.split(' ')[1] if ' ' in request_line else '/')
+
+        if status is None:
+          break
+
+        connection.sendall('HTTP/1.1 {} {}\r\nContent-Length: {}\r\nConnection: keep-alive\r\n\r\n{}'.format(
+          status, self.reasons.get(status, 'Unknown'), len(body), body))
+    except socket.error:
+      pass
+    finally:
+      reader.close()
+      connection.close()
+
+  def respond(self, target):
+    """(status, body) for a request, or (None, None) to drop the connection."""
+    url = urlsplit(target)
+
+    if url.path == '/stats':
+      return 200, json.dumps(self.stats())
+
+    if url.path == '/reset':
+      self.reset()
+      return 200, json.dumps(self.stats())
+
+    if url.path != self.event_path:
+      return 404, ''
+
+    self.counts['received'] += 1
+
+    delay = self.latency + self._random.random() * self.jitter
+
+    if delay:
+      eventlet.sleep(delay)
+
+    if self._random.random() < self.reset_rate:
+      self.counts['resets'] += 1
+      return None, None
+
+    status = self.draw_status()
+
+    self.counts['statuses'][status] = self.counts['statuses'].get(status, 0) + 1
+
+    if status == 200:
+      # Sent time changes with every send of an event, it is no part of its identity.
+      key = tuple(sorted((name, value) for name, value in parse_qsl(url.query) if name != 'tsent'))
+
+      if key in self.delivered:
+        self.duplicates += 1
+
+      self.delivered.add(key)
+
+    return status, ''
+
+  def draw_status(self):
+    draw = self._random.random()
+
+    for status, rate in self.errors:
+      if draw < rate:
+        return status
+
+      draw -= rate
+
+    return 200
@@ -0,0 +1,142 @@
+from eventlet.green import httplib, socket
+from eventlet.queue import Empty, LightQueue
+from eventlet.semaphore import Semaphore
+
+import time
+
+
+class PooledConnection(object):
+  """A persistent HTTP/1.1 connection that counts the requests it carried."""
+  def __init__(self, host, timeout):
+    self._connection = httplib.HTTPConnection(host, timeout=timeout)
+    self._requests   = 0
+    self._last_used  = time.time()
+
+  def close(self):
+    self._connection.close()
+
+  def get(self, path):
+    """GET path and read the whole response, so the connection can carry the next request."""
+    self._connection.request('GET', path, headers={'Connection': 'keep-alive'})
+
+    response = self._connection.getresponse()
+    response.read()
+
+    self._requests  += 1
+    self._last_used = time.time()
+
+    return response
+
+  def idle_for(self):
+    return time.time() - self._last_used
+
+  @property
+  def requests(self):
+    return self._requests
+
+
+class ConnectionPool(object):
+  """Per-host pool of keep-alive connections shared by the sending greenlets.
+
+    At most size connections are open per host. A greenlet takes an idle connection, or opens one
+    if none is available, and puts it back after reading the response. Connections idle for longer
+    than idle_timeout are closed instead of reused, since the server has likely dropped them.
+  """
+  def __init__(self, size=10, idle_timeout=30, timeout=30):
+    self.size         = size
+    self.idle_timeout = idle_timeout
+    self.timeout      = timeout
+
+    self._idle    = {}
+    self._slots   = {}
+    self._opened  = 0
+    self._retired = []
+    self._active  = set()
+
+  def acquire(self, host):
+    """Returns (connection, reused)."""
+    if host not in self._slots:
+      self._idle[host]  = LightQueue()
+      self._slots[host] = Semaphore(self.size)
+
+    self._slots[host].acquire()
+
+    while True:
+      try:
+        connection = self._idle[host].get_nowait()
+      except Empty:
+        break
+
+      if connection.idle_for() < self.idle_timeout:
+        return connection, True
+
+      self.discard(connection)
+
+    self._opened += 1
+    connection = PooledConnection(host, self.timeout)
+    self._active.add(connection)
+
+    return connection, False
+
+  def discard(self, connection):
+    connection.close()
+
+    if connection in self._active:
+      self._active.remove(connection)
+      self._retired.append(connection.requests)
+
+  def release(self, host, connection, keep=True):
+    if keep:
+      self._idle[host].put(connection)
+    else:
+      self.discard(connection)
+
+    self._slots[host].release()
+
+  def get(self, host, path):
+    """GET http://host/path over a pooled connection. Returns the response (already read).
+
+      A reused connection may have been closed by the server since its last request. That shows
+      up as BadStatusLine or a socket error, and the request is retried once on a new connection.
+    """
+    connection, reused = self.acquire(host)
+
+    try:
+      try:
+        response = connection.get(path)
+      except (httplib.HTTPException, socket.error):
+        if not reused:
+          raise
+
+        self.discard(connection)
+        connection = PooledConnection(host, self.timeout)
+
+        self._opened += 1
+        self._active.add(connection)
+
+        response = connection.get(path)
+    except:
+      self.release(host, connection, keep=False)
+      raise
+
+    self.release(host, connection, keep=not response.will_close)
+
+    return response
+
+  def close(self):
+    for idle in self._idle.itervalues():
+      while not idle.empty():
+        self.discard(idle.get_nowait())
+
+  def stats(self):
+    """Connection reuse: how many were opened and how many requests each one carried."""
+    requests = self._retired + [connection.requests for connection in self._active]
+
+    return {
+      'connections': self._opened,
+      'requests':    sum(requests),
+      'per_connection': {
+        'max':  max(requests) if requests else 0,
+        'mean': sum(requests) / float(len(requests)) if requests else 0
+      }
+    }
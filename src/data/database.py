@@ -1,7 +1,10 @@
-from datetime import datetime
+from itertools import izip
+from metrics import metrics
 from os.path import abspath, dirname
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine, Column, DateTime, Integer, ForeignKey, String
+from sqlalchemy.pool import SingletonThreadPool
+from sqlalchemy.schema import CreateTable
+from sqlalchemy import create_engine, event, Column, Index, Integer, ForeignKey, String
 
 
 # Class from which all mapped classes should inherit
@@ -12,54 +15,275 @@ Base = declarative_base()
 class EventTable(Base):
   """Holds one record for each event.
     Child of the Visitor table bound by foreign key (visitor_id).
+    Times are integer seconds since the Unix epoch, here and in the Visitor table.
+    goal_ids keeps the comma-joined goals as sent to the API; EventGoalTable holds them one per row for queries.
   """
-  __tablename__ = 'event'
+  __tablename__  = 'event'
+  __table_args__ = (
+    # Covers the conversion send query, which reads every column but id through the visitor join.
+    Index('ix_event_visitor', 'visitor_id', 'name', 'time', 'goal_ids', 'revenue'),
+    Index('ix_event_name', 'name', 'visitor_id', 'time')
+  )
   id         = Column(Integer, primary_key=True)
   visitor_id = Column(Integer, ForeignKey('visitor.id'))
   goal_ids   = Column(String(32))
   name       = Column(String(255))
-  time       = Column(DateTime, default=datetime.now())
+  time       = Column(Integer)
   revenue    = Column(Integer, default=0)
 
 
+class EventGoalTable(Base):
+  """Holds one row for each goal an event counts towards.
+    Child of the Event table bound by foreign key (event_id).
+  """
+  __tablename__ = 'event_goal'
+  event_id      = Column(Integer, ForeignKey('event.id'), primary_key=True)
+  goal_id       = Column(Integer, primary_key=True, autoincrement=False)
+
+
 class SegmentTable(Base):
   """Holds one row for each segment a visitor belongs to.
     Child of the Visitor table bound by foreign key (visitor_id).
   """
-  __tablename__ = 'segment'
+  __tablename__  = 'segment'
+  __table_args__ = (
+    Index('ix_segment_gae', 'gae_id', 'visitor_id'),
+    Index('ix_segment_visitor', 'visitor_id', 'gae_id', 'value')
+  )
   id         = Column(Integer, primary_key=True)
   visitor_id = Column(Integer, ForeignKey('visitor.id'))
   gae_id     = Column(Integer)
   value      = Column(String(32))
 
 
+class VisitorSegmentTable(Base):
+  """Holds one wide row for each visitor with segments: column s{gae_id} is the visitor's value for
+    that segment. Columns are added for the config's segment ids with the tables, see Database.create_tables.
+  """
+  __tablename__ = 'visitor_segment'
+  visitor_id    = Column(Integer, ForeignKey('visitor.id'), primary_key=True, autoincrement=False)
+
+
 class VisitorTable(Base):
-  __tablename__ = 'visitor'
+  __tablename__  = 'visitor'
+  __table_args__ = (
+    Index('ix_visitor_variation', 'variation', 'id', 'time'),
+  )
   id            = Column(Integer, primary_key=True)
   number        = Column(Integer)
   experiment_id = Column(Integer)
-  time          = Column(DateTime, default=datetime.now())
+  time          = Column(Integer)
   variation     = Column(Integer)
 
 
 class Database(object):
-  """ Handles all logic for creating and maintaining local SQLite DB. """
-  def __init__(self, db_name):
+  """ Handles all logic for creating and maintaining local SQLite DB.
+
+    In memory by default. With a db_file the database is written to disk: it loads with WAL,
+    synchronous=OFF and a large page cache, and once finish_load has run it can be reopened
+    by a later run instead of generated again.
+
+    Indexes are only created by finish_load, once every row is inserted, so no insert has an index
+    to maintain and each index is built in one pass. The few queries generation makes read whole
+    variations, which needs no index.
+  """
+  # Page cache per connection, in KiB
+  cache_size = 256 * 1024
+
+  def __init__(self, db_name, db_file=None):
+    """
+    :param : db_file (str): path of a file-backed database, None to keep it in memory
+    """
     self.db_name       = db_name
-    self.db_file       = dirname(dirname(abspath(__file__))) + '/sql/' + str(db_name) + '.db'
-    self.engine        = create_engine('sqlite://')# /' + self.db_file, echo=False)
+    self.db_file       = db_file or dirname(dirname(abspath(__file__))) + '/sql/' + str(db_name) + '.db'
+    self.in_memory     = db_file is None
+    self.indexed       = False
+    self.loading       = True
     self.metadata      = Base.metadata
+
+    if self.in_memory:
+      self.engine = create_engine('sqlite://')
+    else:
+      # One connection per thread, kept open, so the page cache outlives a query.
+      self.engine = create_engine('sqlite:///' + self.db_file, poolclass=SingletonThreadPool)
+      event.listen(self.engine, 'connect', self.on_connect)
+
     self.metadata.bind = self.engine
 
-  def create_tables(self):
-    """Create all tables that inherit from Base."""
-    self.metadata.drop_all(checkfirst=True)
-    self.metadata.create_all(checkfirst=True)
+  def create_tables(self, segment_ids=()):
+    """Create all tables that inherit from Base, without their indexes (see create_indexes).
+
+    :param : segment_ids (list<int>): segments that get a column in VisitorSegmentTable
+    """
+    self.metadata.drop_all(self.engine, checkfirst=True)
+
+    for table in self.metadata.sorted_tables:
+      self.engine.execute(CreateTable(table))
+
+    # Added now rather than on insert: sqlite3 commits the open transaction before any DDL.
+    segment_table = VisitorSegmentTable.__tablename__
+
+    for segment_id in segment_ids:
+      self.engine.execute('ALTER TABLE {} ADD COLUMN s{} VARCHAR(32)'.format(segment_table, segment_id))
+
+    self.indexed = False
+    self.loading = True
+
+  def create_indexes(self):
+    """Create the indexes declared on the tables that don't exist yet."""
+    if self.indexed:
+      return
+
+    existing = set(row[0] for row in self.engine.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+
+    for table in self.metadata.sorted_tables:
+      for index in table.indexes:
+        if index.name not in existing:
+          index.create(self.engine)
+
+    self.indexed = True
+
+  def finish_load(self):
+    """Called once generation is done. Indexes the data and, for a file, makes it durable and
+      marks it complete, see is_complete.
+    """
+    self.create_indexes()
+    self.loading = False
+
+    if not self.in_memory:
+      connection = self.engine.raw_connection()
+
+      try:
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        connection.execute('PRAGMA user_version=1')
+        connection.commit()
+      finally:
+        connection.close()
+
+  def is_complete(self):
+    """Whether a file-backed database was fully generated by an earlier run."""
+    return not self.in_memory and self.engine.execute('PRAGMA user_version').scalar() == 1
+
+  def open(self):
+    """Use the data of a complete database file as is."""
+    self.indexed = True
+    self.loading = False
+
+  def on_connect(self, connection, record):
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous={}'.format('OFF' if self.loading else 'NORMAL'))
+    connection.execute('PRAGMA cache_size=-{}'.format(self.cache_size))
+
+  def export_columns(self, table, names):
+    """Read a whole table back as a dict of columns, in row order."""
+    rows   = self.engine.execute('SELECT {} FROM {} ORDER BY id'.format(', '.join(names),
+                                                                        table.__tablename__)).fetchall()
+    values = zip(*rows) if rows else [()] * len(names)
+
+    return dict((name, list(column)) for name, column in zip(names, values))
+
+  def queries(self):
+    """Query objects for this backend, keyed by the data they serve."""
+    from query import APIQuery, EventQuery, SegmentQuery, VisitorQuery
+
+    return {
+      'api':     APIQuery(self),
+      'event':   EventQuery(self),
+      'segment': SegmentQuery(self),
+      'visitor': VisitorQuery(self)
+    }
+
+  @staticmethod
+  def event_goals(event_ids, goal_ids):
+    """(event_id, goal_id) rows split from the events' comma-joined goal_ids."""
+    for event_id, event_goal_ids in izip(event_ids, goal_ids):
+      for goal_id in str(event_goal_ids).split(','):
+        yield (event_id, int(goal_id))
+
+  def segment_columns(self, connection=None):
+    """gae_ids that have a column in VisitorSegmentTable."""
+    columns = (connection or self.engine).execute('PRAGMA table_info({})'.format(VisitorSegmentTable.__tablename__))
+
+    return set(int(row[1][1:]) for row in columns if row[1] != 'visitor_id')
+
+  def update_visitor_segments(self, cursor, columns, existing):
+    """Copy inserted segment rows into their visitors' VisitorSegmentTable rows.
+
+    :param : existing (set<int>): segment_columns, read before the insert began
+    """
+    table  = VisitorSegmentTable.__tablename__
+    values = {}
+
+    for visitor_id, gae_id, value in izip(columns['visitor_id'], columns['gae_id'], columns['value']):
+      values.setdefault(gae_id, []).append((value, visitor_id))
+
+    missing = set(values) - existing
+
+    if missing:
+      raise ValueError('Segments {} are not in the segment_ids the tables were created with.'.format(
+        ', '.join(str(gae_id) for gae_id in sorted(missing))))
+
+    cursor.executemany('INSERT OR IGNORE INTO {} (visitor_id) VALUES (?)'.format(table),
+                       ((visitor_id,) for visitor_id in set(columns['visitor_id'])))
+
+    for gae_id, rows in values.iteritems():
+      cursor.executemany('UPDATE {} SET s{} = ? WHERE visitor_id = ?'.format(table, gae_id), rows)
 
   def insert(self, table, rows):
-    """Calls the insert method for the table--available from Base."""
-    if type(rows) is list and len(rows):
-      self.engine.execute(
-        table.__table__.insert(),
-        rows
-      )
+    """Inserts a list of row dicts, or a dict of columns ({'column_name': [values]}), see insert_columns."""
+    if type(rows) is dict:
+      self.insert_columns(table, rows)
+    elif type(rows) is list and len(rows):
+      names = rows[0].keys()
+      self.insert_columns(table, dict((name, [row[name] for row in rows]) for name in names))
+
+  def insert_columns(self, table, columns):
+    """Bulk insert column-oriented data straight through the DBAPI cursor.
+      Values go through the same bind processors SQLAlchemy applies to row inserts,
+      so the stored data is identical.
+      Events are given ids here, so their goals can be written to EventGoalTable in the same transaction.
+      Segments are copied to VisitorSegmentTable in the same way.
+    """
+    names = columns.keys()
+
+    if not names or not len(columns[names[0]]):
+      return
+
+    with metrics.timer('insert', table=table.__tablename__):
+      connection = self.engine.raw_connection()
+      cursor     = connection.cursor()
+
+      if table is EventTable and 'id' not in columns:
+        first_id = cursor.execute('SELECT IFNULL(MAX(id), 0) + 1 FROM event').fetchone()[0]
+        columns  = dict(columns, id=range(first_id, first_id + len(columns[names[0]])))
+        names    = columns.keys()
+
+      # Read first: sqlite3 commits the open transaction before a PRAGMA, like before any statement but DML.
+      existing = self.segment_columns(cursor) if table is SegmentTable else None
+      dialect  = self.engine.dialect
+      values   = []
+
+      for name in names:
+        processor = table.__table__.c[name].type.dialect_impl(dialect).bind_processor(dialect)
+        values.append(map(processor, columns[name]) if processor else columns[name])
+
+      statement = 'INSERT INTO {} ({}) VALUES ({})'.format(table.__tablename__,
+                                                           ', '.join(names),
+                                                           ', '.join('?' * len(names)))
+
+      try:
+        cursor.executemany(statement, izip(*values))
+
+        if table is EventTable:
+          cursor.executemany('INSERT OR IGNORE INTO event_goal (event_id, goal_id) VALUES (?, ?)',
+                             self.event_goals(columns['id'], columns['goal_ids']))
+
+        if table is SegmentTable:
+          self.update_visitor_segments(cursor, columns, existing)
+
+        connection.commit()
+      finally:
+        connection.close()
+
+    metrics.increment('rows_inserted', len(columns[names[0]]), table=table.__tablename__)
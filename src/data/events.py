@@ -1,85 +1,56 @@
 from __future__ import division
-from datetime import datetime, timedelta
 from experiments import Experiment
+from itertools import islice, izip
+from sampling import Sampler, get_distribution
 
 import math
-import random
-
-
-class Event(object):
-  def __init__(self, goal_ids, name, time, visitor_id, revenue_data=None):
-    self._goal_ids   = goal_ids
-    self._name       = name
-    self._time       = time
-    self._visitor_id = visitor_id
-    self._revenue    = self.get_revenue_amount(revenue_data) if revenue_data else 0
-
-  def format(self):
-    return {
-      'goal_ids':   self._goal_ids,
-      'name':       self._name,
-      'time':       self._time,
-      'visitor_id': self._visitor_id,
-      'revenue':    self._revenue
-    }
-
-  @staticmethod
-  def get_revenue_amount(revenue_data):
-    """Using gamma distribution: http://en.wikipedia.org/wiki/Gamma_distribution
-
-    :arg : alpha (int): Shape parameter
-    :arg : beta (int): Scale parameter
-    """
-    pdf_value = random.gammavariate(revenue_data['alpha'], revenue_data['beta'])
-
-    return int(math.floor(pdf_value * 100))
-
-  @property
-  def goal_ids(self):
-    return self._goal_ids
-
-  @property
-  def name(self):
-    return self._name
-
-  @property
-  def time(self):
-    return self._time
-
-  @property
-  def visitor_id(self):
-    return self._visitor_id
-
-  @property
-  def revenue(self):
-    return self._revenue
 
 
 class EventCollection(Experiment):
-  """Base class for generating lists of Events. Super class for each special Event list type.
+  """Base class for generating Events. Super class for each special Event list type.
     You must inherit from this class and define self.get_events(). It will throw a NotImplementedError
     if you call this class directly.
+
+    get_events yields one tuple per event, in the order of columns. generate groups them into
+    batches of columns, so only one batch of events is held at a time.
+
+    Each goal/variation draws from its own stream, (stream_name, goal_name, variation_id), and its
+    revenue from another, (stream_name, goal_name, variation_id, 'revenue'). Revenue is drawn from
+    the distribution in the config, gamma unless revenue.distribution says otherwise; see get_distribution.
   """
-  def __init__(self, config, database):
-    Experiment.__init__(self, config, database)
+  columns     = ('goal_ids', 'name', 'time', 'visitor_id', 'revenue')
+  stream_name = None
 
-  def generate(self):
-    """Entry point"""
-    if self.data:
-      self.data = []
+  def __init__(self, config, database, streams=None):
+    Experiment.__init__(self, config, database, streams)
 
+  def generate(self, batch_size=10000):
+    """Entry point. Yields dicts of columns ready for Database.insert, at most batch_size events each."""
     for goal_name, goal_data in self.conversions.iteritems():
       goal_ids = ','.join(str(x) for x in goal_data['goal_ids'])
 
       for variation_id, conversion_data in goal_data['counts'].iteritems():
-        events     = self.get_events(conversion_data, goal_ids, goal_name, variation_id)
-        self.data += events
+        events = iter(self.get_events(conversion_data, goal_ids, goal_name, variation_id))
+        batch  = list(islice(events, batch_size))
 
-    return self.data
+        while batch:
+          yield dict(zip(self.columns, [list(column) for column in zip(*batch)]))
+          batch = list(islice(events, batch_size))
 
   def get_events(self, conversion_data, goal_ids, goal_name, variation_id):
     raise NotImplementedError('Must use BaselineEvents or DistributedEvents to generate data.')
 
+  @staticmethod
+  def to_cents(amount):
+    return int(math.floor(amount * 100))
+
+  def get_revenues(self, revenue_data, goal_name, variation_id):
+    """Function drawing revenue amounts for the goal/variation, or None if it has no revenue."""
+    if not revenue_data:
+      return None
+
+    return get_distribution(self.streams.get(self.stream_name, goal_name, variation_id, 'revenue'), revenue_data)
+
   @property
   def query(self):
     return self._query
@@ -87,70 +58,110 @@ class EventCollection(Experiment):
 
 class BaselineEventCollection(EventCollection):
   """ Handles creating first events for visitors who converted *at least* once."""
-  def __init__(self, config, database):
-    EventCollection.__init__(self, config, database)
+  stream_name = 'baseline'
+
+  def __init__(self, config, database, streams=None):
+    EventCollection.__init__(self, config, database, streams)
 
   def get_events(self, conversion_data, goal_ids, event_name, variation_id):
-    """ For each goal/variaton, return a list of events for every visitor who converted at least once."""
-    events       = []
+    """ For each goal/variaton, yield an event for every visitor who converted at least once."""
     events_count = conversion_data['unique']
-    visitors     = self.query['visitor'].query_visitors_for_baseline_events(variation_id, events_count)
+    revenues     = self.get_revenues(conversion_data.get('revenue'), event_name, variation_id)
+    rng          = self.streams.get(self.stream_name, event_name, variation_id)
+    visitors     = self.query['visitor'].query_visitors_for_baseline_events(variation_id, events_count,
+                                                                            Sampler(rng))
 
     for visitor in visitors:
       event_time = self.get_event_time(visitor['time'])
+      revenue    = self.to_cents(revenues()) if revenues else 0
 
-      event = Event(goal_ids=goal_ids,
-                    name=event_name,
-                    revenue_data=conversion_data['revenue'] if 'revenue' in conversion_data else None,
-                    time=event_time,
-                    visitor_id=visitor['id'])
-
-      events.append(event.format())
-
-    return events
+      yield (goal_ids, event_name, event_time, visitor['id'], revenue)
 
   @staticmethod
   def get_event_time(visitor_time):
     """Baseline events should occur at the initial time of the visitor."""
-    return datetime.strptime(visitor_time, '%Y-%m-%d %H:%M:%S.%f').replace(microsecond=0)
+    return visitor_time
 
 
 class DistributedEventCollection(EventCollection):
-  def __init__(self, config, database):
-    EventCollection.__init__(self, config, database)
+  """Repeat conversions of visitors who converted at least once.
+
+    The total - unique extra events of a goal/variation are split over its converted visitors, see
+    Sampler.allocate, so any visitor may convert any number of times and the total is always met.
+    How unevenly they are split is set per goal/variation by repeats.concentration (default 1).
+
+    Each repeat follows the visitor's previous conversion by a delay in hours, drawn from the
+    goal/variation's delay settings on top of the default delay (front loaded, averaging 12 hours),
+    e.g. delay: {distribution: lognormal, mu: 1.5, sigma: 1}. Delays have a stream of their own,
+    (stream_name, goal_name, variation_id, 'delay'). A visitor whose repeats would run past the end
+    of the experiment has them squeezed into the time left, see get_repeat_times.
+  """
+  delay       = {'distribution': 'gamma', 'alpha': 2, 'beta': 6}
+  stream_name = 'distributed'
+
+  def __init__(self, config, database, streams=None):
+    EventCollection.__init__(self, config, database, streams)
 
-  # TODO: Update to handle conversions > 2 per visitor.
   def get_events(self, conversion_data, goal_ids, event_name, variation_id):
     """For each goal/variation, add additional events to previously converted visitors."""
-    if conversion_data['total'] < conversion_data['unique']:
-      return None
-
-    events       = []
     events_count = conversion_data['total'] - conversion_data['unique']
-    visitors     = self.query['visitor'].query_visitors_for_distributed_events(event_name, variation_id, events_count)
+    visitors     = self.query['visitor'].query_converted_visitors(event_name, variation_id) if events_count > 0 else []
 
-    for visitor in visitors:
-      event_time = self.get_event_time(visitor['event_time'])
+    if not visitors:
+      return
 
-      event = Event(goal_ids=goal_ids,
-                    name=event_name,
-                    revenue_data=conversion_data['revenue'] if 'revenue' in conversion_data else None,
-                    time=event_time,
-                    visitor_id=visitor['id'])
+    concentration = conversion_data.get('repeats', {}).get('concentration', 1.0)
+    rng           = self.streams.get(self.stream_name, event_name, variation_id)
+    repeats       = Sampler(rng).allocate(events_count, len(visitors), concentration)
+    revenues      = self.get_revenues(conversion_data.get('revenue'), event_name, variation_id)
+    delays        = self.get_delays(conversion_data.get('delay'), event_name, variation_id)
 
-      events.append(event.format())
+    for visitor, count in izip(visitors, repeats):
+      for event_time in self.get_repeat_times(visitor['event_time'], count, delays):
+        revenue = self.to_cents(revenues()) if revenues else 0
 
-    return events
+        yield (goal_ids, event_name, event_time, visitor['id'], revenue)
 
-  @staticmethod
-  def get_event_time(event_time):
-    """Front loaded gamma distriubuution between visitor time and end of experiment."""
-    event_datetime  = datetime.strptime(event_time, '%Y-%m-%d %H:%M:%S.%f')
+  def get_repeat_times(self, event_time, count, delays):
+    """Times of count repeats after a conversion at event_time, all within the experiment.
+
+      Repeats are chained by delays, and one more delay follows the last of them. When that chain
+      runs past the end of the experiment it is scaled down to the time left, so the repeats keep
+      their order and relative spacing and the last one isn't pinned to the end.
+
+      Times are whole seconds, and the visitor, event name and time identify an event when sending.
+      So each repeat comes at least a second after the one before, and after event_time, as long
+      as the experiment has a second left for each of them.
+    """
+    if not count:
+      return []
+
+    offsets = []
+    offset  = 0.0
+
+    for _ in xrange(count + 1):
+      offset += max(0.0, delays()) * 3600
+      offsets.append(offset)
+
+    remaining = self.time['stop'] - event_time
+    scale     = remaining / offset if offset > remaining else 1.0
+    times     = []
+    previous  = event_time
+
+    for offset in offsets[:-1]:
+      previous = max(event_time + int(offset * scale), previous + 1)
+      times.append(previous)
+
+    # Pushed past the end of the experiment: pull the last ones back, a second apart, until they fit.
+    latest = self.time['stop']
 
-    distribution_average = 12
-    distribution_shape   = 2
-    distribution_scale   = int(distribution_average / distribution_shape)
+    for k in reversed(xrange(count)):
+      times[k] = min(times[k], latest)
+      latest   = times[k] - 1
 
-    pdf_value = random.gammavariate(distribution_shape, distribution_scale)
+    return times
 
-    return (event_datetime + timedelta(hours=pdf_value)).replace(microsecond=0)
+  def get_delays(self, delay_data, goal_name, variation_id):
+    """Function drawing the hours between conversions for the goal/variation."""
+    return get_distribution(self.streams.get(self.stream_name, goal_name, variation_id, 'delay'),
+                            dict(self.delay, **(delay_data or {})))
@@ -1,17 +1,25 @@
 from datetime import datetime
-from query import EventQuery, SegmentQuery, VisitorQuery
+from sampling import RandomStreams
 
-class Experiment(object):
-  data = []
+import calendar
+
+
+def to_epoch(value):
+  """Whole seconds since the Unix epoch for a naive UTC datetime."""
+  return calendar.timegm(value.timetuple())
 
-  def __init__(self, config, database):
+
+class Experiment(object):
+  def __init__(self, config, database, streams=None):
     """
+    :param : streams (RandomStreams): source of every random draw, unseeded by default
+
     :param : conversions (dict)
     :param : goal_ids (list<int>)
     :param : id (integer)
-    :param : time.start (datetime)
-    :param : time.stop (datetime)
-    :param : time.range (integer)
+    :param : time.start (integer): epoch seconds
+    :param : time.stop (integer): epoch seconds
+    :param : time.range (integer): seconds
     :param : variation_ids (list<int>)
     :param : variations (dict)
 
@@ -24,19 +32,16 @@ class Experiment(object):
     self._variation_ids = config['variation_ids']
     self._visitors      = config['visitors']
 
-    self._query = {
-      'event':   EventQuery(database),
-      'segment': SegmentQuery(database),
-      'visitor': VisitorQuery(database)
-    }
+    self._query   = database.queries()
+    self._streams = streams or RandomStreams()
 
     # TODO(Brendan): auto defined stop as UTC NOW.
     self._time = {
-      'start': datetime.strptime(config['experiment']['start'],'%Y-%m-%dT%H:%M:%SZ'),
-      'stop':  datetime.strptime(config['experiment']['stop'],'%Y-%m-%dT%H:%M:%SZ')
+      'start': to_epoch(datetime.strptime(config['experiment']['start'],'%Y-%m-%dT%H:%M:%SZ')),
+      'stop':  to_epoch(datetime.strptime(config['experiment']['stop'],'%Y-%m-%dT%H:%M:%SZ'))
     }
 
-    self._time['range'] = (self._time['stop'] - self._time['start']).total_seconds()
+    self._time['range'] = self._time['stop'] - self._time['start']
 
   @property
   def conversions(self):
@@ -70,6 +75,10 @@ class Experiment(object):
   def visitors(self):
     return self._visitors
 
+  @property
+  def streams(self):
+    return self._streams
+
   @property
   def time(self):
     return self._time
@@ -0,0 +1,167 @@
+from metrics import metrics
+from Queue import Queue
+from threading import Thread
+
+import csv
+import gzip
+import json
+import os
+import StringIO
+
+
+class EventExporter(object):
+  """Writes events, formatted like APIImport.format_event, to files instead of sending them.
+
+    Each call to export writes {prefix}-{name}-00000.{ndjson,csv}[.gz], -00001, ... with at most
+    chunk_size events per file. Files are written under a temporary name and renamed once complete.
+
+    Events are formatted and encoded on the calling thread and handed, batch_size at a time, to a
+    writer thread that compresses and writes them. gzip and file writes release the GIL, so
+    encoding and writing overlap. At most queue_size batches wait for the writer, so memory stays
+    flat however many events are exported.
+  """
+  formats = ('csv', 'ndjson')
+
+  # sort_keys would switch json to its pure Python encoder, several times slower.
+  json_encoder = json.JSONEncoder(separators=(',', ':'))
+
+  def __init__(self, directory, prefix, format_event, fieldnames, format='ndjson', compress=False,
+               chunk_size=1000000, batch_size=10000, queue_size=8):
+    """
+    :param : format_event (callable): turns a query row into the event to write, e.g. APIImport.format_event
+    :param : fieldnames (list<str>): every key an event can have, the columns of csv files
+    :param : format (str): ndjson, one JSON object per line, or csv with a header per file
+    :param : compress (bool): gzip every file
+    """
+    if format not in self.formats:
+      raise ValueError('Unknown export format {}, expected one of {}.'.format(format, ', '.join(self.formats)))
+
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+    self.directory    = directory
+    self.prefix       = prefix
+    self.format_event = format_event
+    self.fieldnames   = sorted(fieldnames)
+    self.format       = format
+    self.compress     = compress
+    self.chunk_size   = chunk_size
+    self.batch_size   = batch_size
+    self.files        = []
+
+    self._error  = None
+    self._queue  = Queue(maxsize=queue_size)
+    self._writer = Thread(target=self.write_batches, name='export-writer')
+
+    self._writer.daemon = True
+    self._writer.start()
+
+  def export(self, rows, name):
+    """Format and write every row. Returns the number of events written."""
+    count = 0
+    chunk = 0
+    batch = []
+    path  = None
+
+    with metrics.timer('export', events=name):
+      for row in rows:
+        if count % self.chunk_size == 0:
+          if batch:
+            self.put(path, batch)
+            batch = []
+
+          path   = self.chunk_path(name, chunk)
+          chunk += 1
+
+        batch.append(self.format_event(row))
+        count += 1
+
+        if len(batch) == self.batch_size:
+          self.put(path, batch)
+          batch = []
+
+      if batch:
+        self.put(path, batch)
+
+    metrics.increment('events_exported', count, events=name)
+
+    return count
+
+  def chunk_path(self, name, chunk):
+    extension = '.' + self.format + ('.gz' if self.compress else '')
+    path      = os.path.join(self.directory, '{}-{}-{:05d}{}'.format(self.prefix, name, chunk, extension))
+
+    self.files.append(path)
+
+    return path
+
+  def encode(self, events):
+    if self.format == 'ndjson':
+      encode = self.json_encoder.encode
+
+      return ''.join(encode(event) + '\n' for event in events)
+
+    output = StringIO.StringIO()
+    writer = csv.DictWriter(output, self.fieldnames, lineterminator='\n')
+
+    writer.writerows(events)
+
+    return output.getvalue()
+
+  def header(self):
+    return ','.join(self.fieldnames) + '\n' if self.format == 'csv' else ''
+
+  def put(self, path, events):
+    if self._error:
+      raise self._error
+
+    self._queue.put((path, self.encode(events)))
+
+  def close(self):
+    """Wait for the writer to finish every file. Raises the writer's error, if it had one."""
+    self._queue.put(None)
+    self._writer.join()
+
+    if self._error:
+      raise self._error
+
+  def open(self, path):
+    if self.compress:
+      return gzip.open(path + '.tmp', 'wb', compresslevel=6)
+
+    return open(path + '.tmp', 'wb')
+
+  def write_batches(self):
+    """Writer thread: appends batches to their file, opening the next one when the path changes."""
+    current = None
+    output  = None
+
+    while True:
+      item = self._queue.get()
+
+      if item is None:
+        break
+
+      # After an error, keep taking batches so export never blocks on a full queue.
+      if self._error:
+        continue
+
+      path, data = item
+
+      try:
+        if path != current:
+          if output:
+            output.close()
+            os.rename(current + '.tmp', current)
+
+          current = path
+          output  = self.open(path)
+          output.write(self.header())
+
+        output.write(data)
+      except (IOError, OSError) as error:
+        self._error = error
+
+    if output and not self._error:
+      output.close()
+      os.rename(current + '.tmp', current)
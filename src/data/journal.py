@@ -0,0 +1,71 @@
+from hashlib import md5
+
+import os
+import time
+
+
+class SendJournal(object):
+  """Append-only record of the events the log endpoint acknowledged, so a send can be resumed.
+
+    Each event is stored as an 8 byte digest of its identity (visitor id, event name, time).
+    Digests are buffered and written batch_size at a time, or after flush_interval seconds.
+  """
+  record_size = 8
+
+  def __init__(self, path, resume=False, batch_size=1000, flush_interval=1.0):
+    """
+    :param : resume (bool): keep the existing journal and skip the events it lists.
+              Otherwise the journal starts empty.
+    """
+    self.path           = path
+    self.batch_size     = batch_size
+    self.flush_interval = flush_interval
+
+    self.acknowledged = self.load() if resume else set()
+
+    self._buffer     = []
+    self._file       = open(path, 'ab' if resume else 'wb')
+    self._last_flush = time.time()
+
+  def __contains__(self, identity):
+    return self.key(identity) in self.acknowledged
+
+  def close(self):
+    self.flush()
+    os.fsync(self._file.fileno())
+    self._file.close()
+
+  def flush(self):
+    if self._buffer:
+      self._file.write(''.join(self._buffer))
+      self._file.flush()
+      self._buffer = []
+
+    self._last_flush = time.time()
+
+  @classmethod
+  def key(cls, identity):
+    """Digest of an event's identity, 'u|n|time' as given by EventSerializer.serialize."""
+    return md5(identity).digest()[:cls.record_size]
+
+  def load(self):
+    if not os.path.exists(self.path):
+      return set()
+
+    with open(self.path, 'rb') as journal:
+      data = journal.read()
+
+    # A run killed mid-write can leave a partial record at the end. Drop it so appends stay aligned.
+    size = len(data) - len(data) % self.record_size
+
+    if size != len(data):
+      with open(self.path, 'r+b') as journal:
+        journal.truncate(size)
+
+    return set(data[i:i + self.record_size] for i in xrange(0, size, self.record_size))
+
+  def record(self, identity):
+    self._buffer.append(self.key(identity))
+
+    if len(self._buffer) >= self.batch_size or time.time() - self._last_flush >= self.flush_interval:
+      self.flush()
@@ -0,0 +1,80 @@
+class MembershipIndex(object):
+  """In-memory bitmaps over each variation's visitors, for segment assignment.
+
+    Bit n of a bitmap is the visitor at position n of its variation. Bitmaps are Python longs, so
+    unions, intersections and complements run in C over the whole variation at once:
+
+      segment (gae_id, variation): visitors that have a value for the segment
+      goal (goal_id, variation):   visitors that converted on the goal
+      events (variation):          visitors with any event
+  """
+  def __init__(self):
+    self._bitmaps     = {}
+    self._positions   = {}
+    self._visitor_ids = {}
+
+  def add_variation(self, variation_id, visitor_ids):
+    """Register a variation's visitors. Their order defines the bit positions."""
+    self._visitor_ids[variation_id] = visitor_ids
+    self._positions[variation_id]   = dict((visitor_id, position) for position, visitor_id in enumerate(visitor_ids))
+
+  def add_conversions(self, variation_id, goal_ids, visitor_ids):
+    """Mark visitors as converted on every goal in goal_ids, and as having events."""
+    bitmap = self.to_bitmap(variation_id, visitor_ids)
+
+    for goal_id in goal_ids:
+      self.set(('goal', goal_id, variation_id), bitmap)
+
+    self.set(('events', variation_id), bitmap)
+
+  def add_segment(self, gae_id, variation_id, visitor_ids):
+    self.set(('segment', gae_id, variation_id), self.to_bitmap(variation_id, visitor_ids))
+
+  def converted(self, goal_id, variation_id):
+    return self._bitmaps.get(('goal', goal_id, variation_id), 0)
+
+  def everyone(self, variation_id):
+    return (1 << len(self._visitor_ids[variation_id])) - 1
+
+  def with_events(self, variation_id):
+    return self._bitmaps.get(('events', variation_id), 0)
+
+  def with_segment(self, gae_id, variation_id):
+    return self._bitmaps.get(('segment', gae_id, variation_id), 0)
+
+  def without_segment(self, gae_id, variation_id):
+    return self.everyone(variation_id) & ~self.with_segment(gae_id, variation_id)
+
+  def set(self, key, bitmap):
+    self._bitmaps[key] = self._bitmaps.get(key, 0) | bitmap
+
+  def to_bitmap(self, variation_id, visitor_ids):
+    """Build the bitmap in one pass over a string of bits; or-ing bits into a long one at a time is quadratic."""
+    size = len(self._visitor_ids[variation_id])
+
+    if not size:
+      return 0
+
+    positions = self._positions[variation_id]
+    bits      = bytearray('0' * size)
+
+    for visitor_id in visitor_ids:
+      bits[size - 1 - positions[visitor_id]] = '1'
+
+    return int(str(bits), 2)
+
+  def visitor_ids(self, variation_id, bitmap):
+    """Ids of the visitors set in the bitmap, in position order."""
+    visitor_ids = self._visitor_ids[variation_id]
+
+    return [visitor_ids[position] for position in self.positions(bitmap)]
+
+  @staticmethod
+  def count(bitmap):
+    return bin(bitmap).count('1')
+
+  @staticmethod
+  def positions(bitmap):
+    bits = bin(bitmap)[:1:-1]
+
+    return [position for position, bit in enumerate(bits) if bit == '1']
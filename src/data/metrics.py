@@ -0,0 +1,141 @@
+from array import array
+from contextlib import contextmanager
+
+import json
+import math
+import os
+import time
+
+
+class Metrics(object):
+  """Counters and timings of one run, reported as JSON or as a Prometheus textfile.
+
+    Every metric is a name plus labels, e.g. observe('insert', 0.2, table='event'). Timings keep
+    each observation (8 bytes), so percentiles are exact.
+  """
+  percentiles = (50, 90, 99)
+  prefix      = 'fake_data'
+
+  def __init__(self):
+    self.counters = {}
+    self.timings  = {}
+
+  def reset(self):
+    self.counters = {}
+    self.timings  = {}
+
+  def increment(self, name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    self.counters[key] = self.counters.get(key, 0) + value
+
+  def observe(self, name, seconds, **labels):
+    key = (name, tuple(sorted(labels.items())))
+
+    if key not in self.timings:
+      self.timings[key] = array('d')
+
+    self.timings[key].append(seconds)
+
+  @contextmanager
+  def timer(self, name, **labels):
+    """Observe the time spent in the with block."""
+    started = time.time()
+
+    try:
+      yield
+    finally:
+      self.observe(name, time.time() - started, **labels)
+
+  def merge(self, state):
+    """Add the counters and timings of another process, see state."""
+    counters, timings = state
+
+    for (name, labels), value in counters.iteritems():
+      self.increment(name, value, **dict(labels))
+
+    for (name, labels), seconds in timings.iteritems():
+      for value in seconds:
+        self.observe(name, value, **dict(labels))
+
+  def state(self):
+    """Picklable copy of every metric, e.g. to return from a worker process."""
+    return dict(self.counters), dict((key, list(seconds)) for key, seconds in self.timings.iteritems())
+
+  @classmethod
+  def percentile(cls, ordered, percent):
+    """Nearest-rank percentile of a sorted sequence."""
+    if not ordered:
+      return None
+
+    return ordered[max(0, int(math.ceil(percent / 100.0 * len(ordered))) - 1)]
+
+  def report(self):
+    """Every metric as plain data: {'counters': {name: [...]}, 'timings': {name: [...]}}."""
+    counters = {}
+    timings  = {}
+
+    for (name, labels), value in sorted(self.counters.iteritems()):
+      counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+
+    for (name, labels), seconds in sorted(self.timings.iteritems()):
+      ordered = sorted(seconds)
+      timing  = {'labels': dict(labels), 'count': len(ordered), 'seconds': sum(ordered), 'max': ordered[-1]}
+
+      for percent in self.percentiles:
+        timing['p{}'.format(percent)] = self.percentile(ordered, percent)
+
+      timings.setdefault(name, []).append(timing)
+
+    return {'counters': counters, 'timings': timings}
+
+  def write_json(self, path, **fields):
+    """Write the report, plus any extra fields (config, stages, ...), as JSON."""
+    report = self.report()
+    report.update(fields)
+
+    with open(path, 'w') as output:
+      json.dump(report, output, indent=2, sort_keys=True)
+
+  def write_prometheus(self, path):
+    """Write every metric in the Prometheus text format, for the node exporter's textfile collector.
+      Counters become {prefix}_{name}_total, timings summaries {prefix}_{name}_seconds.
+    """
+    lines  = []
+    report = self.report()
+
+    for name, values in sorted(report['counters'].iteritems()):
+      metric = '{}_{}_total'.format(self.prefix, name)
+      lines.append('# TYPE {} counter'.format(metric))
+
+      for value in values:
+        lines.append('{}{} {}'.format(metric, self.format_labels(value['labels']), value['value']))
+
+    for name, values in sorted(report['timings'].iteritems()):
+      metric = '{}_{}_seconds'.format(self.prefix, name)
+      lines.append('# TYPE {} summary'.format(metric))
+
+      for value in values:
+        for percent in self.percentiles:
+          labels = dict(value['labels'], quantile='{:g}'.format(percent / 100.0))
+          lines.append('{}{} {!r}'.format(metric, self.format_labels(labels), value['p{}'.format(percent)]))
+
+        lines.append('{}_sum{} {!r}'.format(metric, self.format_labels(value['labels']), value['seconds']))
+        lines.append('{}_count{} {}'.format(metric, self.format_labels(value['labels']), value['count']))
+
+    # Written under another name and renamed, so the collector never reads a partial file.
+    with open(path + '.tmp', 'w') as output:
+      output.write('\n'.join(lines) + '\n')
+
+    os.rename(path + '.tmp', path)
+
+  @staticmethod
+  def format_labels(labels):
+    if not labels:
+      return ''
+
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in sorted(labels.iteritems())) + '}'
+
+
+# The run's metrics. Like logging, one registry per process that every module records into.
+metrics = Metrics()
@@ -0,0 +1,96 @@
+import re
+
+
+# A step of EXPLAIN QUERY PLAN that reads a whole table or index, e.g. "SCAN v" or,
+# before SQLite 3.36, "SCAN TABLE visitor AS v USING COVERING INDEX ix_visitor_variation".
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?')
+
+# Tables each query may read in full, by alias and name. Queries that send or count every row have to
+# scan the table driving them; everything they join, and every filtered query, must use an index.
+# The conversion query may be driven by either of its inner join tables, but only one of them.
+ALLOWED_SCANS = {
+  'count_conversion_data':              ('e', 'event'),
+  'count_visitor_data':                 ('v', 'visitor'),
+  'query_conversion_data':              ('e', 'event', 'v', 'visitor'),
+  'query_converted_visitors':           (),
+  'query_event_goals':                  (),
+  'query_event_names':                  ('e', 'event'),
+  'query_segment_count_for_variation':  (),
+  'query_segment_ids':                  ('s', 'segment'),
+  'query_variation_ids':                ('v', 'visitor'),
+  'query_variation_visitor_ids':        (),
+  'query_visitor_count':                (),
+  'query_visitor_data':                 ('v', 'visitor'),
+  'query_visitors_for_baseline_events': ()
+}
+
+
+class QueryPlanError(Exception):
+  pass
+
+
+def full_scans(plan):
+  """(name, alias) of the tables a plan reads in full. SQLite reports either, depending on version
+    and query. Scans of subqueries are left out.
+  """
+  scans = []
+
+  for detail in plan:
+    match = FULL_SCAN.match(detail)
+
+    if match and match.group(1) != 'SUBQUERY':
+      scans.append(match.groups())
+
+  return scans
+
+
+def check_query_plans(database, config):
+  """Run every query the pipeline makes against a generated SQLite database and raise
+    QueryPlanError if one falls back to a full scan it isn't allowed in ALLOWED_SCANS.
+  """
+  queries      = database.queries()
+  variation_id = config['variation_ids'][0]
+  goal_name    = sorted(config['conversions'])[0]
+  segment_ids  = config['segment_ids']
+
+  calls = [
+    (queries['api'],     'count_conversion_data',              ()),
+    (queries['api'],     'count_visitor_data',                 ()),
+    (queries['api'],     'query_conversion_data',              (segment_ids,)),
+    (queries['api'],     'query_visitor_data',                 (segment_ids,)),
+    (queries['event'],   'query_event_goals',                  (variation_id,)),
+    (queries['event'],   'query_event_names',                  ()),
+    (queries['segment'], 'query_segment_count_for_variation',  (variation_id, segment_ids[0])),
+    (queries['segment'], 'query_segment_ids',                  ()),
+    (queries['visitor'], 'query_variation_ids',                ()),
+    (queries['visitor'], 'query_variation_visitor_ids',        (variation_id,)),
+    (queries['visitor'], 'query_visitor_count',                (variation_id,)),
+    (queries['visitor'], 'query_converted_visitors',           (goal_name, variation_id)),
+    (queries['visitor'], 'query_visitors_for_baseline_events', (variation_id, 1))
+  ]
+
+  failures = []
+
+  for query, name, args in calls:
+    query.plans = []
+    result      = getattr(query, name)(*args)
+
+    # The send queries are generators: the plan is recorded once the first row is asked for.
+    if hasattr(result, 'next'):
+      next(result, None)
+      result.close()
+
+    for statement, plan in query.plans:
+      scans = [table for table, alias in full_scans(plan)
+               if table not in ALLOWED_SCANS[name] and alias not in ALLOWED_SCANS[name]]
+
+      if len(full_scans(plan)) > 1:
+        scans.append('more than one table')
+
+      if scans:
+        failures.append('{} scans {}:\n  {}'.format(name, ', '.join(scans), '\n  '.join(plan)))
+
+    query.plans = None
+
+  if failures:
+    raise QueryPlanError('Queries fall back to a full scan:\n' + '\n'.join(failures))
@@ -0,0 +1,133 @@
+from contextlib import contextmanager
+
+import cProfile
+import gc
+import logging
+import os
+import pstats
+import re
+import StringIO
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+
+class StageProfiler(object):
+  """Profiles pipeline stages one at a time, for CPU and allocations. Disabled until enable is called.
+
+    Every stage gets {label}-{stage}.prof, a cProfile dump for pstats or snakeviz, and
+    {label}-{stage}.txt with the top functions of this project by cumulative time, the top
+    functions overall by own time, and the top allocations.
+
+    Allocations come from tracemalloc where it is available (Python 3, or the pytracemalloc
+    backport), with a .tracemalloc snapshot dump. Otherwise they are the objects the stage left
+    behind, counted by type through the garbage collector: no allocation tracing exists in Python 2.
+  """
+  # Functions whose file is under this directory are "ours" in the summary.
+  source_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+  def __init__(self):
+    self.directory = None
+    self.label     = None
+    self.top       = 25
+
+  @property
+  def enabled(self):
+    return self.directory is not None
+
+  def enable(self, directory, label, top=25):
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+    self.directory = directory
+    self.label     = label
+    self.top       = top
+
+  def disable(self):
+    self.directory = None
+
+  @contextmanager
+  def profile(self, name):
+    """Profile the with block as the stage name. Does nothing while disabled."""
+    if not self.enabled:
+      yield
+      return
+
+    path = os.path.join(self.directory, '{}-{}'.format(self.label, name))
+
+    objects = None if tracemalloc else self.count_objects()
+
+    if tracemalloc:
+      tracemalloc.start()
+
+    profile = cProfile.Profile()
+    profile.enable()
+
+    try:
+      yield
+    finally:
+      profile.disable()
+      profile.dump_stats(path + '.prof')
+
+      if tracemalloc:
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        snapshot.dump(path + '.tracemalloc')
+        allocations = self.format_snapshot(snapshot)
+      else:
+        allocations = self.format_object_growth(objects, self.count_objects())
+
+      with open(path + '.txt', 'w') as summary:
+        summary.write(self.format_stats(profile))
+        summary.write(allocations)
+
+      logging.info('Profile of %s written to %s.prof/.txt.', name, path)
+
+  @staticmethod
+  def count_objects():
+    """Live objects tracked by the garbage collector, by type name."""
+    gc.collect()
+
+    counts = {}
+
+    for obj in gc.get_objects():
+      name         = type(obj).__name__
+      counts[name] = counts.get(name, 0) + 1
+
+    return counts
+
+  def format_object_growth(self, before, after):
+    growth = sorted(((after[name] - before.get(name, 0), name) for name in after), reverse=True)
+    lines  = ['Objects left by the stage, by type (gc tracked objects only):']
+
+    for count, name in growth[:self.top]:
+      if count > 0:
+        lines.append('{:>12}  {}'.format(count, name))
+
+    return '\n'.join(lines) + '\n'
+
+  def format_snapshot(self, snapshot):
+    lines = ['Allocations still held at the end of the stage, by line:']
+
+    for statistic in snapshot.statistics('lineno')[:self.top]:
+      lines.append(str(statistic))
+
+    return '\n'.join(lines) + '\n'
+
+  def format_stats(self, profile):
+    output = StringIO.StringIO()
+    stats  = pstats.Stats(profile, stream=output)
+
+    output.write('Functions of this project, by cumulative time:\n')
+    stats.sort_stats('cumulative').print_stats(re.escape(self.source_dir), self.top)
+
+    output.write('All functions, by own time:\n')
+    stats.sort_stats('time').print_stats(self.top)
+
+    return output.getvalue()
+
+
+# Profiler the pipeline stages run under. Like metrics, one per process.
+profiler = StageProfiler()
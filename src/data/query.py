@@ -1,42 +1,133 @@
-from database import EventTable, SegmentTable, VisitorTable
+from database import EventGoalTable, EventTable, SegmentTable, VisitorSegmentTable, VisitorTable
+from metrics import metrics
+from sampling import Sampler
+
+import time
 
 class Query(object):
+  """Runs SQL for the Query subclasses. Time and rows of every query go to metrics, labelled with
+    the name each query method passes, its own.
+  """
+  # Rows fetched from the cursor at a time by stream()
+  chunk_size = 1000
+
   def __init__(self, database):
     self.database = database
+    self.sampler  = Sampler()
+
+    # When a list, the plan of every query run is appended to it, see plans.check_query_plans
+    self.plans = None
 
     self.tables = {
-      'event':         EventTable.__tablename__,
-      'segment':       SegmentTable.__tablename__,
-      'segment_temp1': 'SegmentAggregated',
-      'segment_temp2': 'SegmentManual',
-      'visitor':       VisitorTable.__tablename__
+      'event':           EventTable.__tablename__,
+      'event_goal':      EventGoalTable.__tablename__,
+      'segment':         SegmentTable.__tablename__,
+      'visitor':         VisitorTable.__tablename__,
+      'visitor_segment': VisitorSegmentTable.__tablename__
     }
 
-  def execute(self, sql_statements):
+  def execute(self, sql_statements, name):
+    """Rows of the last statement.
+
+    :param : name (str): label of the query in metrics
+    """
+    with metrics.timer('query', query=name):
+      connection    = self.database.engine.connect()
+      index_of_last = len(sql_statements) - 1
+      return_array  = []
+
+      for i, statement in enumerate(sql_statements):
+        if i == index_of_last:
+          self.explain(connection, statement)
+
+        result = connection.execute(statement)
+
+        if i == index_of_last:
+          for row in result:
+            return_array.append(row)
+
+      connection.close()
+
+    metrics.increment('query_rows', len(return_array), query=name)
+    return return_array
+
+  def explain(self, connection, statement):
+    """Record how SQLite will run the statement, one detail string per step of the plan."""
+    if self.plans is not None:
+      plan = connection.execute('EXPLAIN QUERY PLAN ' + statement).fetchall()
+      self.plans.append((statement, [row['detail'] for row in plan]))
+
+  def stream(self, sql_statements, name):
+    """Like execute, but yields the rows of the last statement as they are fetched from the cursor,
+      chunk_size at a time, so memory stays flat however many rows the query returns.
+      Only the time spent in SQLite counts as query time, not the consumer's.
+    """
+    started       = time.time()
+    seconds       = 0
+    count         = 0
     connection    = self.database.engine.connect()
     index_of_last = len(sql_statements) - 1
-    return_array  = []
 
-    for i, statement in enumerate(sql_statements):
-      result = connection.execute(statement)
+    try:
+      for i, statement in enumerate(sql_statements):
+        if i == index_of_last:
+          self.explain(connection, statement)
 
-      if i == index_of_last:
-        for row in result:
-          return_array.append(row)
+        result = connection.execute(statement)
 
-    connection.close()
-    return return_array
+        if i == index_of_last:
+          rows     = result.fetchmany(self.chunk_size)
+          seconds += time.time() - started
+
+          while rows:
+            count += len(rows)
+
+            for row in rows:
+              yield row
+
+            started  = time.time()
+            rows     = result.fetchmany(self.chunk_size)
+            seconds += time.time() - started
+    finally:
+      connection.close()
+
+      metrics.observe('query', seconds, query=name)
+      metrics.increment('query_rows', count, query=name)
 
 
 class VisitorQuery(Query):
+  """Visitors are picked in Python with the Sampler: fetching the candidates is a single scan,
+    where ORDER BY RANDOM() sorted the whole variation for every goal.
+  """
   def __init__(self, database):
     Query.__init__(self, database)
 
+    # Visitors don't change once generated, so each variation is only read once.
+    self.variation_visitors = {}
+
+  def get_variation_visitors(self, variation_id):
+    """Rows (id, time) of every visitor in a variation."""
+    if variation_id not in self.variation_visitors:
+      sql_statements = []
+
+      sql_statements.append('''SELECT v.id,
+                                      v.time
+                                FROM {} v
+                                WHERE v.variation = {}
+                                ORDER BY v.id'''.format(self.tables['visitor'],
+                                                        variation_id))
+
+      self.variation_visitors[variation_id] = self.execute(sql_statements, 'get_variation_visitors')
+
+    return self.variation_visitors[variation_id]
+
   def query_variation_ids(self):
-    sql = '''SELECT DISTINCT v.variation
-                FROM {} v'''.format(self.tables['visitor'])
+    sql_statements = []
 
-    return [x[0] for x in self.execute(sql)]
+    sql_statements.append('''SELECT DISTINCT v.variation
+                              FROM {} v'''.format(self.tables['visitor']))
+
+    return [x[0] for x in self.execute(sql_statements, 'query_variation_ids')]
 
   def query_visitor_count(self, variation_id):
     sql_statements = []
@@ -46,7 +137,7 @@ class VisitorQuery(Query):
                               WHERE v.variation = {};'''.format(self.tables['visitor'],
                                                                 variation_id))
 
-    result = self.execute(sql_statements)
+    result = self.execute(sql_statements, 'query_visitor_count')
 
     return result[0]['number']
 
@@ -58,114 +149,43 @@ class VisitorQuery(Query):
                               FROM {} v
                               GROUP BY variation'''.format(self.tables['visitor']))
 
-    return self.execute(sql_statements)
-
-  def query_visitors_for_baseline_events(self, variation_id, count):
-    sql_statements = []
+    return self.execute(sql_statements, 'query_visitor_count_for_variation')
 
-    sql_statements.append('''SELECT v.id,
-                                    v.time
-                              FROM {0} v
-                              WHERE v.variation = {1}
-                              ORDER BY RANDOM()
-                              LIMIT {2}'''.format(self.tables['visitor'],
-                                                 variation_id,
-                                                 count))
+  def query_visitors_for_baseline_events(self, variation_id, count, sampler=None):
+    """
+    :param : sampler (Sampler): draws the visitors, self.sampler by default
+    """
+    return (sampler or self.sampler).sample(self.get_variation_visitors(variation_id), count)
 
-    return self.execute(sql_statements)
-
-  def query_visitors_for_distributed_events(self, goal_name, variation_id, count):
+  def query_converted_visitors(self, goal_name, variation_id):
+    """Visitors of the variation that converted on the goal, with the time of their conversion, by visitor."""
     sql_statements = []
 
     sql_statements.append('''SELECT v.id,
-                                    v.time as visitor_time,
                                     e.time as event_time
                               FROM {} v
                               INNER JOIN {} e
                                 ON v.id = e.visitor_id
                               WHERE e.name = "{}"
                                 AND v.variation = {}
-                              ORDER BY RANDOM()
-                              LIMIT {}'''.format(self.tables['visitor'],
-                                                 self.tables['event'],
-                                                 goal_name,
-                                                 variation_id,
-                                                 count))
+                              ORDER BY v.id, e.time'''.format(self.tables['visitor'],
+                                                              self.tables['event'],
+                                                              goal_name,
+                                                              variation_id))
 
-    return self.execute(sql_statements)
+    return self.execute(sql_statements, 'query_converted_visitors')
 
-  def query_for_segment_default(self, segment_id, segment_count, variation_id):
+  def query_variation_visitor_ids(self, variation_id):
+    """Ids of every visitor in a variation, in visitor order."""
     sql_statements = []
 
     sql_statements.append('''SELECT v.id
                               FROM {} v
-                              LEFT JOIN (SELECT * FROM {} WHERE gae_id = {}) s
-                                ON v.id = s.visitor_id
                               WHERE v.variation = {}
-                                AND s.visitor_id IS NULL
-                              ORDER BY RANDOM()
-                              LIMIT {}'''.format(self.tables['visitor'],
-                                                 self.tables['segment'],
-                                                 segment_id,
-                                                 variation_id,
-                                                 segment_count))
-
-    return self.execute(sql_statements)
-
-  def query_for_segment_manual_conversions(self, segment_id, variation_id, goal_distribution):
-    sql_statements = []
-
-    sql_statements.append('''DROP TABLE IF EXISTS {}'''.format(self.tables['segment_temp2']))
-
-    sql_statements.append('''CREATE TEMPORARY TABLE {} (
-                              id INT NOT NULL
-                              )'''.format(self.tables['segment_temp2']))
-
-    for goal_id, conversion_count in goal_distribution.iteritems():
-      sql_statements.append('''INSERT INTO {} (id)
-                                SELECT v.id
-                                FROM {} v
-                                INNER JOIN {} e
-                                  ON v.id = e.visitor_id
-                                LEFT JOIN (SELECT * FROM {} WHERE gae_id = {}) s
-                                  ON v.id = s.visitor_id
-                                WHERE e.goal_ids LIKE '%{}%'
-                                  AND v.variation = {}
-                                  AND s.visitor_id IS NULL
-                                ORDER BY RANDOM()
-                                LIMIT {}'''.format(self.tables['segment_temp2'],
-                                                   self.tables['visitor'],
-                                                   self.tables['event'],
-                                                   self.tables['segment'],
-                                                   segment_id,
-                                                   goal_id,
-                                                   variation_id,
-                                                   conversion_count))
-
-    sql_statements.append('''SELECT DISTINCT id FROM {}'''.format(self.tables['segment_temp2']))
-
-    return self.execute(sql_statements)
-
-  def query_for_segment_manual_bounce(self, segment_id, variation_id, count):
-    sql_statements = []
+                              ORDER BY v.id'''.format(self.tables['visitor'],
+                                                      variation_id))
 
-    sql_statements.append('''SELECT v.id
-                                FROM {} v
-                                LEFT JOIN {} e
-                                  ON v.id = e.visitor_id
-                                LEFT JOIN (SELECT * FROM {} WHERE gae_id = {}) s
-                                  ON v.id = s.visitor_id
-                                WHERE e.visitor_id IS NULL
-                                  AND s.visitor_id IS NULL
-                                  AND v.variation = {}
-                              LIMIT {}'''.format(self.tables['visitor'],
-                                                 self.tables['event'],
-                                                 self.tables['segment'],
-                                                 segment_id,
-                                                 variation_id,
-                                                 count))
-
-    return self.execute(sql_statements)
+    return [row[0] for row in self.execute(sql_statements, 'query_variation_visitor_ids')]
 
 
 class EventQuery(Query):
@@ -178,7 +198,25 @@ class EventQuery(Query):
     sql_statements.append('''SELECT DISTINCT e.name
                               FROM {} e'''.format(self.tables['event']))
 
-    return self.execute(sql_statements)
+    return self.execute(sql_statements, 'query_event_names')
+
+  def query_event_goals(self, variation_id):
+    """(visitor_id, goal_id) of every distinct conversion in a variation."""
+    sql_statements = []
+
+    sql_statements.append('''SELECT DISTINCT e.visitor_id,
+                                    g.goal_id
+                              FROM {} v
+                              INNER JOIN {} e
+                                ON e.visitor_id = v.id
+                              INNER JOIN {} g
+                                ON g.event_id = e.id
+                              WHERE v.variation = {}'''.format(self.tables['visitor'],
+                                                               self.tables['event'],
+                                                               self.tables['event_goal'],
+                                                               variation_id))
+
+    return [(row[0], row[1]) for row in self.execute(sql_statements, 'query_event_goals')]
 
 
 class SegmentQuery(Query):
@@ -191,7 +229,7 @@ class SegmentQuery(Query):
     sql_statements.append('''SELECT DISTINCT s.gae_id
                               FROM {} s'''.format(self.tables['segment']))
 
-    return [x[0] for x in self.execute(sql_statements)]
+    return [x[0] for x in self.execute(sql_statements, 'query_segment_ids')]
 
   def query_segment_count_for_variation(self, variation_id, gae_id):
     sql_statements = []
@@ -201,70 +239,93 @@ class SegmentQuery(Query):
                               INNER JOIN {} v
                                 ON s.visitor_id = v.id
                               WHERE s.gae_id = {}
-                                AND v.variation = {}
-                              GROUP BY s.gae_id, v.variation'''.format(self.tables['segment'],
+                                AND v.variation = {}'''.format(self.tables['segment'],
                                                                        self.tables['visitor'],
                                                                        gae_id,
                                                                        variation_id))
 
-    return self.execute(sql_statements)[0]['count']
+    return self.execute(sql_statements, 'query_segment_count_for_variation')[0]['count']
 
 class APIQuery(Query):
+  """Segment values are read from the wide VisitorSegmentTable, one column per segment, which is
+    kept up to date as segments are inserted. Nothing is pivoted or aggregated at send time.
+    Rows are ordered by visitor, so the same data is sent in the same order however it was generated.
+    Their columns are in the order of event_columns, which every backend keeps.
+  """
   def __init__(self, database):
     Query.__init__(self, database)
 
   @staticmethod
-  def transpose_segments(segment_ids, table_prefix="", trailing_comma=True):
-    sql_snippet = ''
+  def event_columns(segment_ids):
+    """Names of the columns of query_visitor_data and query_conversion_data rows, in order."""
+    return ['u', 'variation_id', 'x'] + ['s{}'.format(segment_id) for segment_id in segment_ids] + ['t', 'n', 'g', 'v']
+
+  def select_segments(self, segment_ids, default):
+    """Select list of one s{segment_id} column per segment.
+
+    :param : default (str): SQL for the value of a visitor without a value for the segment
+    """
+    columns  = self.database.segment_columns()
+    snippets = []
 
     for segment_id in segment_ids:
-      sql_case = '''ifnull(group_concat(case when {1}.gae_id = {0}
-                                      then {1}.value
-                                      else NULL
-                                      end, ""), "false") as s{0},'''.format(segment_id,
-                                                                        table_prefix)
+      if segment_id in columns:
+        value = 'ifnull(w.s{0}, {1})'.format(segment_id, default)
+      else:
+        value = default
 
-      sql_snippet += sql_case
+      snippets.append('{} as s{},'.format(value, segment_id))
 
-    if not trailing_comma:
-      sql_snippet = sql_snippet[0:(len(sql_snippet)-1)]
+    return '\n'.join(snippets)
 
-    return sql_snippet
+  def count_conversion_data(self):
+    """Number of rows query_conversion_data will yield."""
+    sql_statements = []
 
-  def query_conversion_data(self, segment_ids):
+    sql_statements.append('''SELECT COUNT(*) as count
+                              FROM {} e'''.format(self.tables['event']))
+
+    return self.execute(sql_statements, 'count_conversion_data')[0]['count']
+
+  def count_visitor_data(self):
+    """Number of rows query_visitor_data will yield."""
     sql_statements = []
 
-    sql_statements.append('''CREATE TEMPORARY TABLE {} AS
-                              SELECT visitor_id,
-                                    {}
-                              FROM {} s
-                              GROUP BY visitor_id;'''.format(self.tables['segment_temp1'],
-                                                             self.transpose_segments(segment_ids,
-                                                                                      table_prefix="s",
-                                                                                      trailing_comma=False),
-                                                             self.tables['segment']))
+    sql_statements.append('''SELECT COUNT(*) as count
+                              FROM {} v'''.format(self.tables['visitor']))
+
+    return self.execute(sql_statements, 'count_visitor_data')[0]['count']
+
+  def query_conversion_data(self, segment_ids):
+    """Generator over one row per conversion event.
+      Visitors without any segment get NULL segment values, the others 'false' for missing ones.
+    """
+    sql_statements = []
 
     sql_statements.append('''SELECT v.id as u,
                                     v.variation as variation_id,
                                     v.experiment_id as x,
-                                    s.*,
+                                    {}
                                     e.time as t,
                                     e.name as n,
                                     e.goal_ids as g,
                                     e.revenue as v
                               FROM {} v
-                              LEFT JOIN {} s
-                                ON v.id = s.visitor_id
                               INNER JOIN {} e
                                 ON v.id = e.visitor_id
-                              GROUP BY v.id, v.variation, v.experiment_id, e.time,
-                                    e.name, e.goal_ids, e.revenue;'''.format(self.tables['visitor'],
-                                                                             self.tables['segment_temp1'],
-                                                                             self.tables['event']))
+                              LEFT JOIN {} w
+                                ON v.id = w.visitor_id
+                              ORDER BY e.visitor_id, e.name, e.time'''.format(
+                                  self.select_segments(segment_ids,
+                                                       "CASE WHEN w.visitor_id IS NULL THEN NULL ELSE 'false' END"),
+                                  self.tables['visitor'],
+                                  self.tables['event'],
+                                  self.tables['visitor_segment']))
 
-    return self.execute(sql_statements)
+    return self.stream(sql_statements, 'query_conversion_data')
 
   def query_visitor_data(self, segment_ids):
+    """Generator over one 'register' row per visitor."""
     sql_statements = []
 
     sql_statements.append('''SELECT v.id as u,
@@ -276,11 +337,10 @@ class APIQuery(Query):
                                     v.experiment_id as g,
                                     0 as v
                                 FROM {} v
-                                LEFT JOIN {} s
-                                  ON v.id = s.visitor_id
-                                GROUP BY v.id, v.variation, v.experiment_id, v.time,
-                                      n, g, v'''.format(self.transpose_segments(segment_ids, table_prefix="s"),
-                                                        self.tables['visitor'],
-                                                        self.tables['segment']))
-
-    return self.execute(sql_statements)
+                                LEFT JOIN {} w
+                                  ON v.id = w.visitor_id
+                                ORDER BY v.id'''.format(self.select_segments(segment_ids, "'false'"),
+                                                                    self.tables['visitor'],
+                                                                    self.tables['visitor_segment']))
+
+    return self.stream(sql_statements, 'query_visitor_data')
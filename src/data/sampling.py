@@ -0,0 +1,123 @@
+from bisect import bisect_right
+from functools import partial
+from hashlib import md5
+
+import random
+
+
+class RandomStreams(object):
+  """Independent random number generators derived from one seed, one per key.
+
+    A stream only depends on the seed and its key, e.g. ('baseline', goal_name, variation_id). So
+    the draws for a variation are the same whether it is generated alone in a shard or with the
+    rest of the experiment, and whatever order the other keys are generated in.
+  """
+  def __init__(self, seed=None):
+    """
+    :param : seed (int): None picks a random seed
+    """
+    self.seed = seed if seed is not None else random.randrange(2 ** 32)
+
+  def get(self, *key):
+    """A new generator for the key. Every call with the same key starts the same sequence."""
+    return random.Random(int(md5(repr((self.seed,) + key)).hexdigest(), 16))
+
+
+class Sampler(object):
+  """Draws k items without replacement in O(k) instead of randomly sorting the whole population.
+
+    Uses a sparse partial Fisher-Yates shuffle: only the swapped positions are remembered, so
+    the population is never copied or shuffled.
+  """
+  def __init__(self, rng=None):
+    self.rng = rng if rng is not None else random
+
+  def sample(self, population, count):
+    """Random subset of at most count items from a sequence, in random order.
+
+    :param : population (sequence): list, array or xrange of candidates
+    :param : count (int): number of items to draw (ORDER BY RANDOM() LIMIT count)
+    """
+    return [population[position] for position in self.sample_positions(len(population), count)]
+
+  def sample_positions(self, size, count):
+    """Distinct positions in [0, size), in random order."""
+    count = max(0, min(int(count), size))
+
+    positions = []
+    swaps     = {}
+    rng       = self.rng.random
+
+    for i in xrange(count):
+      j = i + int(rng() * (size - i))
+
+      positions.append(swaps.get(j, j))
+      swaps[j] = swaps.get(i, i)
+
+    return positions
+
+  def allocate(self, count, size, concentration=1.0):
+    """Split count into size random non-negative parts that sum to exactly count.
+
+      Each part gets a gamma(concentration) weight and its floor share of count; the rest is handed
+      out one at a time in proportion to the weights. A high concentration spreads count evenly,
+      1 gives geometric-like parts and below 1 leaves most of count on a few parts.
+
+    :param : count (int): total to split
+    :param : size (int): number of parts
+    :param : concentration (float): gamma shape of the weights
+    """
+    if size <= 0:
+      return []
+
+    gamma      = self.rng.gammavariate
+    weights    = [gamma(concentration, 1.0) for _ in xrange(size)]
+    cumulative = []
+    total      = 0.0
+
+    for weight in weights:
+      total += weight
+      cumulative.append(total)
+
+    if not total:
+      weights, cumulative, total = [1.0] * size, range(1, size + 1), float(size)
+
+    parts = [int(count * weight / total) for weight in weights]
+    rng   = self.rng.random
+
+    for _ in xrange(count - sum(parts)):
+      parts[bisect_right(cumulative, rng() * total)] += 1
+
+    return parts
+
+
+# Distributions the config can name, e.g. for revenue: random.Random method, parameters in argument order.
+DISTRIBUTIONS = {
+  'exponential': ('expovariate',    ('rate',)),
+  'gamma':       ('gammavariate',   ('alpha', 'beta')),
+  'lognormal':   ('lognormvariate', ('mu', 'sigma')),
+  'normal':      ('gauss',          ('mu', 'sigma')),
+  'weibull':     ('weibullvariate', ('alpha', 'beta'))
+}
+
+
+def get_distribution(rng, parameters):
+  """Function of no arguments that draws one variate of the distribution in parameters from rng.
+
+    parameters come from the config, e.g. {'alpha': 4, 'beta': 100} or
+    {'distribution': 'lognormal', 'mu': 3, 'sigma': 0.5}. The distribution defaults to gamma.
+    Raises ValueError for an unknown distribution or a missing parameter.
+  """
+  distribution = parameters.get('distribution', 'gamma')
+
+  if distribution not in DISTRIBUTIONS:
+    raise ValueError('Unknown distribution {}, expected one of {}.'.format(
+      distribution, ', '.join(sorted(DISTRIBUTIONS))))
+
+  method, names = DISTRIBUTIONS[distribution]
+  missing       = [name for name in names if name not in parameters]
+
+  if missing:
+    raise ValueError('The {} distribution needs {}.'.format(distribution, ', '.join(missing)))
+
+  return partial(getattr(rng, method), *[parameters[name] for name in names])
@@ -0,0 +1,175 @@
+from eventlet.event import Event
+
+import eventlet
+import heapq
+import json
+import random
+import time
+
+
+class SendError(Exception):
+  """A failed send. retry is False when sending the same event again can't succeed (e.g. HTTP 400)."""
+  def __init__(self, message, retry=True):
+    Exception.__init__(self, message)
+    self.retry = retry
+
+
+class SendScheduler(object):
+  """Runs sends on greenlets with adaptive concurrency, an optional rate limit and retries.
+
+    Concurrency follows additive-increase/multiplicative-decrease: every fast success adds
+    1/concurrency (about one slot per round of requests), every error or response slower than
+    latency_target multiplies it by decrease_factor, at most once per round trip.
+
+    Failed sends are retried with exponential backoff. Events that fail retries + 1 times, or fail
+    in a way retrying can't fix, are appended to the dead_letter file as JSON lines, with the error
+    and the number of attempts.
+  """
+  decrease_factor = 0.5
+
+  def __init__(self, send, concurrency=10, min_concurrency=1, max_concurrency=50, latency_target=1.0,
+               max_rate=None, retries=5, backoff=1.0, max_backoff=60, dead_letter='dead_letter.ndjson'):
+    """
+    :param : send (callable): sends one event, raises SendError on failure
+    :param : max_rate (float): maximum events per second, None for no limit
+    :param : backoff (float): seconds before the first retry, doubled for each further retry
+    """
+    self.send            = send
+    self.concurrency     = float(concurrency)
+    self.min_concurrency = min_concurrency
+    self.max_concurrency = max_concurrency
+    self.latency_target  = latency_target
+    self.max_rate        = max_rate
+    self.retries         = retries
+    self.backoff         = backoff
+    self.max_backoff     = max_backoff
+    self.dead_letter     = dead_letter
+
+    self.in_flight = 0
+    self.latency   = None
+
+    self.stats = {
+      'dead':      0,
+      'errors':    0,
+      'retried':   0,
+      'succeeded': 0
+    }
+
+    self._dead_letter_file = None
+    self._last_decrease    = 0
+    self._next_send        = 0
+    self._retry_queue      = []
+    self._retry_sequence   = 0
+    self._wakeup           = Event()
+
+  def submit(self, event):
+    """Send an event once a slot (and the rate limit) allows it. Due retries go first."""
+    self.dispatch_retries()
+    self.acquire()
+    self.dispatch(event, 0)
+
+  def drain(self):
+    """Wait until every submitted event has succeeded or reached the dead letter file."""
+    while self.in_flight or self._retry_queue:
+      self.dispatch_retries()
+
+      if self._retry_queue:
+        self.wait(max(0, self._retry_queue[0][0] - time.time()))
+      elif self.in_flight:
+        self.wait()
+
+    self.close()
+
+  def close(self):
+    """Close the dead letter file, e.g. once sending was interrupted. Safe to call more than once."""
+    if self._dead_letter_file:
+      self._dead_letter_file.close()
+      self._dead_letter_file = None
+
+  def acquire(self):
+    while self.in_flight >= int(self.concurrency):
+      self.wait()
+
+    if self.max_rate:
+      now   = time.time()
+      delay = self._next_send - now
+
+      if delay > 0:
+        eventlet.sleep(delay)
+
+      self._next_send = max(now, self._next_send) + 1.0 / self.max_rate
+
+  def decrease(self):
+    now = time.time()
+
+    # The errors of one burst of requests should only halve concurrency once.
+    if now - self._last_decrease < (self.latency or 0):
+      return
+
+    self._last_decrease = now
+    self.concurrency    = max(self.min_concurrency, self.concurrency * self.decrease_factor)
+
+  def dispatch(self, event, attempt):
+    self.in_flight += 1
+    eventlet.spawn_n(self.run, event, attempt)
+
+  def dispatch_retries(self):
+    while self._retry_queue and self._retry_queue[0][0] <= time.time():
+      _, _, event, attempt = heapq.heappop(self._retry_queue)
+
+      self.acquire()
+      self.dispatch(event, attempt)
+
+  def on_failure(self, event, attempt, error):
+    self.stats['errors'] += 1
+    self.decrease()
+
+    if error.retry and attempt < self.retries:
+      delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1)
+
+      self._retry_sequence += 1
+      heapq.heappush(self._retry_queue, (time.time() + delay, self._retry_sequence, event, attempt + 1))
+
+      self.stats['retried'] += 1
+    else:
+      self.write_dead_letter(event, error, attempt + 1)
+
+  def on_success(self, latency):
+    self.stats['succeeded'] += 1
+    self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+
+    if latency > self.latency_target:
+      self.decrease()
+    else:
+      self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+  def run(self, event, attempt):
+    started = time.time()
+
+    try:
+      self.send(event)
+    except SendError as error:
+      self.on_failure(event, attempt, error)
+    except Exception as error:
+      self.on_failure(event, attempt, SendError(repr(error), retry=False))
+    else:
+      self.on_success(time.time() - started)
+    finally:
+      self.in_flight -= 1
+
+      if not self._wakeup.ready():
+        self._wakeup.send()
+
+  def wait(self, timeout=None):
+    """Sleep until a send finishes, or timeout seconds."""
+    self._wakeup = Event()
+
+    with eventlet.Timeout(timeout, False):
+      self._wakeup.wait()
+
+  def write_dead_letter(self, event, error, attempts):
+    if not self._dead_letter_file:
+      self._dead_letter_file = open(self.dead_letter, 'a')
+
+    self._dead_letter_file.write(json.dumps({'attempts': attempts, 'error': str(error), 'event': event}) + '\n')
+    self.stats['dead'] += 1
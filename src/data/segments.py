@@ -1,52 +1,74 @@
 from database import SegmentTable
 from experiments import Experiment
+from membership import MembershipIndex
+from sampling import Sampler
 
 import math
 
 
-class Segment(object):
-  def __init__(self, visitor_id, gae_id, value):
-    self._gae_id     = gae_id
-    self._value      = value
-    self._visitor_id = visitor_id
+class SegmentCollection(Experiment):
+  """Assigns segment values to visitors.
+    Who already has a value, and who converted on which goal, is tracked in a MembershipIndex,
+    so picking the visitors for a segment value never goes back to the database.
+    Every insert also updates the visitors' wide segment records (one value per gae_id) the send
+    queries read, so those stay current as segments are assigned.
 
-  def format(self):
-    if self._value == 0:
-      formatted_value = 'false'
-    elif self._value == 1:
-      formatted_value = 'true'
-    else:
-      formatted_value = self._value
+    Each segment/variation draws from its own stream, ('segment', segment_id, variation_id).
+    Segments are inserted as columns, at most batch_size rows at a time, and only counted.
+  """
+  def __init__(self, config, database, streams=None, batch_size=10000):
+    Experiment.__init__(self, config, database, streams)
 
-    return {
-      'visitor_id': self._visitor_id,
-      'gae_id':     self._gae_id,
-      'value':      formatted_value
-    }
+    self._batch_size = batch_size
+    self._database   = database
+    self._index      = None
+    self._samplers   = {}
 
-  @property
-  def gae_id(self):
-    return self._gae_id
+    self.rows = 0
 
   @property
-  def value(self):
-    return self._value
+  def database(self):
+    return self._database
 
   @property
-  def visitor_id(self):
-    return self._visitor_id
+  def index(self):
+    return self._index
 
-class SegmentCollection(Experiment):
-  def __init__(self, config, database):
-    Experiment.__init__(self, config, database)
+  def get_sampler(self, segment_id, variation_id):
+    key = (segment_id, variation_id)
 
-    self._database = database
+    if key not in self._samplers:
+      self._samplers[key] = Sampler(self.streams.get('segment', segment_id, variation_id))
 
-  @property
-  def database(self):
-    return self._database
+    return self._samplers[key]
+
+  def assign(self, segment_id, segment_value, variation_id, visitor_ids):
+    self.index.add_segment(segment_id, variation_id, visitor_ids)
+
+    for first in xrange(0, len(visitor_ids), self._batch_size):
+      self.insert_segments(self.get_segments(segment_id, segment_value, visitor_ids[first:first + self._batch_size]))
+
+  def build_index(self):
+    """Index every variation's visitors and the goals they converted on."""
+    index = MembershipIndex()
+
+    for variation_id in self.variation_ids:
+      index.add_variation(variation_id, self.query['visitor'].query_variation_visitor_ids(variation_id))
+
+      visitors_by_goal = {}
+
+      for visitor_id, goal_id in self.query['event'].query_event_goals(variation_id):
+        visitors_by_goal.setdefault(goal_id, []).append(visitor_id)
+
+      for goal_id, visitor_ids in visitors_by_goal.iteritems():
+        index.add_conversions(variation_id, [goal_id], visitor_ids)
+
+    return index
 
   def generate(self):
+    """Entry point. Inserts every segment value and returns the number of rows inserted."""
+    self._index = self.build_index()
+
     for segment_id in self.segments['default']:
       self.generate_default(segment_id)
 
@@ -54,12 +76,15 @@ class SegmentCollection(Experiment):
       for segment_id, segment_distribution in self.segments['manual'].iteritems():
         self.generate_manual(segment_id, segment_distribution)
 
+    return self.rows
+
   def generate_default(self, segment_id):
     for segment_value, ratio in self.segments['default'][segment_id].iteritems():
-      visitors = self.get_visitors_for_segment_value(segment_id, ratio)
-      segments = self.get_segments(segment_id, segment_value, visitors)
+      for variation_id, distribution in self.visitors.iteritems():
+        segment_count = math.ceil(distribution['total'] * ratio)
+        visitors      = self.get_visitors_for_segment_value(segment_id, segment_count, variation_id)
 
-      self.insert_segments(segments)
+        self.assign(segment_id, segment_value, variation_id, visitors)
 
   def generate_manual(self, segment_id, segment_dist):
     for segment_value, segment_value_dist in segment_dist.iteritems():
@@ -68,50 +93,54 @@ class SegmentCollection(Experiment):
         self.generate_manual_bounces(segment_id, segment_value, variation_id, variation_dist)
 
   def generate_manual_bounces(self, segment_id, segment_value, variation_id, variation_dist):
-    conversion_total_count = self.query['segment'].query_segment_count_for_variation(variation_id, segment_id)
+    conversion_total_count = self.index.count(self.index.with_segment(segment_id, variation_id))
     bounce_count = variation_dist['total'] - conversion_total_count
 
     if bounce_count > 0:
-      bounce_visitors = self.query['visitor'].query_for_segment_manual_bounce(segment_id,
-                                                                              variation_id,
-                                                                              bounce_count)
+      bounced = self.index.without_segment(segment_id, variation_id) & ~self.index.with_events(variation_id)
 
-      bounce_segments = self.get_segments(segment_id, segment_value, bounce_visitors)
+      # The first visitors without any event, in visitor order.
+      bounce_visitors = self.index.visitor_ids(variation_id, bounced)[:bounce_count]
 
-      self.insert_segments(bounce_segments)
+      self.assign(segment_id, segment_value, variation_id, bounce_visitors)
 
   def generate_manual_conversions(self, segment_id, segment_value, variation_id, variation_dist):
-    conversion_visitors = self.query['visitor'].query_for_segment_manual_conversions(segment_id,
-                                                                                     variation_id,
-                                                                                     variation_dist['conversions'])
+    unassigned          = self.index.without_segment(segment_id, variation_id)
+    conversion_visitors = set()
 
-    conversion_segments = self.get_segments(segment_id, segment_value, conversion_visitors)
+    for goal_id, conversion_count in variation_dist['conversions'].iteritems():
+      converted = self.index.visitor_ids(variation_id, self.index.converted(goal_id, variation_id) & unassigned)
+      conversion_visitors.update(self.get_sampler(segment_id, variation_id).sample(converted, conversion_count))
 
-    self.insert_segments(conversion_segments)
+    self.assign(segment_id, segment_value, variation_id, sorted(conversion_visitors))
 
   @staticmethod
-  def get_segments(segment_id, segment_value, visitors):
-    segments = []
-
-    for visitor in visitors:
-      segment = Segment(visitor['id'], segment_id, segment_value)
-      segments.append(segment.format())
+  def get_segments(segment_id, segment_value, visitor_ids):
+    """Columns of one segment value for every visitor in visitor_ids."""
+    return {
+      'visitor_id': list(visitor_ids),
+      'gae_id':     [segment_id] * len(visitor_ids),
+      'value':      [SegmentCollection.format_value(segment_value)] * len(visitor_ids)
+    }
 
-    return segments
+  @staticmethod
+  def format_value(value):
+    """Booleans from the config are stored and sent as 'true' and 'false'."""
+    if value == 0:
+      return 'false'
+    elif value == 1:
+      return 'true'
 
-  def get_visitors_for_segment_value(self, segment_id, ratio):
-    visitors = []
+    return value
 
-    for variation_id, distribution in self.visitors.iteritems():
-      segment_count          = math.ceil(distribution['total'] * ratio)
-      visitors_for_variation = self.query['visitor'].query_for_segment_default(segment_id,
-                                                                             segment_count,
-                                                                             variation_id)
+  def get_visitors_for_segment_value(self, segment_id, segment_count, variation_id):
+    """Random visitors of the variation that don't have a value for the segment yet."""
+    unassigned = self.index.without_segment(segment_id, variation_id)
 
-      visitors += visitors_for_variation
+    sampler    = self.get_sampler(segment_id, variation_id)
 
-    return visitors
+    return sampler.sample(self.index.visitor_ids(variation_id, unassigned), segment_count)
 
   def insert_segments(self, segments):
     self.database.insert(SegmentTable, segments)
-    self.data += segments
+    self.rows += len(segments['visitor_id'])
@@ -0,0 +1,52 @@
+from database import EventTable, SegmentTable, VisitorTable
+
+import copy
+
+
+# Columns carried from a shard to the merged database. Event and segment ids are left out:
+# the merged database numbers those rows itself.
+SHARD_COLUMNS = (
+  (VisitorTable, ('experiment_id', 'id', 'number', 'time', 'variation')),
+  (EventTable,   ('visitor_id', 'goal_ids', 'name', 'time', 'revenue')),
+  (SegmentTable, ('visitor_id', 'gae_id', 'value'))
+)
+
+
+def export_shard(database):
+  """Every generated row of a shard's database, as columns per table."""
+  return [(table, database.export_columns(table, names)) for table, names in SHARD_COLUMNS]
+
+
+def merge_shard(database, shard):
+  """Insert an exported shard. Returns the number of rows inserted."""
+  rows = 0
+
+  for table, columns in shard:
+    database.insert_columns(table, columns)
+    rows += len(columns.itervalues().next())
+
+  return rows
+
+
+def shard_config(config, variation_id):
+  """Copy of the config that only generates data for one variation.
+
+    Variations never share visitors, and every count in the config is given per variation,
+    so the shards of an experiment can be generated independently and merged afterwards.
+  """
+  shard = copy.deepcopy(config)
+
+  shard['variation_ids'] = [variation_id]
+  shard['visitors']      = {variation_id: config['visitors'][variation_id]}
+
+  for goal_data in shard['conversions'].itervalues():
+    goal_data['counts'] = dict((key, counts) for key, counts in goal_data['counts'].iteritems()
+                               if key == variation_id)
+
+  for segment_distribution in shard['segments'].get('manual', {}).itervalues():
+    for segment_value, variation_distribution in segment_distribution.iteritems():
+      segment_distribution[segment_value] = dict((key, distribution)
+                                                 for key, distribution in variation_distribution.iteritems()
+                                                 if key == variation_id)
+
+  return shard
@@ -0,0 +1,286 @@
+from array import array
+from database import EventTable, SegmentTable, VisitorTable
+from itertools import izip
+from metrics import metrics
+from sampling import Sampler
+from sqlalchemy import Integer
+
+
+def integer_column():
+  """Typed array for integer columns. Ids need 64 bits, fall back to a list where longs are narrower."""
+  return array('l') if array('l').itemsize >= 8 else []
+
+
+class ColumnarTable(object):
+  """Array-backed columns for one table, laid out from the SQLAlchemy table definition."""
+  def __init__(self, table):
+    self.name    = table.__tablename__
+    self.schema  = table.__table__.columns
+    self.columns = {}
+    self.length  = 0
+
+    for column in self.schema:
+      self.columns[column.name] = integer_column() if isinstance(column.type, Integer) else []
+
+  def __len__(self):
+    return self.length
+
+  def append(self, columns):
+    """Append a dict of equally sized columns. Returns the (start, stop) row range written."""
+    count = len(columns.itervalues().next())
+    start = self.length
+
+    for column in self.schema:
+      if column.name in columns:
+        self.columns[column.name].extend(columns[column.name])
+      elif column.primary_key:
+        self.columns[column.name].extend(xrange(start + 1, start + count + 1))
+      else:
+        default = column.default.arg if column.default is not None else None
+        self.columns[column.name].extend([default] * count)
+
+    self.length += count
+
+    return start, self.length
+
+
+class ColumnarStore(object):
+  """In-memory generation store with the same interface as Database.
+
+    Visitors, events and segments are kept as array-backed columns. Each variation's visitors
+    occupy one contiguous row range, which the queries use instead of SQL filters and joins.
+    Use Database (SQLite) to inspect generated data with SQL while debugging.
+  """
+  def __init__(self, db_name):
+    self.db_name = db_name
+    self.create_tables()
+
+  def create_tables(self, segment_ids=()):
+    """Reset every table and index. segment_ids is only taken for Database's interface."""
+    self.tables = {
+      EventTable.__tablename__:   ColumnarTable(EventTable),
+      SegmentTable.__tablename__: ColumnarTable(SegmentTable),
+      VisitorTable.__tablename__: ColumnarTable(VisitorTable)
+    }
+
+    self.visitor_rows     = {}
+    self.variation_ranges = {}
+    self.event_rows       = {}
+    self.segment_values   = {}
+    self.segment_records  = {}
+
+  def insert(self, table, rows):
+    """Accepts a list of row dicts or a dict of columns, like Database.insert."""
+    if type(rows) is dict:
+      self.insert_columns(table, rows)
+    elif type(rows) is list and len(rows):
+      self.insert_columns(table, dict((name, [row[name] for row in rows]) for name in rows[0]))
+
+  def insert_columns(self, table, columns):
+    names = columns.keys()
+
+    if not names or not len(columns[names[0]]):
+      return
+
+    with metrics.timer('insert', table=table.__tablename__):
+      start, stop = self.tables[table.__tablename__].append(columns)
+
+      if table is VisitorTable:
+        self.index_visitors(start, stop)
+      elif table is EventTable:
+        self.index_events(start, stop)
+      elif table is SegmentTable:
+        self.index_segments(start, stop)
+
+    metrics.increment('rows_inserted', stop - start, table=table.__tablename__)
+
+  def export_columns(self, table, names):
+    """The named columns of a table, like Database.export_columns."""
+    columns = self.tables[table.__tablename__].columns
+
+    return dict((name, columns[name]) for name in names)
+
+  def index_events(self, start, stop):
+    visitors   = self.tables['visitor'].columns
+    events     = self.tables['event'].columns
+    visitor_id = events['visitor_id']
+    name       = events['name']
+
+    for row in xrange(start, stop):
+      variation_id = visitors['variation'][self.visitor_rows[visitor_id[row]]]
+      self.event_rows.setdefault((name[row], variation_id), []).append(row)
+
+  def index_segments(self, start, stop):
+    segments = self.tables['segment'].columns
+
+    for row in xrange(start, stop):
+      gae_id     = segments['gae_id'][row]
+      visitor_id = segments['visitor_id'][row]
+      value      = segments['value'][row]
+
+      self.segment_values.setdefault(gae_id, {})[visitor_id] = value
+      self.segment_records.setdefault(visitor_id, {})['s{}'.format(gae_id)] = value
+
+  def index_visitors(self, start, stop):
+    """Record row positions by id and the contiguous row range of each variation."""
+    visitors  = self.tables['visitor'].columns
+    variation = visitors['variation']
+
+    self.visitor_rows.update(izip(visitors['id'][start:stop], xrange(start, stop)))
+
+    run_start = start
+    for row in xrange(start + 1, stop + 1):
+      if row == stop or variation[row] != variation[run_start]:
+        self.extend_variation_range(variation[run_start], run_start, row)
+        run_start = row
+
+  def finish_load(self):
+    """Nothing to do, the store is indexed as rows are inserted. See Database.finish_load."""
+    pass
+
+  def extend_variation_range(self, variation_id, start, stop):
+    if variation_id not in self.variation_ranges:
+      self.variation_ranges[variation_id] = (start, stop)
+    elif self.variation_ranges[variation_id][1] == start:
+      self.variation_ranges[variation_id] = (self.variation_ranges[variation_id][0], stop)
+    else:
+      raise ValueError('Visitors must be inserted grouped by variation.')
+
+  def queries(self):
+    return {
+      'api':     ColumnarAPIQuery(self),
+      'event':   ColumnarEventQuery(self),
+      'segment': ColumnarSegmentQuery(self),
+      'visitor': ColumnarVisitorQuery(self)
+    }
+
+  def variation_rows(self, variation_id):
+    return xrange(*self.variation_ranges.get(variation_id, (0, 0)))
+
+
+class ColumnarQuery(object):
+  """Answers the same questions as query.Query, directly from a ColumnarStore."""
+  def __init__(self, database):
+    self.database = database
+    self.sampler  = Sampler()
+
+  @property
+  def events(self):
+    return self.database.tables['event'].columns
+
+  @property
+  def segments(self):
+    return self.database.tables['segment'].columns
+
+  @property
+  def visitors(self):
+    return self.database.tables['visitor'].columns
+
+
+class ColumnarVisitorQuery(ColumnarQuery):
+  def query_variation_ids(self):
+    return self.database.variation_ranges.keys()
+
+  def query_visitor_count(self, variation_id):
+    rows = self.database.variation_rows(variation_id)
+    return max(self.visitors['number'][row] for row in rows) if rows else None
+
+  def query_visitor_count_for_variation(self):
+    return [{'variation': variation_id, 'var_count': stop - start}
+            for variation_id, (start, stop) in self.database.variation_ranges.iteritems()]
+
+  def query_visitors_for_baseline_events(self, variation_id, count, sampler=None):
+    rows = (sampler or self.sampler).sample(self.database.variation_rows(variation_id), count)
+
+    return [{'id': self.visitors['id'][row], 'time': self.visitors['time'][row]} for row in rows]
+
+  def query_converted_visitors(self, goal_name, variation_id):
+    visitor_ids = self.events['visitor_id']
+    event_times = self.events['time']
+    rows        = sorted(self.database.event_rows.get((goal_name, variation_id), []),
+                         key=lambda row: (visitor_ids[row], event_times[row]))
+
+    return [{'id': visitor_ids[row], 'event_time': event_times[row]} for row in rows]
+
+  def query_variation_visitor_ids(self, variation_id):
+    start, stop = self.database.variation_ranges.get(variation_id, (0, 0))
+
+    return self.visitors['id'][start:stop]
+
+
+class ColumnarEventQuery(ColumnarQuery):
+  def query_event_goals(self, variation_id):
+    goals = set()
+
+    for (name, event_variation_id), rows in self.database.event_rows.iteritems():
+      if event_variation_id == variation_id:
+        goals.update((self.events['visitor_id'][row], int(goal_id))
+                     for row in rows
+                     for goal_id in str(self.events['goal_ids'][row]).split(','))
+
+    return list(goals)
+
+  def query_event_names(self):
+    return [{'name': name} for name in set(self.events['name'])]
+
+
+class ColumnarSegmentQuery(ColumnarQuery):
+  def query_segment_ids(self):
+    return self.database.segment_values.keys()
+
+  def query_segment_count_for_variation(self, variation_id, gae_id):
+    variation_rows = self.database.variation_ranges.get(variation_id, (0, 0))
+    visitor_rows   = self.database.visitor_rows
+
+    return sum(1 for visitor_id in self.database.segment_values.get(gae_id, {})
+               if variation_rows[0] <= visitor_rows[visitor_id] < variation_rows[1])
+
+
+class ColumnarAPIQuery(ColumnarQuery):
+  """Builds the same rows as query.APIQuery, as tuples in the order of APIQuery.event_columns:
+    u, variation_id, x, s{segment_id}..., t, n, g, v.
+  """
+  def get_segment_columns(self, visitor_id, keys, default):
+    record = self.database.segment_records.get(visitor_id, {})
+
+    return tuple(record.get(key, default) for key in keys)
+
+  def count_conversion_data(self):
+    return len(self.database.tables['event'])
+
+  def count_visitor_data(self):
+    return len(self.database.tables['visitor'])
+
+  def query_conversion_data(self, segment_ids):
+    """Generator over one row per conversion event."""
+    visitor = self.database.visitor_rows
+    records = self.database.segment_records
+    events  = self.events
+    keys    = ['s{}'.format(x) for x in segment_ids]
+
+    # In visitor order like the SQL version, whatever order the events were inserted in.
+    rows = sorted(xrange(len(self.database.tables['event'])),
+                  key=lambda row: (events['visitor_id'][row], events['name'][row], events['time'][row]))
+
+    for row in rows:
+      visitor_id  = events['visitor_id'][row]
+      visitor_row = visitor[visitor_id]
+
+      # Visitors without any segment have no segment record to join to.
+      default = 'false' if visitor_id in records else None
+
+      yield ((visitor_id, self.visitors['variation'][visitor_row], self.visitors['experiment_id'][visitor_row]) +
+             self.get_segment_columns(visitor_id, keys, default) +
+             (events['time'][row], events['name'][row], events['goal_ids'][row], events['revenue'][row]))
+
+  def query_visitor_data(self, segment_ids):
+    """Generator over one 'register' row per visitor."""
+    keys = ['s{}'.format(x) for x in segment_ids]
+
+    for row in sorted(xrange(len(self.database.tables['visitor'])), key=self.visitors['id'].__getitem__):
+      visitor_id    = self.visitors['id'][row]
+      experiment_id = self.visitors['experiment_id'][row]
+
+      yield ((visitor_id, self.visitors['variation'][row], experiment_id) +
+             self.get_segment_columns(visitor_id, keys, 'false') +
+             (self.visitors['time'][row], 'register', experiment_id, 0))
@@ -0,0 +1,116 @@
+from bisect import bisect_right
+
+import math
+
+
+class ArrivalCurve(object):
+  """When visitors arrive during the experiment, from the optional traffic section of the config:
+
+    traffic:
+      daily:  [24 weights, one per hour of the day, midnight first]
+      weekly: [7 weights, one per day of the week, Monday first]
+      utc_offset: -5        # hours, the timezone daily and weekly are in
+      ramp_up_hours: 48     # traffic grows linearly to full over the first hours
+      launch:
+        boost: 2            # extra traffic at the start, relative to normal
+        decay_hours: 12     # time for the extra traffic to fall to 1/e of boost
+
+    Every part is optional and weights are relative, so [1, 2] and [10, 20] are the same. The
+    experiment is cut into hourly bins, each weighted by every part at its midpoint, and visitors
+    are placed by the inverse of the cumulative weight: visitor n of N arrives where (n - 1) / N
+    of the weight has passed. Inside a bin the inverse is linear in n, so a whole bin of visitors
+    takes one pass, whatever the number of visitors.
+  """
+  bin_seconds = 3600
+
+  def __init__(self, traffic, start, stop):
+    """
+    :param : traffic (dict): traffic section of the config
+    :param : start (int): epoch seconds
+    :param : stop (int): epoch seconds
+    """
+    daily  = traffic.get('daily')
+    weekly = traffic.get('weekly')
+
+    if daily is not None and len(daily) != 24:
+      raise ValueError('traffic.daily needs 24 weights, got {}.'.format(len(daily)))
+
+    if weekly is not None and len(weekly) != 7:
+      raise ValueError('traffic.weekly needs 7 weights, got {}.'.format(len(weekly)))
+
+    launch     = traffic.get('launch', {})
+    boost      = launch.get('boost', 0)
+    decay      = launch.get('decay_hours', 24) * 3600.0
+    ramp       = traffic.get('ramp_up_hours', 0) * 3600.0
+    utc_offset = int(traffic.get('utc_offset', 0) * 3600)
+
+    self.cumulative = [0.0]
+    self.lengths    = []
+    self.starts     = []
+    self.weights    = []
+
+    for offset in xrange(0, stop - start, self.bin_seconds):
+      length = min(self.bin_seconds, stop - start - offset)
+      middle = offset + length / 2.0
+      local  = start + utc_offset + int(middle)
+      weight = length
+
+      if daily is not None:
+        weight *= daily[local // 3600 % 24]
+
+      if weekly is not None:
+        # The epoch began on a Thursday.
+        weight *= weekly[(local // 86400 + 3) % 7]
+
+      if ramp:
+        weight *= min(1.0, middle / ramp)
+
+      if boost:
+        weight *= 1 + boost * math.exp(-middle / decay)
+
+      if weight < 0:
+        raise ValueError('traffic weights must not be negative.')
+
+      self.cumulative.append(self.cumulative[-1] + weight)
+      self.lengths.append(length)
+      self.starts.append(offset)
+      self.weights.append(float(weight))
+
+    if not self.cumulative[-1]:
+      raise ValueError('traffic weights are zero for the whole experiment.')
+
+    # Visitors past the end of the weight, by rounding, go to the last bin with any traffic.
+    self.last = max(k for k, weight in enumerate(self.weights) if weight)
+
+  def get_offsets(self, visitor_total, visitor_numbers):
+    """Whole second offsets from the experiment start of the visitors with the given numbers.
+
+    :param : visitor_total (int): visitors in the variation
+    :param : visitor_numbers (xrange): consecutive, increasing visitor numbers
+    """
+    if not len(visitor_numbers):
+      return []
+
+    first   = visitor_numbers[0]
+    stop    = visitor_numbers[-1] + 1
+    scale   = self.cumulative[-1] / visitor_total
+    offsets = []
+    number  = first
+    k       = min(bisect_right(self.cumulative, (first - 1) * scale) - 1, self.last)
+
+    while number < stop:
+      # Visitor n arrives in bin k while (n - 1) * scale is below the weight at the end of the bin.
+      end = stop if k == self.last else min(stop, int(math.ceil(self.cumulative[k + 1] / scale)) + 1)
+
+      if self.weights[k] and end > number:
+        seconds = self.lengths[k] / self.weights[k]
+        base    = self.starts[k] - (scale + self.cumulative[k]) * seconds
+        slope   = scale * seconds
+        limit   = self.starts[k] + self.lengths[k] - 1
+
+        offsets.extend(min(int(base + slope * n), limit) for n in xrange(number, end))
+        number = end
+
+      k += 1
+
+    return offsets
@@ -1,79 +1,56 @@
-from datetime import timedelta
 from experiments import Experiment
-
-
-class Visitor(object):
-  def __init__(self, experiment_id, number, time, variation_id):
-    self._experiment_id = experiment_id
-    self._id            = int(str(variation_id) + str(number))
-    self._number        = number
-    self._time          = time
-    self._variation_id   = variation_id
-
-  def format(self):
-    return {
-      'experiment_id': self._experiment_id,
-      'id':            self._id,
-      'number':        self._number,
-      'time':          self._time,
-      'variation':     self._variation_id
-    }
-
-  @property
-  def experiment_id(self):
-    return self._experiment_id
-
-  @property
-  def id(self):
-    return self._id
-
-  @property
-  def number(self):
-    return self._number
-
-  @property
-  def time(self):
-    return self._time
-
-  @property
-  def variation_id(self):
-    return self._variation_id
+from traffic import ArrivalCurve
 
 
 class VisitorCollection(Experiment):
-  """Creates data for all visitors in the experiment."""
+  """Creates data for all visitors in the experiment.
+    They arrive evenly over the experiment, or along its arrival curve if the config has a
+    traffic section, see ArrivalCurve.
+  """
+  columns = ('experiment_id', 'id', 'number', 'time', 'variation')
+
   def __init__(self, config, database):
     Experiment.__init__(self, config, database)
 
-  def generate(self):
-    """Entry point."""
-    # If generate has already been called, make sure we have a clean slate.
-    if self.data:
-      self.data = []
+    self._arrivals = None
 
+    if config.get('traffic'):
+      self._arrivals = ArrivalCurve(config['traffic'], self.time['start'], self.time['stop'])
+
+  def generate(self, batch_size=10000):
+    """Entry point. Yields the visitors of every variation as dicts of columns ready for
+      Database.insert, at most batch_size visitors each.
+    """
     for variation_id in self.variation_ids:
-        self.data += self.generate_visitors_for_variation(variation_id)
+      visitor_total = self.visitors[variation_id]['total']
 
-    return self.data
+      for first in xrange(1, visitor_total, batch_size):
+        yield self.generate_visitors_for_variation(variation_id, xrange(first, min(first + batch_size, visitor_total)))
 
-  def generate_visitors_for_variation(self, variation_id):
-    data_array    = []
+  def generate_visitors_for_variation(self, variation_id, numbers):
+    """Build the visitors of a variation with the given numbers in one pass, as columns."""
     visitor_total = self.visitors[variation_id]['total']
+    id_prefix     = str(variation_id)
+    start         = self.time['start']
 
-    for number in xrange(1, visitor_total):
-      visitor = Visitor(experiment_id=self._experiment_id,
-                        number=number,
-                        time=self.get_visitor_timestamp(visitor_total, number),
-                        variation_id=variation_id)
+    return {
+      'experiment_id': [self._experiment_id] * len(numbers),
+      'id':            [int(id_prefix + str(number)) for number in numbers],
+      'number':        list(numbers),
+      'time':          [start + offset for offset in self.get_visitor_offsets(visitor_total, numbers)],
+      'variation':     [variation_id] * len(numbers)
+    }
 
-      data_array.append(visitor.format())
+  def get_visitor_offsets(self, visitor_total, visitor_numbers):
+    """Evenly spread visitors through the life of the experiment, unless it has an arrival curve.
 
-    return data_array
+    Returns whole second offsets from the experiment start, rounded the way
+    start + timedelta(seconds=delta) rounds before the microseconds are dropped.
+    """
+    if self._arrivals:
+      return self._arrivals.get_offsets(visitor_total, visitor_numbers)
 
-  def get_visitor_timestamp(self, visitor_total, visitor_number):
-    """Evenly spread visitors through the life of the experiment."""
-    delta_per_visitor = self.time['range'] / visitor_total
-    delta             = delta_per_visitor * (visitor_number - 1)
+    delta_per_visitor = self.time['range'] / float(visitor_total)
+    deltas            = [delta_per_visitor * (number - 1) for number in visitor_numbers]
 
-    return (self.time['start'] + timedelta(seconds=delta)).\
-            replace(microsecond=0)
+    return [int(delta) + (round((delta - int(delta)) * 1000000) >= 1000000) for delta in deltas]
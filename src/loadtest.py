@@ -0,0 +1,269 @@
+""" Load test the event sender against a local stand-in collector, at several connection pool sizes.
+
+  From the ./optimizely-fake-data directory
+
+    python ./src/loadtest.py config/web/retail.yaml
+    python ./src/loadtest.py config/web/retail.yaml --pool-sizes 10 50 --latency 0.05 --error 503=0.02 --reset-rate 0.01
+
+  The config is generated once, with -m -s and --seed 1. Then its first --events events are sent
+  once per pool size to an EventCollector. The collector runs in a process of its own, so it doesn't
+  take the sender's CPU. Concurrency starts and stays capped at the pool size.
+
+  Every run prints events per second and latency percentiles of the requests. It also reconciles
+  the sender's counts with the collector's: every event must be delivered exactly once or be dead
+  lettered, and only after all its retries unless the collector answered it with a status that
+  can't be retried. Results are written to --output as JSON, and the exit status is 1 if a run
+  doesn't add up.
+
+"""
+
+from data.api import APIImport
+from data.collector import EventCollector
+from data.connections import ConnectionPool
+from data.metrics import Metrics, metrics
+from itertools import chain, islice
+from main import add_arguments, create_database, generate, get_config
+from multiprocessing import Pipe, Process
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib2
+
+
+def serve_collector(args, pipe):
+  """Collector process: bind a free port, report the address through the pipe, serve until terminated."""
+  collector = EventCollector(latency=args.latency,
+                             jitter=args.jitter,
+                             errors=dict(args.errors),
+                             reset_rate=args.reset_rate,
+                             seed=args.seed)
+
+  pipe.send(collector.listen())
+  collector.serve()
+
+
+def collector_request(address, path):
+  return json.load(urllib2.urlopen('http://{}:{}{}'.format(address[0], address[1], path)))
+
+
+def count_unretried(dead_letter, retries, errors):
+  """Dead lettered events that still had retries left, though no injected failure forbids retrying them.
+
+    :param : dead_letter (str): dead letter file of the run, see SendScheduler
+    :param : errors (list): the injected (status, rate) pairs
+  """
+  if not os.path.exists(dead_letter):
+    return 0
+
+  final = set('HTTP {}'.format(status) for status, _ in errors
+              if status < 500 and status not in APIImport.retry_statuses)
+
+  with open(dead_letter) as lines:
+    records = [json.loads(line) for line in lines]
+
+  return sum(1 for record in records if record['attempts'] <= retries and record['error'] not in final)
+
+
+def run_load(config, database, args, pool_size, address, directory):
+  """Send the events at one pool size. Returns the result of the run."""
+  collector_request(address, '/reset')
+  metrics.reset()
+
+  dead_letter = os.path.join(directory, 'pool-{}.dead.ndjson'.format(pool_size))
+  connections = ConnectionPool(size=pool_size, idle_timeout=args.idle_timeout)
+  api_import  = APIImport(config['account']['id'],
+                          config['account']['admin_id'],
+                          config['experiment']['id'],
+                          config['segment_ids'],
+                          connections=connections,
+                          concurrency=pool_size,
+                          max_concurrency=pool_size,
+                          retries=args.retries,
+                          backoff=args.backoff,
+                          dead_letter=dead_letter)
+
+  api_query = database.queries()['api']
+  total     = min(args.events, api_query.count_visitor_data() + api_query.count_conversion_data())
+  events    = islice(chain(api_query.query_visitor_data(config['segment_ids']),
+                           api_query.query_conversion_data(config['segment_ids'])), total)
+
+  started = time.time()
+  api_import.send(events, title='Pool size {}'.format(pool_size), total=total)
+  seconds = time.time() - started
+
+  connections.close()
+
+  sent      = api_import.scheduler.stats
+  received  = collector_request(address, '/stats')
+  latencies = sorted(chain.from_iterable(values for (name, labels), values in metrics.timings.iteritems()
+                                         if name == 'http_request'))
+
+  result = {
+    'pool_size':         pool_size,
+    'events':            total,
+    'seconds':           seconds,
+    'events_per_second': total / seconds if seconds else None,
+    'succeeded':         sent['succeeded'],
+    'dead':              sent['dead'],
+    'unretried':         count_unretried(dead_letter, args.retries, args.errors),
+    'retried':           sent['retried'],
+    'connections':       received['connections'],
+    'received':          received['received'],
+    'resets':            received['resets'],
+    'statuses':          received['statuses'],
+    'delivered':         received['delivered'],
+    'duplicates':        received['duplicates']
+  }
+
+  for percent in Metrics.percentiles:
+    result['p{}'.format(percent)] = Metrics.percentile(latencies, percent)
+
+  # Every event was delivered once or dead lettered, and what the sender counts as sent was delivered.
+  # Resets and retryable statuses must only reach the dead letter file once their retries ran out.
+  result['reconciled'] = (sent['succeeded'] + sent['dead'] == total and
+                          sent['succeeded'] == received['delivered'] and
+                          not received['duplicates'] and
+                          not result['unretried'])
+
+  return result
+
+
+def print_results(results):
+  print '\t'.join(['pool', 'events', 'seconds', 'events/s', 'p50 ms', 'p90 ms', 'p99 ms',
+                   'delivered', 'dead', 'unretried', 'retried', 'resets', 'reconciled'])
+
+  for result in results:
+    columns = [result['pool_size'], result['events'], '{:.2f}'.format(result['seconds']),
+               '{:.0f}'.format(result['events_per_second']) if result['events_per_second'] else '-']
+
+    for key in ('p50', 'p90', 'p99'):
+      columns.append('{:.1f}'.format(result[key] * 1000) if result[key] is not None else '-')
+
+    columns += [result['delivered'], result['dead'], result['unretried'], result['retried'], result['resets'],
+                'yes' if result['reconciled'] else 'NO']
+
+    print '\t'.join(str(column) for column in columns)
+
+
+def main(args):
+  logging.basicConfig(level=logging.WARNING)
+
+  # Started before anything else, so the collector process doesn't inherit the generated data.
+  parent, child = Pipe()
+  collector     = Process(target=serve_collector, args=(args, child))
+
+  collector.daemon = True
+  collector.start()
+
+  address = parent.recv()
+
+  APIImport.url_base = 'http://{}:{}{}'.format(address[0], address[1], EventCollector.event_path)
+
+  config   = get_config(args.config)
+  database = create_database(config, args.store)
+
+  generate(config, database, args, {'stages': []})
+  database.finish_load()
+
+  directory = tempfile.mkdtemp(prefix='loadtest-')
+
+  try:
+    results = [run_load(config, database, args, pool_size, address, directory) for pool_size in args.pool_sizes]
+  finally:
+    shutil.rmtree(directory)
+    collector.terminate()
+
+  print_results(results)
+
+  report = {
+    'config':     args.config,
+    'created':    int(time.time()),
+    'errors':     dict(args.errors),
+    'jitter':     args.jitter,
+    'latency':    args.latency,
+    'reset_rate': args.reset_rate,
+    'results':    results
+  }
+
+  with open(args.output, 'w') as output:
+    json.dump(report, output, indent=2, sort_keys=True)
+
+  if not all(result['reconciled'] for result in results):
+    print 'Sent and delivered events do not add up, see {}.'.format(args.output)
+    sys.exit(1)
+
+
+def status_rate(value):
+  """STATUS=RATE, e.g. 503=0.02."""
+  try:
+    status, rate = value.split('=')
+    return int(status), float(rate)
+  except ValueError:
+    raise argparse.ArgumentTypeError('expected STATUS=RATE, e.g. 503=0.02, got {}'.format(value))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Load test the event sender against a local collector.')
+
+  parser.add_argument('config',
+                      help='Config file the events are generated from.')
+
+  parser.add_argument('--backoff',
+                      default=0.1,
+                      type=float,
+                      help='Seconds before the first retry of a failed event, doubled for each further retry.')
+
+  parser.add_argument('--error',
+                      action='append',
+                      default=[],
+                      dest='errors',
+                      metavar='STATUS=RATE',
+                      type=status_rate,
+                      help='Answer this fraction of events with an HTTP status, e.g. 503=0.02. Repeatable.')
+
+  parser.add_argument('--events',
+                      default=20000,
+                      type=int,
+                      help='Events sent per pool size, the first of the config.')
+
+  parser.add_argument('--jitter',
+                      default=0,
+                      type=float,
+                      help='Up to this many seconds of random latency on top of --latency.')
+
+  parser.add_argument('--latency',
+                      default=0.01,
+                      type=float,
+                      help='Seconds the collector takes to answer every event.')
+
+  parser.add_argument('-o', '--output',
+                      default='loadtest.json',
+                      help='File the results are written to, as JSON.')
+
+  parser.add_argument('--pool-sizes',
+                      default=[1, 5, 10, 25, 50],
+                      nargs='+',
+                      type=int,
+                      help='Connection pool sizes to run at, one run each.')
+
+  parser.add_argument('--reset-rate',
+                      default=0,
+                      type=float,
+                      help='Fraction of events answered by closing the connection, like a reset.')
+
+  add_arguments(parser)
+
+  parser.set_defaults(include_multiple_conversions=True, include_segments=True, seed=1)
+
+  args = parser.parse_args()
+
+  if args.jobs > 1:
+    parser.error('--jobs can not be combined with loadtest.py.')
+
+  main(args)
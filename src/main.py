@@ -22,7 +22,7 @@ How to run this bad-boy:
         i. Total visitors
         ii. Goal conversion counts
         iii. Revenue amounts
-        iv. Retention timelines
+        iv. Visitor arrival curves (optional traffic section, see data/traffic.py)
 
   3. Run the program passing the YAML file as an argument, using the included Python Virtual Environment.
 
@@ -39,7 +39,10 @@ An overview of the program execution:
 
   [x] Main.py
    |
-   |-database.py-- Initialize a local SQLite database
+   |-database.py-- Initialize a local SQLite database (--store sqlite, handy for debugging; --store sqlite-file
+   |               keeps it on disk and reuses it on the next run with the same config)
+   |
+   |-store.py-- Columnar in-memory store with the same interface as database.py (default)
    | |
    |-|-visitor.py-- Insert one record for each visitor to "visitor" table with variaton_id and timestamp.
    | |
@@ -54,57 +57,217 @@ An overview of the program execution:
 """
 
 from data.api import APIImport
+from data.connections import ConnectionPool
 from data.database import Database, EventTable, VisitorTable
 from data.events import BaselineEventCollection, DistributedEventCollection
-from data.query import APIQuery
+from data.export import EventExporter
+from data.journal import SendJournal
+from data.metrics import metrics
+from data.profiling import profiler
+from data.sampling import RandomStreams
+from data.plans import check_query_plans
 from data.segments import SegmentCollection
+from data.shards import export_shard, merge_shard, shard_config
+from data.store import ColumnarStore
 from data.visitors import VisitorCollection
 
+from multiprocessing import Pool
+
 import argparse
+import hashlib
 import logging
+import os
+import resource
 import sys
+import time
 import yaml
 
 
-def create_baseline_events(config, database):
-  baseline_events = BaselineEventCollection(config, database)
-  baseline_events.generate()
+def create_baseline_events(config, database, streams, batch_size):
+  baseline_events = BaselineEventCollection(config, database, streams)
+  rows            = insert_batches(database, EventTable, baseline_events.generate(batch_size))
 
-  database.insert(EventTable, baseline_events.data)
   logging.info('Baseline events generated.')
 
+  return rows
+
+
+# Options that change the generated data. Together with the config they key the dataset cache.
+GENERATION_OPTIONS = ('include_multiple_conversions', 'include_segments', 'seed')
+
+RESUME_ERROR = '--resume needs the --seed of the interrupted send, or its cached --store sqlite-file database.'
 
-def create_database(name):
-  database = Database(name)
-  database.create_tables()
+
+def config_name(config_path):
+  """File name of a config without its extension, e.g. retail for config/web/retail.yaml."""
+  return os.path.splitext(os.path.basename(config_path))[0]
+
+
+def create_database(config, store='columnar', db_file=None):
+  if store == 'columnar':
+    database = ColumnarStore(config['experiment']['id'])
+  else:
+    database = Database(config['experiment']['id'], db_file)
+
+  database.create_tables(config['segment_ids'])
 
   logging.info('Database created.')
 
   return database
 
 
-def create_distributed_events(config, database):
-  distributed_events      = DistributedEventCollection(config, database)
-  distributed_events_data = distributed_events.generate()
+def dataset_file(config_path, config, args):
+  """Path of the cached database for this config file and these generation options."""
+  digest = hashlib.sha1(open(config_path, 'rb').read())
+  digest.update(repr([(name, getattr(args, name)) for name in GENERATION_OPTIONS]))
+
+  return os.path.join(args.cache_dir, '{}-{}.db'.format(config['experiment']['id'], digest.hexdigest()[:16]))
+
+
+def open_cached_database(config_path, config, args):
+  """The cached database when a complete one exists (and --rebuild isn't given), else None."""
+  db_file = dataset_file(config_path, config, args)
+
+  if args.rebuild or not os.path.exists(db_file):
+    return None
+
+  database = Database(config['experiment']['id'], db_file)
+
+  if not database.is_complete():
+    return None
+
+  database.open()
+  logging.info('Reusing generated database %s.', db_file)
+
+  return database
+
+
+def create_distributed_events(config, database, streams, batch_size):
+  distributed_events = DistributedEventCollection(config, database, streams)
+  rows               = insert_batches(database, EventTable, distributed_events.generate(batch_size))
 
-  database.insert(EventTable, distributed_events_data)
   logging.info('Distributed events generated.')
 
+  return rows
 
-def create_segments(config, database):
-  segments = SegmentCollection(config, database)
-  segments.generate()
+
+def create_segments(config, database, streams, batch_size):
+  segments = SegmentCollection(config, database, streams, batch_size)
+  rows     = segments.generate()
 
   logging.info('Segments generated.')
 
+  return rows
+
 
-def create_visitors(config, database):
-  visitors      = VisitorCollection(config, database)
-  visitors_data = visitors.generate()
+def create_visitors(config, database, batch_size):
+  visitors = VisitorCollection(config, database)
+  rows     = insert_batches(database, VisitorTable, visitors.generate(batch_size))
 
-  database.insert(VisitorTable, visitors_data)
   logging.info('Visitors generated.')
 
+  return rows
+
+
+def generate(config, database, args, summary):
+  """Generation stages, in order. Each records its rows and seconds in the summary."""
+  streams = RandomStreams(args.seed)
+
+  run_stage(summary, 'visitors', create_visitors, config, database, args.batch_size)
+  run_stage(summary, 'baseline_events', create_baseline_events, config, database, streams, args.batch_size)
+
+  if args.include_multiple_conversions:
+    run_stage(summary, 'distributed_events', create_distributed_events, config, database, streams, args.batch_size)
+
+  if args.include_segments:
+    run_stage(summary, 'segments', create_segments, config, database, streams, args.batch_size)
+
+
+def generate_shard(job):
+  """Worker entry point: generate one variation in a database of its own and export its rows."""
+  config, args = job
+
+  # Workers are reused for the next shard, which must not report this one's metrics again.
+  metrics.reset()
+
+  if args.profile:
+    profiler.enable(args.profile, '{}-{}'.format(config['experiment']['id'], config['variation_ids'][0]), args.profile_top)
+
+  # Shards only live until they are merged, so they're never written to a file.
+  database = create_database(config, 'sqlite' if args.store == 'sqlite-file' else args.store)
+  summary  = {'stages': []}
+
+  generate(config, database, args, summary)
+
+  return export_shard(database), summary, metrics.state()
+
+
+def generate_sharded(config, database, args, summary):
+  """Generate each variation in its own worker process, then merge the shards into database.
+
+    Stage rows are summed over the shards, stage seconds and peak memory are those of the largest shard.
+  """
+  jobs   = [(shard_config(config, variation_id), args) for variation_id in config['variation_ids']]
+  pool   = Pool(processes=min(args.jobs, len(jobs)))
+  stages = []
+  merge  = {'name': 'merge', 'rows': 0, 'seconds': 0, 'peak_memory': 0}
+
+  # Shards are merged in variation order as they arrive, so the merged tables don't depend on timing.
+  for shard, shard_summary, shard_metrics in pool.imap(generate_shard, jobs):
+    metrics.merge(shard_metrics)
+
+    started = time.time()
+    merge['rows']        += merge_shard(database, shard)
+    merge['seconds']     += time.time() - started
+    merge['peak_memory'] = max(merge['peak_memory'], peak_memory())
+
+    for stage in shard_summary['stages']:
+      if stage['name'] not in [x['name'] for x in stages]:
+        stages.append({'name': stage['name'], 'rows': 0, 'seconds': 0, 'peak_memory': 0})
+
+      merged = [x for x in stages if x['name'] == stage['name']][0]
+      merged['rows']        += stage['rows']
+      merged['seconds']     = max(merged['seconds'], stage['seconds'])
+      merged['peak_memory'] = max(merged['peak_memory'], stage['peak_memory'])
+
+  pool.close()
+  pool.join()
+
+  for stage in stages + [merge]:
+    stage['rows_per_second'] = stage['rows'] / stage['seconds'] if stage['seconds'] else None
+
+  metrics.observe('stage', merge['seconds'], stage='merge')
+  metrics.increment('stage_rows', merge['rows'], stage='merge')
+
+  summary['stages'] += stages + [merge]
+  logging.info('Shards merged.')
+
+
+def export_events(config, database, args):
+  """Write the events send_events would send to files in args.export instead, see EventExporter."""
+  api_import = APIImport(config['account']['id'],
+                         config['account']['admin_id'],
+                         config['experiment']['id'],
+                         config['segment_ids'])
+  api_query  = database.queries()['api']
+
+  exporter = EventExporter(args.export,
+                           config['experiment']['id'],
+                           api_import.format_event,
+                           APIImport.format_event_keys(config['experiment']['id'], config['segment_ids']),
+                           format=args.export_format,
+                           compress=args.export_gzip,
+                           chunk_size=args.export_chunk_size,
+                           batch_size=args.batch_size)
+
+  rows  = exporter.export(api_query.query_visitor_data(config['segment_ids']), 'visitors')
+  rows += exporter.export(api_query.query_conversion_data(config['segment_ids']), 'conversions')
+
+  exporter.close()
+  logging.info('Exported %d events to %d files in %s.', rows, len(exporter.files), args.export)
+
+  return rows
+
 
 def get_config(config_path):
   try:
@@ -117,56 +280,331 @@ def get_config(config_path):
   return config
 
 
-def send_events(config, database):
+def insert_batches(database, table, batches):
+  """Insert each batch of columns as it is generated, so only one is held at a time. Returns the rows inserted."""
+  rows = 0
+
+  for batch in batches:
+    database.insert(table, batch)
+    rows += len(batch.itervalues().next())
+
+  return rows
+
+
+def send_events(config, database, connections, journal, scheduling):
   api_import = APIImport(config['account']['id'],
-                         config['account']['admin_id'])
+                         config['account']['admin_id'],
+                         config['experiment']['id'],
+                         config['segment_ids'],
+                         connections=connections,
+                         journal=journal,
+                         **scheduling)
 
-  api_query  = APIQuery(database)
+  api_query  = database.queries()['api']
 
-  conversion_events = api_query.query_conversion_data(config['segment_ids'])
-  visitor_events    = api_query.query_visitor_data(config['segment_ids'])
+  # Both queries are generators: rows are formatted and sent while they are fetched.
+  # Acknowledged events are written to the journal however sending ends, so --resume can skip them.
+  try:
+    api_import.send(api_query.query_visitor_data(config['segment_ids']),
+                    title='Send first events',
+                    total=api_query.count_visitor_data())
 
-  api_import.send(visitor_events, title='Send first events')
-  api_import.send(conversion_events, title='Send conversions')
+    api_import.send(api_query.query_conversion_data(config['segment_ids']),
+                    title='Send conversions',
+                    total=api_query.count_conversion_data())
+  finally:
+    api_import.scheduler.close()
+    connections.close()
+    journal.close()
 
+  logging.info('Connection reuse: {}'.format(connections.stats()))
+  logging.info('Send results: {}'.format(api_import.scheduler.stats))
 
-# TODO Create logging infrastructure (run time, generated data counts, records inserted).
-def main(args):
-  logging.basicConfig(level=logging.INFO)
+  return api_import.scheduler.stats['succeeded']
 
-  config = get_config(args.config)
-  database = create_database(config['experiment']['id'])
 
-  create_visitors(config, database)
-  create_baseline_events(config, database)
+def output_path(pattern, args, config):
+  """Path of an output file of the run, with {experiment_id} and {config} (see config_name) replaced."""
+  return pattern.format(config=config_name(args.config), experiment_id=config['experiment']['id'])
 
-  if args.include_multiple_conversions:
-    create_distributed_events(config, database)
 
-  if args.include_segments:
-    create_segments(config, database)
+def peak_memory():
+  """Peak resident memory of the process in KiB, since the last reset_peak_memory on Linux."""
+  try:
+    with open('/proc/self/status') as status:
+      for line in status:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])
+  except IOError:
+    pass
+
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+  return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def reset_peak_memory():
+  """Start a new peak memory measurement. Only Linux can, elsewhere the peak is since process start."""
+  try:
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+      clear_refs.write('5')
+  except IOError:
+    pass
+
+
+def run_stage(summary, name, stage, *args):
+  """Run one pipeline stage, recording its row count, wall time and peak memory in the summary."""
+  reset_peak_memory()
+
+  started = time.time()
+
+  with profiler.profile(name):
+    rows = stage(*args)
+
+  seconds = time.time() - started
+
+  summary['stages'].append({'name':            name,
+                            'rows':            rows,
+                            'seconds':         seconds,
+                            'rows_per_second': rows / seconds if seconds else None,
+                            'peak_memory':     peak_memory()})
+
+  metrics.observe('stage', seconds, stage=name)
+  metrics.increment('stage_rows', rows, stage=name)
+
+  logging.info('Stage %s: %d rows in %.2fs.', name, rows, seconds)
+
+
+def run(args):
+  """Run the whole pipeline for args.config. Returns a summary of row counts and timings per stage.
+
+    Stages, inserts, queries and sends record into metrics, written out with --report and --prometheus.
+  """
+  metrics.reset()
+
+  config   = get_config(args.config)
+  summary  = {'config': args.config, 'stages': []}
+  database = None
+
+  if args.profile:
+    profiler.enable(args.profile, config['experiment']['id'], args.profile_top)
+
+  if args.store == 'sqlite-file':
+    database = open_cached_database(args.config, config, args)
+
+  if not database:
+    # Generated again with another seed, conversions get other identities than the journal holds.
+    if args.resume and args.seed is None:
+      raise ValueError(RESUME_ERROR)
+
+    db_file = None
+
+    if args.store == 'sqlite-file':
+      db_file = dataset_file(args.config, config, args)
+
+      if not os.path.isdir(args.cache_dir):
+        os.makedirs(args.cache_dir)
+
+    database = create_database(config, args.store, db_file)
+
+    # Shards must share the seed, so pick one here when none is given and log it.
+    if args.seed is None:
+      args.seed = RandomStreams().seed
+
+    logging.info('Generating with --seed %d.', args.seed)
+
+    if args.jobs > 1:
+      generate_sharded(config, database, args, summary)
+    else:
+      generate(config, database, args, summary)
+
+    database.finish_load()
+
+  if args.check_query_plans:
+    if args.store != 'columnar':
+      check_query_plans(database, config)
+      logging.info('Query plans checked.')
+    else:
+      logging.warning('--check-query-plans only applies to the sqlite stores, skipped.')
+
+  if args.export:
+    run_stage(summary, 'export', export_events, config, database, args)
 
   if args.api_send:
-    send_events(config, database)
+    connections = ConnectionPool(size=args.connections or args.max_concurrency,
+                                 idle_timeout=args.idle_timeout)
 
-if __name__ == '__main__':
-  parser = argparse.ArgumentParser(description='Send fake data to an Optimizely experiment.')
+    scheduling = {
+      'concurrency':     args.concurrency,
+      'max_concurrency': args.max_concurrency,
+      'max_rate':        args.max_rate,
+      'retries':         args.retries,
+      'dead_letter':     output_path(args.dead_letter or 'send_{experiment_id}.dead.ndjson', args, config)
+    }
+
+    journal = SendJournal(output_path(args.journal or 'send_{experiment_id}.journal', args, config),
+                          resume=args.resume)
+
+    run_stage(summary, 'send', send_events, config, database, connections, journal, scheduling)
+
+  if args.report:
+    metrics.write_json(output_path(args.report, args, config),
+                       config=args.config,
+                       seed=args.seed,
+                       stages=summary['stages'])
 
+  if args.prometheus:
+    metrics.write_prometheus(output_path(args.prometheus, args, config))
+
+  return summary
+
+
+def main(args):
+  logging.basicConfig(level=logging.INFO)
+
+  run(args)
+
+
+def add_arguments(parser):
+  """Pipeline options, shared with batch.py."""
   parser.add_argument('-a', '--api-send',
                       action='store_true',
                       help='Send events to Optimizely via GET.')
 
-  parser.add_argument('-c', '--config',
-                      default='./config/web/web_test.yaml',
-                      help='Path to YAML file with experiment/distribution information.',
-                      required=True)
+  parser.add_argument('--batch-size',
+                      default=10000,
+                      type=int,
+                      help='Rows generated and inserted at a time. Bounds memory, the data is the same for any size.')
+
+  parser.add_argument('--cache-dir',
+                      default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql'),
+                      help='Directory of the databases kept by --store sqlite-file. Defaults to src/sql.')
+
+  parser.add_argument('--check-query-plans',
+                      action='store_true',
+                      help='After generating, fail if a SQLite query scans a table it should search by index.')
+
+  parser.add_argument('--concurrency',
+                      default=10,
+                      type=int,
+                      help='Events in flight when sending starts. Adapts to latency and errors from there.')
+
+  parser.add_argument('--connections',
+                      type=int,
+                      help='Keep-alive connections per host used to send events. Defaults to --max-concurrency.')
+
+  parser.add_argument('--dead-letter',
+                      help='File that collects events which still failed after all retries. Defaults to '
+                           'send_{experiment_id}.dead.ndjson. {experiment_id} and {config} are replaced.')
+
+  parser.add_argument('--export',
+                      metavar='DIR',
+                      help='Write the events that would be sent to files in DIR, see --export-format.')
+
+  parser.add_argument('--export-chunk-size',
+                      default=1000000,
+                      type=int,
+                      help='Events per --export file.')
+
+  parser.add_argument('--export-format',
+                      choices=EventExporter.formats,
+                      default='ndjson',
+                      help='Format of the --export files: one JSON object per line, or CSV with a header.')
+
+  parser.add_argument('--export-gzip',
+                      action='store_true',
+                      help='Compress the --export files with gzip.')
+
+  parser.add_argument('--idle-timeout',
+                      default=30,
+                      type=float,
+                      help='Seconds before an idle keep-alive connection is closed instead of reused.')
+
+  parser.add_argument('-j', '--jobs',
+                      default=1,
+                      type=int,
+                      help='Worker processes generating the experiment, one variation per process.')
+
+  parser.add_argument('--journal',
+                      help='File recording acknowledged events. Defaults to send_{experiment_id}.journal. '
+                           '{experiment_id} and {config} are replaced.')
+
+  parser.add_argument('--max-concurrency',
+                      default=50,
+                      type=int,
+                      help='Upper bound for events in flight.')
+
+  parser.add_argument('--max-rate',
+                      type=float,
+                      help='Maximum events sent per second.')
 
   parser.add_argument('-m', '--include-multiple-conversions',
                       action='store_true',
                       help='Add additonal conversions for count goals.')
 
+  parser.add_argument('--profile',
+                      help='Directory to write a CPU and allocation profile of every stage to, '
+                           'as {experiment_id}-{stage}.prof with a top functions summary in .txt.')
+
+  parser.add_argument('--profile-top',
+                      default=25,
+                      type=int,
+                      help='Functions and allocations listed in each --profile summary.')
+
+  parser.add_argument('--prometheus',
+                      help='Also write the run metrics to this file in the Prometheus text format, e.g. for the '
+                           'node exporter textfile collector. {experiment_id} and {config}, the config file '
+                           'name, are replaced.')
+
+  parser.add_argument('--rebuild',
+                      action='store_true',
+                      help='Generate the data again even if --store sqlite-file has it cached.')
+
+  parser.add_argument('--report',
+                      help='Write a JSON report of the run to this file: every stage, insert, query and send, '
+                           'with rows, timings and HTTP latency percentiles. {experiment_id} and {config}, '
+                           'the config file name, are replaced.')
+
+  parser.add_argument('--resume',
+                      action='store_true',
+                      help='Skip events the journal lists as acknowledged by a previous, interrupted send. '
+                           'Needs the same --seed, or --store sqlite-file with the data still cached.')
+
+  parser.add_argument('--retries',
+                      default=5,
+                      type=int,
+                      help='Retries, with exponential backoff, before an event goes to --dead-letter.')
+
   parser.add_argument('-s', '--include-segments',
                       action='store_true',
                       help='Add segment values to events.')
-  
-  main(parser.parse_args())
+
+  parser.add_argument('--seed',
+                      type=int,
+                      help='Seed for every random draw. The same config, options and seed generate the same '
+                           'data, with any --jobs. Random when not given.')
+
+  parser.add_argument('--store',
+                      choices=['columnar', 'sqlite', 'sqlite-file'],
+                      default='columnar',
+                      help='Generation backend. Use sqlite to inspect the generated data with SQL. sqlite-file '
+                           'writes it to --cache-dir and reuses it while the config and generation options '
+                           'are unchanged.')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Send fake data to an Optimizely experiment.')
+
+  parser.add_argument('-c', '--config',
+                      default='./config/web/web_test.yaml',
+                      help='Path to YAML file with experiment/distribution information.',
+                      required=True)
+
+  add_arguments(parser)
+
+  args = parser.parse_args()
+
+  if args.resume and args.seed is None and args.store != 'sqlite-file':
+    parser.error(RESUME_ERROR)
+
+  main(args)
@@ -0,0 +1,43 @@
+""" Tests for the generator and sender, runnable without network access:
+
+    python -m unittest discover -s tests -t .
+
+  from the ./optimizely-fake-data directory. Data is generated from config/web/test.yaml unless a
+  test needs something else.
+"""
+
+import argparse
+import os
+import sys
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from main import add_arguments, create_database, generate
+
+
+def load_config(name='test.yaml'):
+  """A config from config/web, loaded the way main.get_config loads it."""
+  with open(os.path.join(ROOT, 'config', 'web', name)) as config:
+    return yaml.load(config)
+
+
+def parse_args(*options):
+  """Options as main.py parses them. --config defaults to config/web/test.yaml."""
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-c', '--config', default=os.path.join(ROOT, 'config', 'web', 'test.yaml'))
+  add_arguments(parser)
+
+  return parser.parse_args(list(options))
+
+
+def generate_database(config, store='columnar', multiple_conversions=True, segments=True, seed=1):
+  """A database generated from config, like main.py with -m and -s (unless turned off) and --seed 1."""
+  options  = ['--seed', str(seed)] + (['-m'] if multiple_conversions else []) + (['-s'] if segments else [])
+  database = create_database(config, store)
+
+  generate(config, database, parse_args(*options), {'stages': []})
+
+  return database
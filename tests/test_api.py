@@ -0,0 +1,156 @@
+from data.api import APIImport
+from data.collector import EventCollector
+from data.connections import ConnectionPool
+from data.metrics import metrics
+from data.query import APIQuery
+from tests import generate_database, load_config
+from urlparse import parse_qsl, urlsplit
+
+import eventlet
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import urllib
+import unittest
+
+
+class EventSerializerTest(unittest.TestCase):
+  def setUp(self):
+    self.config     = load_config()
+    self.api_import = APIImport(self.config['account']['id'],
+                                self.config['account']['admin_id'],
+                                self.config['experiment']['id'],
+                                self.config['segment_ids'])
+
+  def parameters(self, path):
+    """Parameters of a request path, without tsent, which changes with the clock."""
+    return sorted((name, value) for name, value in parse_qsl(urlsplit(path).query, keep_blank_values=True)
+                  if name != 'tsent')
+
+  def assertSerializesLikeUrlencode(self, row):
+    path, identity = self.api_import.serializer.serialize(row)
+    event          = self.api_import.format_event(row)
+
+    self.assertEqual(urlsplit(path).path, self.api_import.env['path'])
+    self.assertEqual(self.parameters(path), self.parameters('?' + urllib.urlencode(event)))
+    self.assertEqual(identity, '{}|{}|{}'.format(event['u'], event['n'], event['time']))
+
+  def test_generated_rows(self):
+    database = generate_database(self.config)
+
+    api_query = database.queries()['api']
+
+    for row in list(api_query.query_visitor_data(self.config['segment_ids']))[:50]:
+      self.assertSerializesLikeUrlencode(row)
+
+    for row in list(api_query.query_conversion_data(self.config['segment_ids']))[:50]:
+      self.assertSerializesLikeUrlencode(row)
+
+  def test_values_are_quoted(self):
+    values = {'u': 1234, 'variation_id': self.config['variation_ids'][0], 'x': self.config['experiment']['id'],
+              't': 1442346000, 'n': 'add to cart & pay', 'g': '1,2', 'v': 1999}
+    row    = tuple(values.get(column, u'caf\xe9 100%'.encode('utf-8'))
+                   for column in APIQuery.event_columns(self.config['segment_ids']))
+
+    self.assertSerializesLikeUrlencode(row)
+
+  def test_segments_without_a_value(self):
+    columns = APIQuery.event_columns(self.config['segment_ids'])
+    row     = tuple({'u': 1, 'variation_id': 2, 'x': 3, 't': 4, 'n': 'register', 'g': 3, 'v': 0}.get(column)
+                    for column in columns)
+
+    self.assertSerializesLikeUrlencode(row)
+
+
+class HeldEvents(APIImport):
+  """Sends nothing: every send takes a moment, and the most events pulled but not yet sent is kept."""
+  def __init__(self, *args, **scheduling):
+    APIImport.__init__(self, *args, **scheduling)
+
+    self.pulled = 0
+    self.sent   = 0
+    self.most   = 0
+
+  def rows(self, count):
+    for number in xrange(count):
+      self.pulled += 1
+      self.most    = max(self.most, self.pulled - self.sent)
+
+      # Columns of APIQuery.event_columns([]): u, variation_id, x, t, n, g, v
+      yield (number, 1, 3, 1442346000, 'register', 3, 0)
+
+  def send_event(self, event):
+    eventlet.sleep(0.001)
+    self.sent += 1
+
+
+class StreamingSendTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_events_are_pulled_as_slots_free_up(self):
+    api_import = HeldEvents(1, 2, 3, [], concurrency=5, max_concurrency=5,
+                            dead_letter=os.path.join(self.directory, 'dead.ndjson'))
+    stdout     = sys.stdout
+
+    sys.stdout = StringIO.StringIO()
+
+    try:
+      api_import.send(api_import.rows(500), total=500)
+    finally:
+      sys.stdout = stdout
+
+    self.assertEqual(api_import.sent, 500)
+    # Five in flight, plus the one waiting for a slot.
+    self.assertTrue(api_import.most <= 6)
+
+
+class DroppedConnectionSendTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.collector = EventCollector(reset_rate=0.1, seed=1)
+    self.address   = self.collector.listen()
+    self.server    = eventlet.spawn(self.collector.serve)
+    self.url_base  = APIImport.url_base
+
+    APIImport.url_base = 'http://{}:{}{}'.format(self.address[0], self.address[1], EventCollector.event_path)
+    metrics.reset()
+
+  def tearDown(self):
+    APIImport.url_base = self.url_base
+    self.server.kill()
+    shutil.rmtree(self.directory)
+
+  def test_reset_connections_are_retried(self):
+    columns    = APIQuery.event_columns([])
+    rows       = [tuple({'u': number, 'variation_id': 1, 'x': 3, 't': 1442346000, 'n': 'register', 'g': 3,
+                         'v': 0}[column] for column in columns) for number in xrange(200)]
+    api_import = APIImport(1, 2, 3, [], connections=ConnectionPool(size=5), concurrency=5, max_concurrency=5,
+                           retries=5, backoff=0.01, dead_letter=os.path.join(self.directory, 'dead.ndjson'))
+    stdout     = sys.stdout
+
+    sys.stdout = StringIO.StringIO()
+
+    try:
+      api_import.send(rows)
+    finally:
+      sys.stdout = stdout
+      api_import.connections.close()
+
+    self.assertTrue(self.collector.counts['resets'] > 0)
+    self.assertEqual(len(self.collector.delivered), 200)
+    self.assertEqual(api_import.scheduler.stats['dead'], 0)
+    # The pool retries a reused connection once by itself, so only some resets reach the scheduler.
+    self.assertTrue(api_import.scheduler.stats['retried'] > 0)
+    self.assertEqual(metrics.counters[('http_errors', (('reason', 'BadStatusLine'),))],
+                     api_import.scheduler.stats['retried'])
+    self.assertFalse(os.path.exists(os.path.join(self.directory, 'dead.ndjson')))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,114 @@
+from batch import find_configs, get_jobs, run_config
+from main import add_arguments, output_path, run
+from multiprocessing import Pool
+from tests import ROOT, load_config, parse_args
+
+import argparse
+import copy
+import logging
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+
+def config_path(name):
+  return os.path.join(ROOT, 'config', 'web', name)
+
+
+class FindConfigsTest(unittest.TestCase):
+  def test_globs_are_expanded_in_order_without_duplicates(self):
+    configs = find_configs([config_path('t*.yaml'), config_path('test.yaml'), config_path('retail.yaml')])
+
+    self.assertEqual(configs, [config_path('test.yaml'), config_path('travel.yaml'), config_path('travel_loser.yaml'),
+                               config_path('travel_totals.yaml'), config_path('retail.yaml')])
+
+  def test_unmatched_pattern_is_kept(self):
+    self.assertEqual(find_configs(['missing.yaml']), ['missing.yaml'])
+
+
+class RunConfigTest(unittest.TestCase):
+  def setUp(self):
+    self.args = parse_args('-m', '-s', '--seed', '1')
+
+  def job(self, name):
+    args        = copy.copy(self.args)
+    args.config = config_path(name)
+
+    return args
+
+  def test_workers_generate_like_a_single_process(self):
+    jobs = [self.job('test.yaml'), self.job('retail_totals.yaml')]
+    pool = Pool(processes=2, maxtasksperchild=1)
+
+    try:
+      summaries = pool.map(run_config, jobs, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+    for job, summary in zip(jobs, summaries):
+      expected = run_config(copy.copy(job))
+
+      self.assertEqual(summary['config'], job.config)
+      self.assertEqual([(stage['name'], stage['rows']) for stage in summary['stages']],
+                       [(stage['name'], stage['rows']) for stage in expected['stages']])
+
+  def test_failed_config_is_reported_in_its_summary(self):
+    stdout     = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    logging.disable(logging.ERROR)
+
+    try:
+      summary = run_config(self.job('missing.yaml'))
+    finally:
+      sys.stdout = stdout
+      logging.disable(logging.NOTSET)
+
+    # get_config exits on a missing file, which must not end the batch.
+    self.assertEqual(summary['config'], config_path('missing.yaml'))
+    self.assertIn('SystemExit', summary['error'])
+
+
+class GetJobsTest(unittest.TestCase):
+  def args(self, *options):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('configs', nargs='+')
+    add_arguments(parser)
+
+    return parser.parse_args([config_path('travel.yaml'), config_path('travel_loser.yaml')] + list(options))
+
+  def test_configs_sharing_an_experiment_write_files_of_their_own(self):
+    jobs = get_jobs(self.args('--profile', 'profiles', '--report', 'report-{config}.json'))
+
+    self.assertEqual([(job.journal, job.dead_letter, job.report, job.profile) for job in jobs],
+                     [('send_{config}.journal', 'send_{config}.dead.ndjson', 'report-{config}.json',
+                       os.path.join('profiles', 'travel')),
+                      ('send_{config}.journal', 'send_{config}.dead.ndjson', 'report-{config}.json',
+                       os.path.join('profiles', 'travel_loser'))])
+
+    config = load_config('travel.yaml')
+
+    self.assertEqual([output_path(job.journal, job, config) for job in jobs],
+                     ['send_travel.journal', 'send_travel_loser.journal'])
+
+  def test_report_paths_differ(self):
+    directory = tempfile.mkdtemp()
+    report    = os.path.join(directory, '{experiment_id}-{config}.json')
+
+    logging.disable(logging.INFO)
+
+    try:
+      for job in get_jobs(self.args('--seed', '1', '--report', report)):
+        run(job)
+
+      self.assertEqual(sorted(os.listdir(directory)), ['2578160075-travel.json', '2578160075-travel_loser.json'])
+    finally:
+      logging.disable(logging.NOTSET)
+      shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  unittest.main()
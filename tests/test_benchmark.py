@@ -0,0 +1,77 @@
+from benchmark import compare, run_benchmark, scale_config
+from tests import load_config, parse_args
+
+import copy
+import StringIO
+import sys
+import unittest
+
+
+class ScaleConfigTest(unittest.TestCase):
+  def test_counts_are_scaled(self):
+    config = load_config('retail.yaml')
+    scaled = scale_config(config, 10)
+
+    for variation_id, distribution in config['visitors'].iteritems():
+      self.assertEqual(scaled['visitors'][variation_id]['total'], distribution['total'] * 10)
+
+    for name, goal_data in config['conversions'].iteritems():
+      for variation_id, counts in goal_data['counts'].iteritems():
+        self.assertEqual(scaled['conversions'][name]['counts'][variation_id]['unique'], counts['unique'] * 10)
+        self.assertEqual(scaled['conversions'][name]['counts'][variation_id]['total'], counts['total'] * 10)
+
+    for segment_id, segment_distribution in config['segments']['manual'].iteritems():
+      for segment_value, variation_distribution in segment_distribution.iteritems():
+        for variation_id, distribution in variation_distribution.iteritems():
+          scaled_distribution = scaled['segments']['manual'][segment_id][segment_value][variation_id]
+
+          self.assertEqual(scaled_distribution['total'], distribution['total'] * 10)
+          self.assertEqual(scaled_distribution['conversions'],
+                           dict((goal_id, count * 10) for goal_id, count in distribution['conversions'].iteritems()))
+
+  def test_config_is_left_unchanged(self):
+    config   = load_config('retail.yaml')
+    original = copy.deepcopy(config)
+
+    scale_config(config, 0.5)
+
+    self.assertEqual(config, original)
+
+  def test_scaled_config_generates_scaled_rows(self):
+    args    = parse_args('-m', '--seed', '1')
+    results = [dict((x['stage'], x) for x in run_benchmark((args.config, scale, args))) for scale in (1, 2)]
+
+    self.assertEqual(sorted(results[0]), ['baseline_events', 'distributed_events', 'visitors'])
+    self.assertEqual(results[1]['visitors']['scale'], 2)
+    self.assertTrue(results[1]['visitors']['rows'] > 1.9 * results[0]['visitors']['rows'])
+
+
+class CompareTest(unittest.TestCase):
+  def result(self, stage, seconds, scale=1):
+    return {'config': 'retail.yaml', 'scale': scale, 'stage': stage, 'rows': 100, 'seconds': seconds}
+
+  def compare(self, results, baseline):
+    stdout     = sys.stdout
+    sys.stdout = StringIO.StringIO()
+
+    try:
+      return compare(results, {'results': baseline}, 0.1)
+    finally:
+      sys.stdout = stdout
+
+  def test_slower_stages_are_regressions(self):
+    baseline = [self.result('visitors', 1.0), self.result('segments', 1.0), self.result('merge', 0.01)]
+    results  = [self.result('visitors', 1.05), self.result('segments', 1.2), self.result('merge', 0.05)]
+
+    # merge is slower, but too fast in the baseline to compare.
+    self.assertEqual(self.compare(results, baseline), [results[1]])
+
+  def test_unmatched_results_are_skipped(self):
+    baseline = [self.result('visitors', 1.0)]
+    results  = [self.result('visitors', 5.0, scale=10), self.result('segments', 5.0)]
+
+    self.assertEqual(self.compare(results, baseline), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,90 @@
+from data.collector import EventCollector
+from eventlet.green import httplib
+
+import eventlet
+import json
+import unittest
+
+
+class EventCollectorTest(unittest.TestCase):
+  def event(self, number, tsent=1):
+    return '{}?u=visitor{}&n=visitor_event&tsent={}'.format(EventCollector.event_path, number, tsent)
+
+  def test_events_are_delivered_once(self):
+    collector = EventCollector()
+
+    self.assertEqual(collector.respond(self.event(1)), (200, ''))
+    self.assertEqual(collector.respond(self.event(2)), (200, ''))
+
+    # Sent again later: a duplicate, whatever its sent time.
+    collector.respond(self.event(1, tsent=2))
+
+    self.assertEqual(collector.stats(), {'connections': 0, 'received': 3, 'resets': 0, 'statuses': {200: 3},
+                                         'delivered': 2, 'duplicates': 1})
+
+  def test_errors_and_resets_are_injected_at_their_rates(self):
+    collector = EventCollector(errors={503: 0.2, 429: 0.1}, reset_rate=0.1, seed=1)
+    responses = [collector.respond(self.event(number)) for number in xrange(10000)]
+    stats     = collector.stats()
+
+    self.assertEqual(responses.count((None, None)), stats['resets'])
+    self.assertAlmostEqual(stats['resets'] / 10000.0, 0.1, delta=0.01)
+    self.assertAlmostEqual(stats['statuses'][503] / 9000.0, 0.2, delta=0.015)
+    self.assertAlmostEqual(stats['statuses'][429] / 9000.0, 0.1, delta=0.015)
+    self.assertEqual(stats['delivered'], stats['statuses'][200])
+    self.assertEqual(stats['duplicates'], 0)
+
+  def test_unknown_path(self):
+    collector = EventCollector()
+
+    self.assertEqual(collector.respond('/v1/other?u=1'), (404, ''))
+    self.assertEqual(collector.stats()['received'], 0)
+
+
+class EventCollectorServerTest(unittest.TestCase):
+  def setUp(self):
+    self.collector = EventCollector()
+    self.address   = self.collector.listen()
+    self.server    = eventlet.spawn(self.collector.serve)
+
+  def tearDown(self):
+    self.server.kill()
+
+  def test_keep_alive_requests_stats_and_reset(self):
+    connection = httplib.HTTPConnection(*self.address)
+
+    def get(path):
+      connection.request('GET', path)
+      response = connection.getresponse()
+
+      return response.status, response.read()
+
+    self.assertEqual(get('{}?u=1'.format(EventCollector.event_path)), (200, ''))
+    self.assertEqual(get('{}?u=2'.format(EventCollector.event_path)), (200, ''))
+
+    status, body = get('/stats')
+
+    self.assertEqual(status, 200)
+    self.assertEqual(json.loads(body), {'connections': 1, 'received': 2, 'resets': 0, 'statuses': {'200': 2},
+                                        'delivered': 2, 'duplicates': 0})
+
+    status, body = get('/reset')
+
+    self.assertEqual(json.loads(body)['received'], 0)
+
+    connection.close()
+
+  def test_reset_closes_the_connection(self):
+    self.collector.reset_rate = 1
+    connection = httplib.HTTPConnection(*self.address)
+
+    connection.request('GET', '{}?u=1'.format(EventCollector.event_path))
+
+    self.assertRaises(httplib.BadStatusLine, connection.getresponse)
+    self.assertEqual(self.collector.stats()['resets'], 1)
+
+    connection.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,54 @@
+from data.collector import EventCollector
+from data.connections import ConnectionPool
+from eventlet.green import httplib
+
+import eventlet
+import unittest
+
+
+class ConnectionPoolTest(unittest.TestCase):
+  def setUp(self):
+    self.collector = EventCollector(latency=0.005)
+    self.host      = '{}:{}'.format(*self.collector.listen())
+    self.server    = eventlet.spawn(self.collector.serve)
+    self.pool      = ConnectionPool(size=4)
+
+  def tearDown(self):
+    self.pool.close()
+    self.server.kill()
+
+  def get(self, number):
+    return self.pool.get(self.host, '{}?u={}'.format(EventCollector.event_path, number)).status
+
+  def test_sequential_requests_share_one_connection(self):
+    statuses = [self.get(number) for number in xrange(20)]
+
+    self.assertEqual(statuses, [200] * 20)
+    self.assertEqual(self.pool.stats()['connections'], 1)
+    self.assertEqual(self.pool.stats()['requests'], 20)
+    self.assertEqual(self.collector.counts['connections'], 1)
+
+  def test_concurrent_requests_open_at_most_size_connections(self):
+    pile = eventlet.GreenPile(20)
+
+    for number in xrange(100):
+      pile.spawn(self.get, number)
+
+    self.assertEqual(list(pile), [200] * 100)
+    self.assertEqual(self.pool.stats()['connections'], 4)
+    self.assertEqual(len(self.collector.delivered), 100)
+
+  def test_connection_closed_by_the_server_is_replaced(self):
+    self.get(0)
+
+    # Connections the server drops, and their retry, fail the request the way APIImport.send_event
+    # expects to retry it, and leave the pool usable.
+    self.collector.reset_rate = 1
+    self.assertRaises(httplib.BadStatusLine, self.get, 1)
+    self.collector.reset_rate = 0
+
+    self.assertEqual(self.get(2), 200)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,60 @@
+from data.database import Database
+from main import dataset_file, open_cached_database, run
+from tests import generate_database, load_config, parse_args
+
+import logging
+import shutil
+import tempfile
+import unittest
+
+
+class DatabaseTest(unittest.TestCase):
+  def setUp(self):
+    self.config    = load_config()
+    self.directory = tempfile.mkdtemp()
+    self.args      = parse_args('-m', '-s', '--seed', '1', '--store', 'sqlite-file', '--cache-dir', self.directory)
+
+    logging.disable(logging.INFO)
+
+  def tearDown(self):
+    logging.disable(logging.NOTSET)
+    shutil.rmtree(self.directory)
+
+  def indexes(self, database):
+    return set(row[0] for row in database.engine.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+               if not row[0].startswith('sqlite_autoindex'))
+
+  def test_indexes_are_built_after_the_load(self):
+    database = generate_database(self.config, 'sqlite')
+
+    self.assertEqual(self.indexes(database), set())
+
+    database.finish_load()
+
+    self.assertEqual(self.indexes(database),
+                     set(index.name for table in database.metadata.sorted_tables for index in table.indexes))
+
+  def test_complete_database_file_is_reused(self):
+    self.assertIsNone(open_cached_database(self.args.config, self.config, self.args))
+
+    run(self.args)
+
+    database = open_cached_database(self.args.config, self.config, self.args)
+
+    self.assertIsNotNone(database)
+    self.assertTrue(database.is_complete())
+    self.assertEqual(database.queries()['api'].count_visitor_data(), 1022 + 1295)
+
+    self.args.seed = 2
+
+    self.assertIsNone(open_cached_database(self.args.config, self.config, self.args))
+
+  def test_incomplete_database_file_is_generated_again(self):
+    database = Database(self.config['experiment']['id'], dataset_file(self.args.config, self.config, self.args))
+    database.create_tables(self.config['segment_ids'])
+
+    self.assertIsNone(open_cached_database(self.args.config, self.config, self.args))
+
+
+if __name__ == '__main__':
+  unittest.main()
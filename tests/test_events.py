@@ -0,0 +1,97 @@
+from data.database import EventTable, VisitorTable
+from data.events import DistributedEventCollection
+from data.experiments import Experiment
+from data.sampling import RandomStreams, Sampler
+from main import create_database
+from tests import generate_database, load_config
+
+import unittest
+
+
+class AllocateTest(unittest.TestCase):
+  def setUp(self):
+    self.sampler = Sampler(RandomStreams(1).get('allocate'))
+
+  def test_parts_sum_to_the_count(self):
+    for count, size, concentration in [(0, 5, 1), (1, 5, 1), (83626, 4000, 1), (1000, 10, 0.1), (7, 1000, 50)]:
+      parts = self.sampler.allocate(count, size, concentration)
+
+      self.assertEqual(len(parts), size)
+      self.assertEqual(sum(parts), count)
+      self.assertTrue(min(parts) >= 0)
+
+  def test_no_parts(self):
+    self.assertEqual(self.sampler.allocate(10, 0), [])
+
+  def test_high_concentration_spreads_evenly(self):
+    parts = self.sampler.allocate(10000, 10, 10000)
+
+    self.assertTrue(max(parts) - min(parts) < 200)
+
+
+class EventWindowTest(unittest.TestCase):
+  """cs_ustream has about 55 repeats per converted visitor, averaging 12 hours apart, in a 2 day experiment."""
+  def setUp(self):
+    self.config   = load_config('cs_ustream.yaml')
+    self.database = generate_database(self.config, segments=False)
+
+    self.events = self.database.export_columns(EventTable, ['name', 'time', 'visitor_id'])
+
+  def test_events_are_within_the_experiment(self):
+    time     = Experiment(self.config, self.database).time
+    visitors = self.database.export_columns(VisitorTable, ['id', 'time'])
+    arrivals = dict(zip(visitors['id'], visitors['time']))
+
+    self.assertTrue(self.events['time'])
+
+    for visitor_id, event_time in zip(self.events['visitor_id'], self.events['time']):
+      self.assertTrue(arrivals[visitor_id] <= event_time <= time['stop'])
+      self.assertTrue(time['start'] <= arrivals[visitor_id])
+
+  def test_totals_are_met(self):
+    totals = {}
+
+    for name in self.events['name']:
+      totals[name] = totals.get(name, 0) + 1
+
+    for goal_name, goal_data in self.config['conversions'].iteritems():
+      self.assertEqual(totals.get(goal_name, 0), sum(counts['total'] for counts in goal_data['counts'].itervalues()))
+
+  def test_events_of_a_visitor_have_distinct_times(self):
+    keys = zip(self.events['visitor_id'], self.events['name'], self.events['time'])
+
+    self.assertEqual(len(set(keys)), len(keys))
+
+
+class RepeatTimesTest(unittest.TestCase):
+  def setUp(self):
+    config          = load_config()
+    self.collection = DistributedEventCollection(config, create_database(config))
+    self.stop       = self.collection.time['stop']
+
+  def repeat_times(self, event_time, count, hours):
+    delays = iter(hours if isinstance(hours, list) else [hours] * (count + 1))
+
+    return self.collection.get_repeat_times(event_time, count, delays.next)
+
+  def test_repeats_follow_their_delays(self):
+    start = self.collection.time['start']
+
+    self.assertEqual(self.repeat_times(start, 3, 0.01), [start + 36, start + 72, start + 108])
+
+  def test_repeats_are_a_second_apart(self):
+    start = self.collection.time['start']
+
+    self.assertEqual(self.repeat_times(start, 3, 0), [start + 1, start + 2, start + 3])
+    self.assertEqual(self.repeat_times(start, 3, -1), [start + 1, start + 2, start + 3])
+
+  def test_squeezed_repeats_are_a_second_apart(self):
+    self.assertEqual(self.repeat_times(self.stop - 100, 5, 1), [self.stop - 84, self.stop - 67, self.stop - 50,
+                                                                 self.stop - 34, self.stop - 17])
+    self.assertEqual(self.repeat_times(self.stop - 5, 5, 1), range(self.stop - 4, self.stop + 1))
+    # The whole chain is one long delay, so every repeat is squeezed onto the end of the experiment.
+    self.assertEqual(self.repeat_times(self.stop - 10, 4, [10, 0, 0, 0, 0]), range(self.stop - 3, self.stop + 1))
+
+
+if __name__ == '__main__':
+  unittest.main()
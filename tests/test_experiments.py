@@ -0,0 +1,40 @@
+from data.api import APIImport
+from data.experiments import Experiment, to_epoch
+from datetime import datetime
+from main import create_database
+from tests import generate_database, load_config
+
+import unittest
+
+
+class EpochTimeTest(unittest.TestCase):
+  def setUp(self):
+    self.config = load_config()
+
+  def test_to_epoch(self):
+    self.assertEqual(to_epoch(datetime(1970, 1, 1)), 0)
+    self.assertEqual(to_epoch(datetime(2015, 9, 15, 19, 40)), 1442346000)
+
+  def test_experiment_time_is_epoch_seconds(self):
+    time = Experiment(self.config, create_database(self.config)).time
+
+    self.assertEqual(time, {'start': 1442346000, 'stop': 1442346600, 'range': 600})
+
+  def test_stored_times_are_integers(self):
+    database = generate_database(self.config, 'sqlite', segments=False)
+
+    for table in ('visitor', 'event'):
+      types = database.engine.execute('SELECT DISTINCT typeof(time) FROM {}'.format(table)).fetchall()
+
+      self.assertEqual(types, [('integer',)])
+
+    first, last = database.engine.execute('SELECT min(time), max(time) FROM visitor').fetchone()
+
+    self.assertTrue(1442346000 <= first <= last < 1442346600)
+
+  def test_event_time_is_sent_unchanged(self):
+    self.assertEqual(APIImport.format_event_time(1442346000), 1442346000)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,86 @@
+from data.export import EventExporter
+
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def events(count):
+  return ({'u': 'visitor{}'.format(n), 'n': 'visitor_event', 'v': n} if n % 3 else {'u': 'visitor{}'.format(n), 'v': n}
+          for n in xrange(count))
+
+
+class EventExporterTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp(prefix='export-')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def export(self, count, **options):
+    exporter = EventExporter(self.directory, 'experiment', dict, ['n', 'u', 'v'], chunk_size=1000, batch_size=64,
+                             **options)
+    written  = exporter.export(events(count), 'visitors')
+
+    exporter.close()
+
+    self.assertEqual(written, count)
+    self.assertEqual(sorted(os.listdir(self.directory)), [os.path.basename(path) for path in exporter.files])
+
+    return exporter.files
+
+  def test_ndjson_chunks(self):
+    files = self.export(2500)
+
+    self.assertEqual([os.path.basename(path) for path in files],
+                     ['experiment-visitors-00000.ndjson', 'experiment-visitors-00001.ndjson',
+                      'experiment-visitors-00002.ndjson'])
+
+    exported = []
+
+    for path in files:
+      with open(path) as lines:
+        exported.append([json.loads(line) for line in lines])
+
+    self.assertEqual([len(chunk) for chunk in exported], [1000, 1000, 500])
+    self.assertEqual(sum(exported, []), list(events(2500)))
+
+  def test_csv_has_a_header_per_file(self):
+    files = self.export(1500, format='csv')
+
+    exported = []
+
+    for path in files:
+      with open(path) as lines:
+        self.assertEqual(lines.readline(), 'n,u,v\n')
+        exported.extend(csv.DictReader(lines, ['n', 'u', 'v']))
+
+    self.assertEqual(exported, [{'n': event.get('n', ''), 'u': event['u'], 'v': str(event['v'])}
+                                for event in events(1500)])
+
+  def test_gzip(self):
+    files = self.export(1200, compress=True)
+
+    self.assertTrue(files[0].endswith('.ndjson.gz'))
+
+    exported = []
+
+    for path in files:
+      with gzip.open(path) as lines:
+        exported.extend(json.loads(line) for line in lines)
+
+    self.assertEqual(exported, list(events(1200)))
+
+  def test_no_events_no_files(self):
+    self.assertEqual(self.export(0), [])
+
+  def test_unknown_format(self):
+    self.assertRaises(ValueError, EventExporter, self.directory, 'experiment', dict, [], format='xml')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,145 @@
+from data.api import APIImport
+from data.collector import EventCollector
+from data.connections import ConnectionPool
+from data.journal import SendJournal
+from data.query import APIQuery
+from main import run, send_events
+from tests import load_config, parse_args
+
+import eventlet
+import logging
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+
+class InterruptedSend(object):
+  """Stands in for a database whose visitor query is interrupted, like Ctrl-C, after its rows."""
+  def __init__(self, rows):
+    self.rows = rows
+
+  def queries(self):
+    return {'api': self}
+
+  def count_visitor_data(self):
+    return len(self.rows)
+
+  def query_visitor_data(self, segment_ids):
+    for row in self.rows:
+      yield row
+
+    raise KeyboardInterrupt()
+
+
+class SendJournalTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path      = os.path.join(self.directory, 'send.journal')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_resume_skips_acknowledged_events(self):
+    journal = SendJournal(self.path)
+    journal.record('oeu1|register|1442346000')
+    journal.record('oeu2|register|1442346001')
+    journal.close()
+
+    resumed = SendJournal(self.path, resume=True)
+
+    self.assertIn('oeu1|register|1442346000', resumed)
+    self.assertIn('oeu2|register|1442346001', resumed)
+    self.assertNotIn('oeu3|register|1442346002', resumed)
+
+    resumed.close()
+
+    self.assertNotIn('oeu1|register|1442346000', SendJournal(self.path))
+
+  def test_partial_record_is_dropped(self):
+    journal = SendJournal(self.path)
+    journal.record('oeu1|register|1442346000')
+    journal.close()
+
+    with open(self.path, 'ab') as partial:
+      partial.write('abc')
+
+    resumed = SendJournal(self.path, resume=True)
+
+    self.assertEqual(len(resumed.acknowledged), 1)
+    self.assertEqual(os.path.getsize(self.path), SendJournal.record_size)
+
+    resumed.close()
+
+  def test_interrupted_send_flushes_the_journal(self):
+    collector = EventCollector()
+    address   = collector.listen()
+    server    = eventlet.spawn(collector.serve)
+    url_base  = APIImport.url_base
+    stdout    = sys.stdout
+
+    config  = load_config()
+    columns = APIQuery.event_columns(config['segment_ids'])
+    rows    = [tuple({'u': visitor_id, 'variation_id': config['variation_ids'][0], 'x': config['experiment']['id'],
+                      't': 1442346000 + visitor_id, 'n': 'register', 'g': config['experiment']['id'], 'v': 0}.get(
+                        column, 'false') for column in columns)
+               for visitor_id in xrange(1, 101)]
+
+    journal = SendJournal(self.path)
+
+    APIImport.url_base = 'http://{}:{}{}'.format(address[0], address[1], EventCollector.event_path)
+    sys.stdout         = StringIO.StringIO()
+
+    try:
+      with self.assertRaises(KeyboardInterrupt):
+        send_events(config, InterruptedSend(rows), ConnectionPool(size=5), journal,
+                    {'concurrency': 5, 'dead_letter': os.path.join(self.directory, 'dead.ndjson')})
+    finally:
+      # Let the sends in flight at the interrupt settle before the collector and the directory go.
+      eventlet.sleep(0.2)
+
+      APIImport.url_base = url_base
+      sys.stdout         = stdout
+      server.kill()
+
+    resumed = SendJournal(self.path, resume=True)
+
+    # Acknowledgements are buffered far longer than this send takes, so they only reach the file on close.
+    # Events in flight at the interrupt may reach the collector without being acknowledged.
+    self.assertTrue(0 < len(resumed.acknowledged) <= len(collector.delivered))
+
+    resumed.close()
+
+
+class ResumeTest(unittest.TestCase):
+  """Resuming must send the events of the interrupted run, so their data must come out the same."""
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+    logging.disable(logging.INFO)
+
+  def tearDown(self):
+    logging.disable(logging.NOTSET)
+    shutil.rmtree(self.directory)
+
+  def args(self, *options):
+    return parse_args('-m', '--cache-dir', self.directory, *options)
+
+  def test_resume_without_seed_is_refused(self):
+    self.assertRaises(ValueError, run, self.args('--resume'))
+    self.assertRaises(ValueError, run, self.args('--resume', '--store', 'sqlite-file'))
+
+  def test_resume_with_seed(self):
+    self.assertEqual(len(run(self.args('--resume', '--seed', '1'))['stages']), 3)
+
+  def test_resume_from_cached_database(self):
+    run(self.args('--store', 'sqlite-file'))
+
+    self.assertEqual(run(self.args('--resume', '--store', 'sqlite-file'))['stages'], [])
+    self.assertRaises(ValueError, run, self.args('--resume', '--store', 'sqlite-file', '--rebuild'))
+
+
+if __name__ == '__main__':
+  unittest.main()
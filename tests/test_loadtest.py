@@ -0,0 +1,43 @@
+from loadtest import count_unretried
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class CountUnretriedTest(unittest.TestCase):
+  def setUp(self):
+    self.directory   = tempfile.mkdtemp()
+    self.dead_letter = os.path.join(self.directory, 'dead.ndjson')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def write(self, *records):
+    with open(self.dead_letter, 'w') as dead_letter:
+      for attempts, error in records:
+        dead_letter.write(json.dumps({'attempts': attempts, 'error': error, 'event': ['path', 'identity']}) + '\n')
+
+  def test_no_dead_letters(self):
+    self.assertEqual(count_unretried(self.dead_letter, 5, []), 0)
+
+  def test_dead_letters_after_every_retry(self):
+    self.write((6, 'HTTP 503'), (6, "BadStatusLine('No status line received',)"))
+
+    self.assertEqual(count_unretried(self.dead_letter, 5, [(503, 0.02)]), 0)
+
+  def test_reset_dead_lettered_without_retries(self):
+    self.write((1, "BadStatusLine('No status line received',)"), (6, 'HTTP 503'))
+
+    self.assertEqual(count_unretried(self.dead_letter, 5, [(503, 0.02)]), 1)
+
+  def test_statuses_that_cant_be_retried(self):
+    self.write((1, 'HTTP 400'), (1, 'HTTP 429'), (1, 'HTTP 503'))
+
+    self.assertEqual(count_unretried(self.dead_letter, 5, [(400, 0.01), (429, 0.01), (503, 0.01)]), 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
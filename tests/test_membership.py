@@ -0,0 +1,46 @@
+from data.database import SegmentTable
+from data.membership import MembershipIndex
+from tests import generate_database, load_config
+
+import unittest
+
+
+class MembershipIndexTest(unittest.TestCase):
+  def setUp(self):
+    self.index = MembershipIndex()
+    self.index.add_variation(1, [101, 102, 103, 104, 105])
+    self.index.add_variation(2, [201, 202])
+
+  def test_segments(self):
+    self.index.add_segment(7, 1, [102, 104])
+    self.index.add_segment(7, 1, [105])
+
+    self.assertEqual(self.index.visitor_ids(1, self.index.with_segment(7, 1)), [102, 104, 105])
+    self.assertEqual(self.index.visitor_ids(1, self.index.without_segment(7, 1)), [101, 103])
+    self.assertEqual(self.index.visitor_ids(2, self.index.without_segment(7, 2)), [201, 202])
+    self.assertEqual(self.index.count(self.index.with_segment(7, 1)), 3)
+
+  def test_conversions(self):
+    self.index.add_conversions(1, [11, 12], [101, 103])
+    self.index.add_conversions(1, [12], [104])
+
+    self.assertEqual(self.index.visitor_ids(1, self.index.converted(11, 1)), [101, 103])
+    self.assertEqual(self.index.visitor_ids(1, self.index.converted(12, 1)), [101, 103, 104])
+    self.assertEqual(self.index.visitor_ids(1, self.index.everyone(1) & ~self.index.with_events(1)), [102, 105])
+    self.assertEqual(self.index.converted(11, 2), 0)
+
+
+class SegmentAssignmentTest(unittest.TestCase):
+  def test_one_value_per_visitor_and_segment(self):
+    config   = load_config()
+    database = generate_database(config)
+
+    segments = database.export_columns(SegmentTable, ['visitor_id', 'gae_id'])
+    pairs    = zip(segments['visitor_id'], segments['gae_id'])
+
+    self.assertTrue(pairs)
+    self.assertEqual(len(pairs), len(set(pairs)))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,42 @@
+from data.metrics import metrics
+from tests import generate_database, load_config
+
+import unittest
+
+
+class QueryMetricsTest(unittest.TestCase):
+  def setUp(self):
+    self.config   = load_config()
+    self.database = generate_database(self.config, 'sqlite', multiple_conversions=False, segments=False)
+    self.database.finish_load()
+
+    metrics.reset()
+
+  def tearDown(self):
+    metrics.reset()
+
+  def queries(self, name):
+    return [dict(labels)['query'] for (metric, labels) in getattr(metrics, name) if metric.startswith('query')]
+
+  def test_queries_are_labelled_by_their_method(self):
+    api_query = self.database.queries()['api']
+    rows      = list(api_query.query_visitor_data(self.config['segment_ids']))
+
+    api_query.count_visitor_data()
+
+    self.assertEqual(sorted(self.queries('timings')), ['count_visitor_data', 'query_visitor_data'])
+    self.assertEqual(metrics.counters[('query_rows', (('query', 'query_visitor_data'),))], len(rows))
+
+  def test_label_is_the_name_passed(self):
+    query = self.database.queries()['visitor']
+
+    # From a lambda, whose frame names no query method.
+    run = lambda: query.execute(['SELECT 1'], 'custom')
+    run()
+
+    self.assertEqual(self.queries('timings'), ['custom'])
+    self.assertEqual(self.queries('counters'), ['custom'])
+
+
+if __name__ == '__main__':
+  unittest.main()
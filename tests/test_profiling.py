@@ -0,0 +1,74 @@
+from data.profiling import StageProfiler, profiler
+from main import create_database, create_visitors, run_stage
+from tests import load_config
+
+import logging
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+
+class Leaf(object):
+  pass
+
+
+def grow_leaves(count):
+  return [Leaf() for _ in xrange(count)]
+
+
+class StageProfilerTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp(prefix='profile-')
+    self.profiler  = StageProfiler()
+
+    logging.disable(logging.INFO)
+
+  def tearDown(self):
+    logging.disable(logging.NOTSET)
+    shutil.rmtree(self.directory)
+
+  def test_disabled_profiler_writes_nothing(self):
+    with self.profiler.profile('visitors'):
+      grow_leaves(10)
+
+    self.assertEqual(os.listdir(self.directory), [])
+
+  def test_stage_profile_and_summary(self):
+    self.profiler.enable(self.directory, 'experiment', top=10)
+
+    with self.profiler.profile('leaves'):
+      leaves = grow_leaves(5000)
+
+    path      = os.path.join(self.directory, 'experiment-leaves')
+    functions = [function for _, _, function in pstats.Stats(path + '.prof').stats]
+
+    self.assertIn('grow_leaves', functions)
+
+    with open(path + '.txt') as summary:
+      text = summary.read()
+
+    self.assertIn('Functions of this project, by cumulative time:', text)
+    self.assertIn('All functions, by own time:', text)
+    self.assertRegexpMatches(text, r'\s+5000  Leaf\n')
+    self.assertEqual(len(leaves), 5000)
+
+  def test_every_stage_gets_its_own_files(self):
+    config   = load_config()
+    database = create_database(config)
+    label    = config['experiment']['id']
+
+    profiler.enable(self.directory, label)
+
+    try:
+      run_stage({'stages': []}, 'visitors', create_visitors, config, database, 500)
+    finally:
+      profiler.disable()
+
+    self.assertEqual(sorted(os.listdir(self.directory)),
+                     ['{}-visitors.prof'.format(label), '{}-visitors.txt'.format(label)])
+
+
+if __name__ == '__main__':
+  unittest.main()
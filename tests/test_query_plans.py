@@ -0,0 +1,25 @@
+from data.plans import QueryPlanError, check_query_plans
+from tests import generate_database, load_config
+
+import unittest
+
+
+class QueryPlanTest(unittest.TestCase):
+  """Every query of the pipeline must search the SQLite store by index, see plans.ALLOWED_SCANS."""
+  def setUp(self):
+    self.config   = load_config()
+    self.database = generate_database(self.config, 'sqlite')
+    self.database.finish_load()
+
+  def test_no_full_scans(self):
+    check_query_plans(self.database, self.config)
+
+  def test_missing_index_fails(self):
+    self.database.engine.execute('DROP INDEX ix_visitor_variation')
+
+    with self.assertRaises(QueryPlanError):
+      check_query_plans(self.database, self.config)
+
+
+if __name__ == '__main__':
+  unittest.main()
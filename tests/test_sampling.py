@@ -0,0 +1,101 @@
+from data.sampling import RandomStreams, Sampler, get_distribution
+from data.shards import SHARD_COLUMNS
+from main import create_database, generate, generate_sharded
+from tests import load_config, parse_args
+
+import logging
+import unittest
+
+
+class RandomStreamsTest(unittest.TestCase):
+  def draws(self, stream, count=5):
+    return [stream.random() for _ in xrange(count)]
+
+  def test_same_seed_and_key_give_the_same_draws(self):
+    self.assertEqual(self.draws(RandomStreams(7).get('baseline', 'purchase', 1)),
+                     self.draws(RandomStreams(7).get('baseline', 'purchase', 1)))
+
+  def test_streams_are_independent(self):
+    streams = RandomStreams(7)
+    first   = self.draws(streams.get('baseline', 'purchase', 1))
+
+    # Drawing from other keys in between doesn't move a stream.
+    self.draws(streams.get('baseline', 'purchase', 2), 100)
+
+    self.assertEqual(self.draws(streams.get('baseline', 'purchase', 1)), first)
+    self.assertNotEqual(self.draws(streams.get('baseline', 'purchase', 2)), first)
+    self.assertNotEqual(self.draws(RandomStreams(8).get('baseline', 'purchase', 1)), first)
+
+
+class SeededGenerationTest(unittest.TestCase):
+  def setUp(self):
+    self.config = load_config()
+    self.args   = parse_args('-m', '-s', '--seed', '3', '--batch-size', '200')
+
+    logging.disable(logging.INFO)
+
+  def tearDown(self):
+    logging.disable(logging.NOTSET)
+
+  def generated(self, jobs=1):
+    database = create_database(self.config)
+
+    self.args.jobs = jobs
+
+    if jobs > 1:
+      generate_sharded(self.config, database, self.args, {'stages': []})
+    else:
+      generate(self.config, database, self.args, {'stages': []})
+
+    return [(table.__tablename__, sorted(zip(*[database.export_columns(table, names)[name] for name in names])))
+            for table, names in SHARD_COLUMNS]
+
+  def test_same_seed_generates_the_same_data(self):
+    self.assertEqual(self.generated(), self.generated())
+
+  def test_sharded_generation_matches(self):
+    self.assertEqual(self.generated(jobs=2), self.generated())
+
+  def test_batch_size_doesnt_change_the_data(self):
+    generated = self.generated()
+
+    self.args.batch_size = 7
+
+    self.assertEqual(self.generated(), generated)
+
+
+class SamplerTest(unittest.TestCase):
+  def test_sample_is_a_distinct_subset(self):
+    sample = Sampler(RandomStreams(1).get('test')).sample(xrange(100, 200), 30)
+
+    self.assertEqual(len(sample), 30)
+    self.assertEqual(len(set(sample)), 30)
+    self.assertTrue(all(100 <= item < 200 for item in sample))
+
+  def test_sample_is_capped_at_the_population(self):
+    self.assertEqual(sorted(Sampler(RandomStreams(1).get('test')).sample([3, 1, 2], 10)), [1, 2, 3])
+
+
+class DistributionTest(unittest.TestCase):
+  def test_draws_are_those_of_the_rng_method(self):
+    draw = get_distribution(RandomStreams(1).get('revenue'), {'distribution': 'lognormal', 'mu': 3, 'sigma': 0.5})
+    rng  = RandomStreams(1).get('revenue')
+
+    self.assertEqual([draw() for _ in xrange(10)], [rng.lognormvariate(3, 0.5) for _ in xrange(10)])
+
+  def test_gamma_by_default(self):
+    draw = get_distribution(RandomStreams(1).get('revenue'), {'alpha': 4, 'beta': 100})
+    rng  = RandomStreams(1).get('revenue')
+
+    self.assertEqual(draw(), rng.gammavariate(4, 100))
+
+  def test_bad_parameters(self):
+    with self.assertRaises(ValueError):
+      get_distribution(RandomStreams(1).get('revenue'), {'distribution': 'pareto', 'alpha': 1})
+
+    with self.assertRaises(ValueError):
+      get_distribution(RandomStreams(1).get('revenue'), {'distribution': 'normal', 'mu': 1})
+
+
+if __name__ == '__main__':
+  unittest.main()
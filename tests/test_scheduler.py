@@ -0,0 +1,95 @@
+from data.scheduler import SendError, SendScheduler
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class SendSchedulerTest(unittest.TestCase):
+  def setUp(self):
+    self.directory   = tempfile.mkdtemp()
+    self.dead_letter = os.path.join(self.directory, 'dead.ndjson')
+    self.attempts    = {}
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def scheduler(self, send, **options):
+    return SendScheduler(send, backoff=0.001, max_backoff=0.01, dead_letter=self.dead_letter, **options)
+
+  def dead_letters(self):
+    if not os.path.exists(self.dead_letter):
+      return []
+
+    with open(self.dead_letter) as dead_letter:
+      return [json.loads(line) for line in dead_letter]
+
+  def dead_events(self):
+    return [dead_letter['event'] for dead_letter in self.dead_letters()]
+
+  def fail_first(self, failures, retry=True):
+    """send that fails each event the given number of times before it succeeds."""
+    def send(event):
+      self.attempts[event] = self.attempts.get(event, 0) + 1
+
+      if self.attempts[event] <= failures:
+        raise SendError('HTTP 503', retry=retry)
+
+    return send
+
+  def test_retries_until_success(self):
+    scheduler = self.scheduler(self.fail_first(2), retries=5)
+
+    for event in xrange(20):
+      scheduler.submit(event)
+
+    scheduler.drain()
+
+    self.assertEqual(scheduler.stats['succeeded'], 20)
+    self.assertEqual(scheduler.stats['retried'], 40)
+    self.assertEqual(scheduler.stats['dead'], 0)
+    self.assertEqual(self.dead_events(), [])
+
+  def test_dead_letter_after_retries(self):
+    scheduler = self.scheduler(self.fail_first(10), retries=3)
+
+    for event in xrange(5):
+      scheduler.submit(event)
+
+    scheduler.drain()
+
+    self.assertEqual(scheduler.stats['succeeded'], 0)
+    self.assertEqual(scheduler.stats['dead'], 5)
+    self.assertEqual(sorted(self.dead_events()), range(5))
+    self.assertEqual(set(self.attempts.values()), set([4]))
+    self.assertEqual(set((x['attempts'], x['error']) for x in self.dead_letters()), set([(4, 'HTTP 503')]))
+
+  def test_errors_that_cant_be_retried_go_straight_to_dead_letter(self):
+    scheduler = self.scheduler(self.fail_first(1, retry=False), retries=5)
+
+    scheduler.submit('event')
+    scheduler.drain()
+
+    self.assertEqual(scheduler.stats['retried'], 0)
+    self.assertEqual(self.dead_letters(), [{'attempts': 1, 'error': 'HTTP 503', 'event': 'event'}])
+    self.assertEqual(self.attempts, {'event': 1})
+
+  def test_concurrency_halves_on_errors_and_grows_on_success(self):
+    scheduler = self.scheduler(self.fail_first(0), concurrency=8, max_concurrency=10)
+
+    scheduler.decrease()
+    self.assertEqual(scheduler.concurrency, 4)
+
+    scheduler.on_success(0.01)
+    self.assertEqual(scheduler.concurrency, 4.25)
+
+    for _ in xrange(100):
+      scheduler.on_success(0.01)
+
+    self.assertEqual(scheduler.concurrency, 10)
+
+
+if __name__ == '__main__':
+  unittest.main()
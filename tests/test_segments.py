@@ -0,0 +1,52 @@
+from data.database import SegmentTable
+from main import create_database
+from tests import generate_database, load_config
+
+import sqlite3
+import unittest
+
+
+class VisitorSegmentTest(unittest.TestCase):
+  def setUp(self):
+    self.config = load_config()
+
+  def send_rows(self, store):
+    database = generate_database(self.config, store)
+    database.finish_load()
+
+    api_query = database.queries()['api']
+
+    return (list(api_query.query_visitor_data(self.config['segment_ids'])) +
+            list(api_query.query_conversion_data(self.config['segment_ids'])))
+
+  def test_sqlite_sends_what_columnar_sends(self):
+    self.assertEqual([tuple(row) for row in self.send_rows('sqlite')], self.send_rows('columnar'))
+
+  def count(self, database, table):
+    return database.engine.execute('SELECT COUNT(*) FROM {}'.format(table)).scalar()
+
+  def test_segment_insert_is_one_transaction(self):
+    database   = create_database(self.config, 'sqlite')
+    segment_id = self.config['segment_ids'][0]
+
+    # The wide table update fails after the segment rows are written, which must take them down with it.
+    database.engine.execute('''CREATE TRIGGER fail_update BEFORE UPDATE ON visitor_segment
+                               BEGIN SELECT RAISE(ABORT, 'update failed'); END''')
+
+    with self.assertRaises(sqlite3.DatabaseError):
+      database.insert(SegmentTable, {'visitor_id': [1, 2], 'gae_id': [segment_id] * 2, 'value': ['ff', 'ie']})
+
+    self.assertEqual(self.count(database, 'segment'), 0)
+    self.assertEqual(self.count(database, 'visitor_segment'), 0)
+
+  def test_unknown_segment_fails(self):
+    database = create_database(self.config, 'sqlite')
+
+    with self.assertRaises(ValueError):
+      database.insert(SegmentTable, {'visitor_id': [1], 'gae_id': [404], 'value': ['ff']})
+
+    self.assertEqual(self.count(database, 'segment'), 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
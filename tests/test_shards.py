@@ -0,0 +1,56 @@
+from data.database import VisitorTable
+from data.shards import export_shard, merge_shard, shard_config
+from main import create_database
+from tests import generate_database, load_config
+
+import copy
+import unittest
+
+
+class ShardConfigTest(unittest.TestCase):
+  def setUp(self):
+    self.config = load_config('retail.yaml')
+
+  def test_shard_keeps_one_variation(self):
+    variation_id = self.config['variation_ids'][1]
+    shard        = shard_config(self.config, variation_id)
+
+    self.assertEqual(shard['variation_ids'], [variation_id])
+    self.assertEqual(shard['visitors'], {variation_id: self.config['visitors'][variation_id]})
+
+    for name, goal_data in shard['conversions'].iteritems():
+      self.assertEqual(goal_data['counts'], {variation_id: self.config['conversions'][name]['counts'][variation_id]})
+
+    for segment_distribution in shard['segments']['manual'].itervalues():
+      for variation_distribution in segment_distribution.itervalues():
+        self.assertEqual(variation_distribution.keys(), [variation_id])
+
+  def test_config_is_left_unchanged(self):
+    original = copy.deepcopy(self.config)
+
+    for variation_id in self.config['variation_ids']:
+      shard_config(self.config, variation_id)
+
+    self.assertEqual(self.config, original)
+
+
+class MergeShardTest(unittest.TestCase):
+  def test_merged_shards_hold_every_variation(self):
+    config   = load_config()
+    database = create_database(config)
+    rows     = 0
+
+    for variation_id in config['variation_ids']:
+      shard = shard_config(config, variation_id)
+      rows += merge_shard(database, export_shard(generate_database(shard)))
+
+    visitors = database.export_columns(VisitorTable, ['variation'])
+
+    self.assertEqual(sorted(set(visitors['variation'])), sorted(config['variation_ids']))
+    self.assertEqual(len(visitors['variation']),
+                     sum(config['visitors'][x]['total'] - 1 for x in config['variation_ids']))
+    self.assertTrue(rows > len(visitors['variation']))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,53 @@
+from tests import generate_database, load_config
+
+import unittest
+
+
+class ColumnarStoreTest(unittest.TestCase):
+  """The columnar store must answer every generation query the way SQLite does."""
+  def setUp(self):
+    self.config  = load_config()
+    self.queries = {}
+
+    for store in ('columnar', 'sqlite'):
+      database = generate_database(self.config, store)
+      database.finish_load()
+
+      self.queries[store] = database.queries()
+
+  def assertSameAnswer(self, kind, name, *args, **options):
+    normalize = options.get('normalize', lambda result: result)
+    answers   = [normalize(getattr(self.queries[store][kind], name)(*args)) for store in ('columnar', 'sqlite')]
+
+    self.assertEqual(answers[0], answers[1], name)
+
+  def test_visitor_queries(self):
+    rows = lambda result: sorted(tuple(dict(row).items()) for row in result)
+
+    self.assertSameAnswer('visitor', 'query_variation_ids', normalize=sorted)
+    self.assertSameAnswer('visitor', 'query_visitor_count_for_variation', normalize=rows)
+
+    for variation_id in self.config['variation_ids']:
+      self.assertSameAnswer('visitor', 'query_visitor_count', variation_id)
+      self.assertSameAnswer('visitor', 'query_variation_visitor_ids', variation_id, normalize=list)
+
+      for goal_name in self.config['conversions']:
+        self.assertSameAnswer('visitor', 'query_converted_visitors', goal_name, variation_id, normalize=rows)
+
+  def test_event_and_segment_queries(self):
+    self.assertSameAnswer('event', 'query_event_names', normalize=lambda result: sorted(row['name'] for row in result))
+    self.assertSameAnswer('segment', 'query_segment_ids', normalize=sorted)
+
+    for variation_id in self.config['variation_ids']:
+      self.assertSameAnswer('event', 'query_event_goals', variation_id, normalize=sorted)
+
+      for segment_id in self.config['segment_ids']:
+        self.assertSameAnswer('segment', 'query_segment_count_for_variation', variation_id, segment_id)
+
+  def test_counts(self):
+    self.assertSameAnswer('api', 'count_visitor_data')
+    self.assertSameAnswer('api', 'count_conversion_data')
+
+
+if __name__ == '__main__':
+  unittest.main()
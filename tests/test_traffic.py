@@ -0,0 +1,67 @@
+from data.traffic import ArrivalCurve
+
+import unittest
+
+
+# Monday 2015-09-14 00:00 UTC, and one week later.
+START = 1442188800
+STOP  = START + 7 * 86400
+
+
+class ArrivalCurveTest(unittest.TestCase):
+  def hours(self, curve, total):
+    """Visitors per hour of the experiment."""
+    counts = [0] * ((STOP - START) // 3600)
+
+    for offset in curve.get_offsets(total, xrange(1, total + 1)):
+      counts[offset // 3600] += 1
+
+    return counts
+
+  def test_flat_traffic_spreads_evenly(self):
+    counts = self.hours(ArrivalCurve({}, START, STOP), 168 * 100)
+
+    self.assertEqual(set(counts), set([100]))
+
+  def test_daily_weights(self):
+    daily  = [0] * 6 + [1] * 12 + [2] * 6
+    counts = self.hours(ArrivalCurve({'daily': daily}, START, STOP), 7 * 2400)
+
+    for hour, count in enumerate(counts):
+      self.assertEqual(count, daily[hour % 24] * 100)
+
+  def test_weekly_weights_and_utc_offset(self):
+    weekly = [1, 1, 1, 1, 1, 0, 0]
+    curve  = ArrivalCurve({'weekly': weekly, 'utc_offset': -5}, START, STOP)
+    counts = self.hours(curve, 5 * 2400)
+
+    # At UTC-5 the first 5 hours are still Sunday, and Friday ends 125 hours in.
+    self.assertEqual(counts[5:5 + 120], [100] * 120)
+    self.assertEqual(sum(counts[:5]) + sum(counts[125:]), 0)
+
+  def test_offsets_are_increasing_and_inside_the_experiment(self):
+    curve   = ArrivalCurve({'ramp_up_hours': 48, 'launch': {'boost': 3, 'decay_hours': 6}}, START, STOP)
+    offsets = curve.get_offsets(10007, xrange(1, 10008))
+
+    self.assertEqual(offsets, sorted(offsets))
+    self.assertTrue(0 <= offsets[0] and offsets[-1] < STOP - START)
+
+  def test_batches_match_a_single_call(self):
+    curve   = ArrivalCurve({'daily': range(24), 'launch': {'boost': 1}}, START, STOP)
+    offsets = curve.get_offsets(10007, xrange(1, 10008))
+    batches = []
+
+    for first in xrange(1, 10008, 997):
+      batches.extend(curve.get_offsets(10007, xrange(first, min(first + 997, 10008))))
+
+    self.assertEqual(batches, offsets)
+
+  def test_invalid_traffic(self):
+    self.assertRaises(ValueError, ArrivalCurve, {'daily': [1] * 23}, START, STOP)
+    self.assertRaises(ValueError, ArrivalCurve, {'weekly': [1] * 8}, START, STOP)
+    self.assertRaises(ValueError, ArrivalCurve, {'daily': [-1] * 24}, START, STOP)
+    self.assertRaises(ValueError, ArrivalCurve, {'daily': [0] * 24}, START, STOP)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,50 @@
+from data.database import Database, VisitorTable
+from data.experiments import to_epoch
+from data.visitors import VisitorCollection
+from datetime import datetime, timedelta
+from tests import load_config
+
+import unittest
+
+
+class VisitorCollectionTest(unittest.TestCase):
+  def setUp(self):
+    self.config   = load_config()
+    self.database = Database('test')
+    self.database.create_tables()
+
+  def test_column_insert_matches_row_insert(self):
+    visitors = VisitorCollection(self.config, self.database)
+    columns  = {}
+
+    for batch in visitors.generate(batch_size=500):
+      self.database.insert(VisitorTable, batch)
+
+      for name, values in batch.iteritems():
+        columns.setdefault(name, []).extend(values)
+
+    rows  = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    other = Database('rows')
+    other.create_tables()
+    other.engine.execute(VisitorTable.__table__.insert(), rows)
+
+    select = 'SELECT id, number, experiment_id, time, variation FROM visitor ORDER BY id'
+
+    self.assertEqual(self.database.engine.execute(select).fetchall(), other.engine.execute(select).fetchall())
+    self.assertEqual(len(rows), sum(visitors.visitors[x]['total'] - 1 for x in visitors.variation_ids))
+
+  def test_offsets_round_like_timedelta(self):
+    visitors = VisitorCollection(self.config, self.database)
+    start    = datetime.utcfromtimestamp(visitors.time['start'])
+    total    = 1023
+    numbers  = xrange(1, total)
+    step     = visitors.time['range'] / float(total)
+
+    expected = [to_epoch((start + timedelta(seconds=step * (number - 1))).replace(microsecond=0)) - visitors.time['start']
+                for number in numbers]
+
+    self.assertEqual(visitors.get_visitor_offsets(total, numbers), expected)
+
+
+if __name__ == '__main__':
+  unittest.main()